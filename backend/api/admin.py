@@ -1,6 +1,45 @@
 from django.contrib.auth.admin import UserAdmin
 from django.contrib import admin
-from .models import User, Category, Subscription, Plan, UserPlan
+from django.core.paginator import Paginator
+from django.db.models import Max
+from django.utils.functional import cached_property
+from .models import (
+    User,
+    Category,
+    Subscription,
+    SubscriptionAlias,
+    Plan,
+    UserPlan,
+    CronRunReport,
+    NotificationEvent,
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Estimates the row count of unfiltered changelists on large tables from the highest
+    id (an index lookup) instead of counting every row. Filtered lists are counted exactly.
+    """
+
+    threshold = 10000  # rows below which counting is cheap enough
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = queryset.model._default_manager.using(queryset.db).aggregate(
+                max_id=Max("pk")
+            )["max_id"]
+            if estimate is not None and estimate > self.threshold:
+                return estimate
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Base for tables that grow with the number of users"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False  # Skips a second, unfiltered count
 
 
 class CustomUserAdmin(UserAdmin):
@@ -45,6 +84,76 @@ class CustomUserAdmin(UserAdmin):
 admin.site.register(User, CustomUserAdmin)
 
 admin.site.register(Category)
-admin.site.register(Subscription)
-admin.site.register(Plan)
-admin.site.register(UserPlan)
+
+
+class SubscriptionAliasInline(admin.TabularInline):
+    model = SubscriptionAlias
+    extra = 1
+
+
+class SubscriptionAdmin(LargeTableAdmin):
+    list_display = ["name", "category"]
+    list_select_related = ["category"]
+    list_filter = ["category"]
+    search_fields = ["^name"]  # Prefix searches can use the name index
+    inlines = [SubscriptionAliasInline]
+
+
+admin.site.register(Subscription, SubscriptionAdmin)
+
+
+class PlanAdmin(LargeTableAdmin):
+    list_display = ["name", "subscription", "cost", "period", "free_trial"]
+    list_select_related = ["subscription"]
+    list_filter = ["period", "free_trial"]
+    search_fields = ["^subscription__name"]
+    autocomplete_fields = ["subscription"]
+
+    def get_queryset(self, request):
+        # Plan.__str__ shows the subscription, e.g. in UserPlan's plan autocomplete
+        return super().get_queryset(request).select_related("subscription")
+
+
+admin.site.register(Plan, PlanAdmin)
+
+
+class UserPlanAdmin(LargeTableAdmin):
+    list_display = ["user", "plan", "payment_date", "track_usage", "usage_score"]
+    list_select_related = ["user", "plan__subscription"]
+    list_filter = ["track_usage"]
+    search_fields = ["=user__username", "^plan__subscription__name"]
+    date_hierarchy = "payment_date"
+    raw_id_fields = ["user"]
+    autocomplete_fields = ["plan"]
+    ordering = ["-pk"]  # The default plan name ordering sorts the whole table
+
+
+admin.site.register(UserPlan, UserPlanAdmin)
+
+
+class CronRunReportAdmin(admin.ModelAdmin):
+    list_display = [
+        "kind",
+        "started_at",
+        "wall_seconds",
+        "cpu_seconds",
+        "users",
+        "plans",
+        "failed_users",
+        "peak_memory_kb",
+    ]
+    list_filter = ["kind"]
+
+
+admin.site.register(CronRunReport, CronRunReportAdmin)
+
+
+class NotificationEventAdmin(LargeTableAdmin):
+    list_display = ["user", "kind", "status", "attempts", "next_attempt_at", "sent_at"]
+    list_select_related = ["user"]
+    list_filter = ["status", "kind"]
+    date_hierarchy = "created_at"
+    raw_id_fields = ["user"]
+
+
+admin.site.register(NotificationEvent, NotificationEventAdmin)
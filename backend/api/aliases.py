@@ -0,0 +1,142 @@
+"""
+Maps RescueTime activity names to subscriptions. All aliases are compiled into one index
+(exact names in a dict, substrings in a single regex alternation), so matching is a single
+pass over each user's activities.
+
+Rather than being built at the start of each cron run, the index is shared by the process
+(get_index()): a run's chunks may be spread over several workers, and building it per
+chunk would repeat the work. It is rebuilt when aliases or subscriptions change (signals,
+within this process) or after ALIAS_INDEX_TTL seconds (changes made by other processes).
+"""
+
+import logging
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from .models import Subscription, SubscriptionAlias
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 300  # seconds an index is reused before being rebuilt
+MAX_CACHED_MATCHES = 100_000  # activities whose matches an index remembers
+
+
+def normalize(activity):
+    return activity.strip().lower()
+
+
+class AliasIndex:
+    def __init__(self, subscriptions, aliases):
+        """
+        `subscriptions` are (id, name) pairs, each matching its own name exactly,
+        and `aliases` are (subscription id, pattern, match type) triples. Invalid regex
+        patterns (saved without SubscriptionAlias.clean()) are logged and skipped.
+        """
+        self.exact = defaultdict(set)
+        contains = defaultdict(set)
+        self.regexes = []
+
+        for subscription_id, name in subscriptions:
+            self.exact[normalize(name)].add(subscription_id)
+
+        for subscription_id, pattern, match_type in aliases:
+            if match_type == SubscriptionAlias.MatchType.REGEX:
+                try:
+                    self.regexes.append((re.compile(pattern, re.IGNORECASE), subscription_id))
+                except re.error as e:
+                    logger.warning("Skipping invalid alias regex %r: %s", pattern, e)
+            elif match_type == SubscriptionAlias.MatchType.CONTAINS:
+                contains[normalize(pattern)].add(subscription_id)
+            else:
+                self.exact[normalize(pattern)].add(subscription_id)
+
+        self.contains = dict(contains)
+        # Longest substrings first, so "youtube music" wins over "youtube"
+        self.contains_regex = (
+            re.compile("|".join(map(re.escape, sorted(contains, key=len, reverse=True))))
+            if contains
+            else None
+        )
+        self._matches = {}  # activity -> subscription ids, shared by all users of the index
+
+    @classmethod
+    def build(cls):
+        return cls(
+            Subscription.objects.values_list("id", "name"),
+            SubscriptionAlias.objects.values_list("subscription_id", "pattern", "match_type"),
+        )
+
+    def match(self, activity):
+        """Ids of the subscriptions an activity counts towards"""
+        matches = self._matches.get(activity)
+        if matches is None:
+            key = normalize(activity)
+            ids = set(self.exact.get(key, ()))
+            if self.contains_regex:
+                for found in self.contains_regex.finditer(key):
+                    ids |= self.contains[found.group(0)]
+            for regex, subscription_id in self.regexes:
+                if regex.search(activity):
+                    ids.add(subscription_id)
+            if len(self._matches) >= MAX_CACHED_MATCHES:
+                self._matches.clear()  # Cheaper than LRU bookkeeping on every lookup
+            matches = self._matches[activity] = frozenset(ids)
+        return matches
+
+    def activity_filter(self, subscription_ids):
+        """A container of the activities matching any of the subscriptions (see screentime.parse_csv)"""
+        return ActivityFilter(self, frozenset(subscription_ids))
+
+    def columns_by_subscription(self, columns, subscription_ids):
+        """Groups a frame's activity columns by the subscriptions they match"""
+        wanted = set(subscription_ids)
+        grouped = defaultdict(list)
+        for column in columns:
+            for subscription_id in self.match(column) & wanted:
+                grouped[subscription_id].append(column)
+        return grouped
+
+    def usage(self, df, subscription_ids):
+        """Daily usage per subscription, summing all of its matching activities"""
+        return {
+            subscription_id: df[columns].sum(axis=1)
+            for subscription_id, columns in self.columns_by_subscription(
+                df.columns, subscription_ids
+            ).items()
+        }
+
+
+class ActivityFilter:
+    def __init__(self, index, subscription_ids):
+        self.index = index
+        self.subscription_ids = subscription_ids
+
+    def __contains__(self, activity):
+        return not self.subscription_ids.isdisjoint(self.index.match(activity))
+
+
+_index = None
+_built_at = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """The shared index, rebuilt after changes to aliases or subscriptions (or the TTL)"""
+    global _index, _built_at
+    ttl = getattr(settings, "ALIAS_INDEX_TTL", DEFAULT_TTL)
+    with _lock:
+        if _index is None or time.monotonic() - _built_at > ttl:
+            _index = AliasIndex.build()
+            _built_at = time.monotonic()
+        return _index
+
+
+def invalidate(**kwargs):
+    """Signal receiver dropping the index when aliases or subscriptions change"""
+    global _index
+    with _lock:
+        _index = None
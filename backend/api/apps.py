@@ -3,3 +3,27 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+
+        from . import aliases, conditional, recommendations, rollups, sqlite, user_cache
+        from .models import Plan, Subscription, SubscriptionAlias, User, UserPlan
+
+        for model in (Subscription, SubscriptionAlias):
+            post_save.connect(aliases.invalidate, sender=model)
+            post_delete.connect(aliases.invalidate, sender=model)
+        post_delete.connect(rollups.mark_dirty, sender=UserPlan)
+        post_save.connect(rollups.user_plan_moved, sender=UserPlan)
+        post_save.connect(rollups.plan_moved, sender=Plan)
+        post_save.connect(recommendations.plan_changed, sender=Plan)
+        post_delete.connect(recommendations.plan_changed, sender=Plan)
+        post_save.connect(conditional.user_plan_changed, sender=UserPlan)
+        post_delete.connect(conditional.user_plan_changed, sender=UserPlan)
+        for model in conditional.CATALOG_LOOKUPS:
+            post_save.connect(conditional.catalog_changed, sender=model)
+        post_save.connect(user_cache.user_changed, sender=User)
+        post_delete.connect(user_cache.user_changed, sender=User)
+
+        connection_created.connect(sqlite.configure_connection)
@@ -1,5 +1,9 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
-from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import user_cache
 
 class CookieJWTAuthentication(JWTAuthentication):
     def authenticate(self, request):
@@ -16,4 +20,68 @@ class CookieJWTAuthentication(JWTAuthentication):
             user=self.get_user(validated_token)
             return user, validated_token
         except AuthenticationFailed as e:
-            raise AuthenticationFailed(f"Error retrieving user: {str(e)}")
\ No newline at end of file
+            raise AuthenticationFailed(f"Error retrieving user: {str(e)}")
+
+    async def aauthenticate(self, request):
+        """Async counterpart of authenticate() for async views (the user lookup uses the async ORM)"""
+        token = request.COOKIES.get("access_token")
+
+        if not token:
+            return None
+        try:
+            validated_token = self.get_validated_token(token)
+        except AuthenticationFailed as e:
+            raise AuthenticationFailed(f"Token validation failed: {str(e)}")
+
+        try:
+            user = await self.aget_user(validated_token)
+            return user, validated_token
+        except AuthenticationFailed as e:
+            raise AuthenticationFailed(f"Error retrieving user: {str(e)}")
+
+    def get_user(self, validated_token):
+        """JWTAuthentication.get_user() through the user cache (see user_cache.py)"""
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        iat = validated_token.get("iat")
+        user = user_cache.lookup(user_id, iat)
+        if user is not None:
+            return user
+
+        generation = user_cache.generation(user_id)
+        user = super().get_user(validated_token)
+        user_cache.store(user, iat, generation)
+        return user
+
+    async def aget_user(self, validated_token):
+        """Same checks as JWTAuthentication.get_user(), with an async user lookup"""
+        iat = validated_token.get("iat")
+        user = await user_cache.alookup(validated_token.get(api_settings.USER_ID_CLAIM), iat)
+        if user is not None:
+            return user
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("Token contained no recognizable user identification")
+
+        generation = await user_cache.ageneration(user_id)
+        try:
+            user = await self.user_model.objects.aget(
+                **{api_settings.USER_ID_FIELD: user_id}
+            )
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+
+        if not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(
+                api_settings.REVOKE_TOKEN_CLAIM
+            ) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(
+                    "The user's password has been changed.", code="password_changed"
+                )
+
+        await user_cache.astore(user, iat, generation)
+        return user
@@ -0,0 +1,405 @@
+"""
+Benchmark suite for the analytics and cron paths (see the benchmark management command).
+Each case records latency, query count and peak traced memory, and runs against existing
+data, e.g. generated with seed_synthetic. Every call (with its setup) runs in a transaction
+that is rolled back, so repeats start from the same data and cron cases leave no advanced
+payment dates or queued notifications behind. RescueTime is replaced by a local fake,
+so only this project's code is measured.
+"""
+
+import datetime
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack, contextmanager
+from functools import cached_property
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F
+from django.db.models.functions import Cast
+from django.test import RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import aliases, jobs, recommendations, rollups, screentime, user_cache
+from .authentication import CookieJWTAuthentication
+from .models import CronJob, Plan, Subscription, SubscriptionRollup, UserPlan
+from .money import cents_to_decimal, micros_to_cents, to_cents
+from .services import (
+    PlanPortfolio,
+    SpendingCalculator,
+    AverageSpendingCalculator,
+    calculate_spending_by_category,
+    calculate_usage_by_category,
+)
+from .utils import budget_plans, budget_plans_by_category
+
+# Benchmark cases by name: (function taking a BenchmarkContext, setup run before each call)
+BENCHMARKS = {}
+
+
+def benchmark(name, setup=None):
+    """Registers a benchmark case"""
+
+    def register(fn):
+        BENCHMARKS[name] = (fn, setup)
+        return fn
+
+    return register
+
+
+class BenchmarkContext:
+    """
+    The user analytics cases run as, plus synthetic screen time data with a column
+    for every subscription and `activities` unrelated ones
+    """
+
+    def __init__(self, user, activities=50, days=30, seed=0):
+        self.user = user
+        columns = sorted(set(Subscription.objects.values_list("name", flat=True)))
+        columns += [f"Activity {i}" for i in range(activities)]
+
+        rng = np.random.default_rng(seed)
+        self.screentime = pd.DataFrame(
+            rng.integers(0, 7200, size=(days, len(columns))),
+            index=pd.date_range(end=pd.Timestamp.today().normalize(), periods=days),
+            columns=columns,
+        )
+
+    def screentime_csv(self):
+        """The screen time data as a RescueTime CSV export"""
+        rows = self.screentime.stack().reset_index()
+        rows.columns = ["Date", "Activity", "Time Spent (seconds)"]
+        rows["Date"] = rows["Date"].dt.strftime("%Y-%m-%dT00:00:00")
+        rows["Number of People"] = 1
+        rows["Category"] = "General"
+        rows["Productivity"] = 0
+        return rows.to_csv(index=False)
+
+    @cached_property
+    def large_export(self):
+        """Lines of a large RescueTime export: 30 days of 3000 activities"""
+        rng = np.random.default_rng(0)
+        days = pd.date_range(end=pd.Timestamp.today().normalize(), periods=30)
+        lines = ["Date,Time Spent (seconds),Number of People,Activity,Category,Productivity"]
+        for day in days.strftime("%Y-%m-%dT00:00:00"):
+            for activity, seconds in enumerate(rng.integers(1, 3600, size=3000)):
+                lines.append(f"{day},{seconds},1,activity-{activity}.com,General,0")
+        return lines
+
+    def user_plans(self):
+        return UserPlan.objects.filter(user=self.user)
+
+    def fake_services(self):
+        """Patches RescueTime calls for the cron cases (notifications only go to the outbox)"""
+        lines = self.screentime_csv().splitlines()
+        stack = ExitStack()
+        stack.enter_context(
+            mock.patch.object(screentime, "fetch_lines", lambda *args: iter(lines))
+        )
+        return stack
+
+
+@benchmark("analytics.total_spending")
+def bench_total_spending(context):
+    portfolio = PlanPortfolio.from_queryset(context.user_plans())
+    SpendingCalculator(portfolio).calculate_spending(SpendingCalculator.DEFAULT_PERIODS)
+
+
+@benchmark("analytics.average_spending")
+def bench_average_spending(context):
+    portfolio = PlanPortfolio.from_queryset(context.user_plans())
+    AverageSpendingCalculator(portfolio).calculate_averages(Plan.Period.choices)
+
+
+@benchmark("analytics.spending_by_category")
+def bench_spending_by_category(context):
+    portfolio = PlanPortfolio.from_queryset(context.user_plans())
+    calculate_spending_by_category(portfolio)
+
+
+@benchmark("analytics.usage_by_category")
+def bench_usage_by_category(context):
+    portfolio = PlanPortfolio.from_queryset(context.user_plans())
+    calculate_usage_by_category(portfolio)
+
+
+@benchmark("budget.budget_plans")
+def bench_budget_plans(context):
+    candidates = [
+        {
+            "id": user_plan_id,
+            "cost_cents": to_cents(cost),
+            "usage_score": usage_score,
+        }
+        for user_plan_id, cost, usage_score in context.user_plans().values_list(
+            "id", "plan__cost", "usage_score"
+        )
+    ]
+    budget_plans(candidates, sum(c["cost_cents"] for c in candidates) // 2)
+
+
+def _category_budget_candidates():
+    """10 categories x 50 plans costing $3-$50, with every other category capped at $80"""
+    rng = np.random.default_rng(0)
+    candidates = [
+        {
+            "id": category * 50 + i,
+            "cost_cents": int(rng.integers(300, 5000)),
+            "usage_score": int(rng.integers(0, 11)),
+            "category": category,
+        }
+        for category in range(10)
+        for i in range(50)
+    ]
+    caps = {category: 8000 for category in range(0, 10, 2)}
+    return candidates, caps
+
+
+@benchmark("budget.by_category_10x50")
+def bench_budget_by_category(context):
+    candidates, caps = _category_budget_candidates()
+    budget_plans_by_category(candidates, 50000, caps)
+
+
+@benchmark("budget.budget_plans_10x50")
+def bench_budget_plans_500(context):
+    """The single-budget optimizer on the same 500 plans, for comparison"""
+    candidates, _ = _category_budget_candidates()
+    budget_plans(candidates, 50000)
+
+
+@benchmark("screentime.calculate_usage")
+def bench_calculate_usage(context):
+    for activity, usage in context.screentime.items():
+        screentime.calculate_usage(usage, name=activity)
+
+
+@benchmark("aliases.match_activities")
+def bench_match_activities(context):
+    index = aliases.AliasIndex.build()  # Built per cron run, so part of the cost
+    subscription_ids = list(Subscription.objects.values_list("id", flat=True)[:10])
+    tracked = index.activity_filter(subscription_ids)
+    df = screentime.parse_csv(iter(context.large_export), activities=tracked)
+    index.usage(df, subscription_ids)
+
+
+def _parse_csv_pandas(lines):
+    """The previous parse (whole body, default dtypes, dense pivot), for comparison"""
+    df = pd.read_csv(StringIO("\n".join(lines)))
+    df["Date"] = pd.to_datetime(df["Date"])
+    df = df.rename(columns={"Time Spent (seconds)": "Time"})
+    df = df.groupby(["Date", "Activity"])["Time"].sum().reset_index()
+    return df.pivot(index="Date", columns="Activity", values="Time").fillna(0)
+
+
+@benchmark("screentime.parse_csv_pandas")
+def bench_parse_csv_pandas(context):
+    _parse_csv_pandas(context.large_export)
+
+
+@benchmark("screentime.parse_csv")
+def bench_parse_csv(context):
+    screentime.parse_csv(iter(context.large_export))
+
+
+@benchmark("screentime.parse_csv_tracked")
+def bench_parse_csv_tracked(context):
+    tracked = {f"activity-{i}.com" for i in range(10)}
+    screentime.parse_csv(iter(context.large_export), activities=tracked)
+
+
+def _run_cron_job(kind, context):
+    with context.fake_services():
+        job = jobs.enqueue_job(kind)
+        jobs.run_worker(worker_id="benchmark", job_id=job.pk)
+
+
+def _reset_usage_checks(context):
+    UserPlan.objects.update(usage_checked=None)  # Daily claims would skip every plan
+
+
+def _make_payments_due(context):
+    """Every plan overdue, so each call advances (and notifies about) all of them"""
+    UserPlan.objects.update(payment_date=datetime.date.today() - datetime.timedelta(days=1))
+
+
+@benchmark("cron.payment", setup=_make_payments_due)
+def bench_payment_cron(context):
+    _run_cron_job(CronJob.Kind.PAYMENT, context)
+
+
+@benchmark("cron.unused", setup=_reset_usage_checks)
+def bench_unused_cron(context):
+    _run_cron_job(CronJob.Kind.UNUSED, context)
+
+
+@benchmark("rollups.full")
+def bench_rollups_full(context):
+    rollups.run_rollups(full=True)
+
+
+def _touch_user_plans(context):
+    """A day's worth of changes: the benchmark user's plans were edited"""
+    if not SubscriptionRollup.objects.exists():
+        rollups.run_rollups(full=True)
+    context.user_plans().update(updated_at=timezone.now())
+
+
+@benchmark("rollups.incremental", setup=_touch_user_plans)
+def bench_rollups_incremental(context):
+    rollups.run_rollups()
+
+
+@benchmark("catalog.popular_live")
+def bench_popular_live(context):
+    """Popular subscriptions computed over the whole UserPlan table, for comparison"""
+    list(
+        UserPlan.objects.order_by()
+        .values("plan__subscription_id")
+        .annotate(count=Count("id"))
+        .order_by("-count")[:10]
+    )
+
+
+@benchmark("catalog.popular_rollup")
+def bench_popular_rollup(context):
+    list(
+        SubscriptionRollup.objects.select_related("subscription__category").order_by(
+            "-user_plans"
+        )[:10]
+    )
+
+
+@benchmark("recommendations.cheaper_plans")
+def bench_cheaper_plans(context):
+    recommendations.find_cheaper_plans(context.user)
+
+
+def _cost_filter_bounds(context):
+    """A month cost range and category covering part of the user's plans"""
+    user_plan = context.user_plans().select_related("plan__subscription").first()
+    return user_plan.plan.subscription.category_id, user_plan.daily_cost_micros
+
+
+@benchmark("user_plans.cost_filter_joined")
+def bench_cost_filter_joined(context):
+    """Cost filter and ordering on the plan's cost normalized in SQL, for comparison"""
+    category_id, micros = _cost_filter_bounds(context)
+    max_cost = cents_to_decimal(micros_to_cents(micros * 2 * Plan.Period.MONTH))
+    monthly_cost = ExpressionWrapper(
+        F("plan__cost") * Plan.Period.MONTH / Cast(F("plan__period"), DecimalField()),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
+    list(
+        context.user_plans()
+        .annotate(monthly_cost=monthly_cost)
+        .filter(
+            plan__subscription__category_id=category_id,
+            monthly_cost__lte=max_cost,
+        )
+        .order_by("-monthly_cost")
+    )
+
+
+@benchmark("user_plans.cost_filter_indexed")
+def bench_cost_filter_indexed(context):
+    category_id, micros = _cost_filter_bounds(context)
+    list(
+        context.user_plans()
+        .filter(category_id=category_id, daily_cost_micros__lte=micros * 2)
+        .order_by("-daily_cost_micros")
+    )
+
+
+def _authenticate_requests(context, count=100):
+    """`count` requests authenticated with the same access token cookie"""
+    request = RequestFactory().get("/api/analytics/dashboard/")
+    request.COOKIES["access_token"] = str(AccessToken.for_user(context.user))
+    authentication = CookieJWTAuthentication()
+    for _ in range(count):
+        authentication.authenticate(request)
+
+
+@benchmark("auth.authenticate_uncached")
+def bench_authenticate_uncached(context):
+    """A user SELECT per request, for comparison"""
+    with override_settings(AUTH_USER_CACHE={"ENABLED": False}):
+        _authenticate_requests(context)
+
+
+@benchmark("auth.authenticate_cached", setup=lambda context: user_cache.clear())
+def bench_authenticate_cached(context):
+    with override_settings(AUTH_USER_CACHE={"ENABLED": True}):
+        _authenticate_requests(context)
+
+
+@contextmanager
+def rolled_back():
+    """Runs the block in a transaction that is always rolled back"""
+    with transaction.atomic():
+        try:
+            yield
+        finally:
+            transaction.set_rollback(True)
+
+
+def run_benchmark(name, context, repeat=5):
+    """
+    Runs a case `repeat` times for latency, then once more under tracemalloc for peak
+    memory (tracing slows code down, so it is kept out of the timings). Each call is
+    rolled back, so timings exclude commits.
+    """
+    fn, setup = BENCHMARKS[name]
+
+    timings = []
+    for _ in range(repeat):
+        with rolled_back():
+            if setup:
+                setup(context)
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                fn(context)
+                timings.append((time.perf_counter() - start) * 1000)
+
+    with rolled_back():
+        if setup:
+            setup(context)
+        tracemalloc.start()
+        try:
+            fn(context)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "min_ms": round(timings[0], 3),
+        "median_ms": round(statistics.median(timings), 3),
+        "max_ms": round(timings[-1], 3),
+        "queries": len(queries),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def compare_to_baseline(results, baseline, threshold=0.2):
+    """
+    Compares median latency, query count and peak memory with a baseline run.
+    Returns regressions as (case, metric, baseline value, current value).
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        previous = baseline[name]
+        for metric in ["median_ms", "peak_kb"]:
+            if result[metric] > previous[metric] * (1 + threshold):
+                regressions.append((name, metric, previous[metric], result[metric]))
+        if result["queries"] > previous["queries"]:
+            regressions.append((name, "queries", previous["queries"], result["queries"]))
+    return regressions
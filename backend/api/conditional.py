@@ -0,0 +1,134 @@
+"""
+Conditional GET for per-user endpoints. Every change to a user's data bumps
+User.data_version, and responses carry a strong ETag derived from the version and the
+request, so a matching If-None-Match is answered with 304 right after authentication,
+without running the view's queries or serializers.
+"""
+
+import hashlib
+from datetime import date
+
+from django.db.models import F
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+from rest_framework.exceptions import APIException
+from rest_framework.response import Response
+
+from . import routers, user_cache
+from .models import Category, Plan, Subscription, User, UserPlan
+
+
+def bump_data_version(user_ids, using=None):
+    """
+    Invalidates the users' ETags (takes ids or a queryset of ids). `using` is the database
+    the change was written to; receivers pass theirs so writes to another alias stay there.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    User.objects.using(using).filter(pk__in=user_ids).update(data_version=F("data_version") + 1)
+    # Cached users (see user_cache.py) would carry the old version
+    user_cache.invalidate(user_ids)
+    # Replica reads could otherwise be cached under the new version
+    for user_id in user_ids:
+        routers.pin_to_primary(user_id)
+
+
+def user_plan_changed(sender, instance, using, **kwargs):
+    """post_save/post_delete receiver for UserPlan"""
+    bump_data_version([instance.user_id], using)
+
+
+# How to find the user plans showing a catalog object, by model
+CATALOG_LOOKUPS = {Plan: "plan", Subscription: "plan__subscription", Category: "category"}
+
+
+def catalog_changed(sender, instance, using, **kwargs):
+    """post_save receiver for catalog models, whose fields show up in users' responses"""
+    bump_data_version(
+        UserPlan.objects.using(using)
+        .filter(**{CATALOG_LOOKUPS[sender]: instance})
+        .values_list("user_id", flat=True)
+        .distinct(),
+        using,
+    )
+
+
+def make_etag(request, user, *parts):
+    """A strong ETag of the user's data version and the request"""
+    key = "\n".join(
+        [
+            str(user.pk),
+            str(user.data_version),
+            request.path,
+            # Parameter order doesn't change the response
+            "&".join(sorted(f"{k}={v}" for k, v in request.GET.lists())),
+            *map(str, parts),
+            # Spending totals, due dates etc. are relative to today
+            date.today().isoformat(),
+        ]
+    )
+    return '"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def is_not_modified(request, etag):
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    # Weak comparison: GZipMiddleware sends compressed responses with weak ETags
+    etags = [tag.removeprefix("W/") for tag in parse_etags(if_none_match)]
+    return etag in etags or "*" in etags
+
+
+def add_etag(response, etag):
+    response["ETag"] = etag
+    # Browsers keep the body but revalidate before every reuse
+    patch_cache_control(response, private=True, no_cache=True)
+
+
+class NotModified(APIException):
+    status_code = 304
+
+    def __init__(self, etag):
+        super().__init__()
+        self.etag = etag
+
+
+class ConditionalGetMixin:
+    """ETags and 304 responses for a DRF view's GET requests"""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        self.etag = None
+        if request.method == "GET" and request.user.is_authenticated:
+            self.etag = make_etag(request, request.user, request.accepted_media_type)
+            if is_not_modified(request, self.etag):
+                raise NotModified(self.etag)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            response = Response(status=304)
+            add_etag(response, exc.etag)
+            return response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, "etag", None) and response.status_code == 200:
+            add_etag(response, self.etag)
+        return response
+
+
+def not_modified_response(request):
+    """
+    For plain Django views, after authentication: a 304 response if the client's copy
+    is current, else None. The ETag to send is left on request.etag.
+    """
+    request.etag = make_etag(request, request.user, "application/json")
+    if is_not_modified(request, request.etag):
+        response = HttpResponseNotModified()
+        add_etag(response, request.etag)
+        return response
+    return None
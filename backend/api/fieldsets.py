@@ -0,0 +1,121 @@
+"""
+Sparse fieldsets: `?fields=id,payment_date` limits a list or detail response to those
+fields, and the queryset only joins the tables and loads the columns they read. What a
+field reads is inferred from its source (e.g. "plan.subscription.name"); serializers list
+the rest (method fields, values added in to_representation) in Meta.field_sources.
+"""
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.exceptions import ValidationError
+
+
+class SparseFieldsetSerializerMixin:
+    """Drops the fields not in context["fields"] (all are kept if it is None)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = self.context.get("fields")
+        if requested is not None:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+    def wants(self, name):
+        """Whether a value added in to_representation was requested"""
+        requested = self.context.get("fields")
+        return requested is None or name in requested
+
+    @classmethod
+    def field_names(cls):
+        return [*cls().fields, *getattr(cls.Meta, "field_sources", {})]
+
+
+class QueryPlan:
+    """The joins, prefetches and columns a set of serializer fields reads"""
+
+    def __init__(self):
+        self.select_related = set()
+        self.prefetch_related = set()
+        self.only = set()
+        self.complete = True  # False if some source isn't a model field
+
+    def add_source(self, model, source):
+        parts = source.split(".")
+        path = []
+        for i, part in enumerate(parts):
+            try:
+                field = model._meta.get_field(part)  # Also finds "plan_id" style names
+            except FieldDoesNotExist:
+                self.complete = False  # A property or an annotation
+                return
+            path.append(field.name)
+            lookup = "__".join(path)
+
+            if field.many_to_many or field.one_to_many:
+                self.prefetch_related.add(lookup)
+                return
+            # Loads the column, or the foreign key of a relation that is joined
+            self.only.add(lookup)
+            if not field.is_relation or i == len(parts) - 1:
+                return
+            self.select_related.add(lookup)
+            model = field.related_model
+
+    def apply(self, queryset, prune_columns=True):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*sorted(self.prefetch_related))
+        if prune_columns and self.complete:
+            queryset = queryset.only(*sorted(self.only))
+        return queryset
+
+
+def query_plan(serializer_class, fields=None):
+    """What the serializer's fields (all if None) read from its model"""
+    model = serializer_class.Meta.model
+    serializer = serializer_class(context={"fields": fields})
+    extra_sources = getattr(serializer_class.Meta, "field_sources", {})
+
+    plan = QueryPlan()
+    for name in fields if fields is not None else [*serializer.fields, *extra_sources]:
+        if name in extra_sources:
+            sources = extra_sources[name]
+        else:
+            field = serializer.fields[name]
+            if field.source == "*":
+                plan.complete = False
+                continue
+            sources = [field.source]
+
+        for source in sources:
+            plan.add_source(model, source)
+    return plan
+
+
+class SparseFieldsetMixin:
+    """
+    Handles ?fields= on a DRF view's GET requests. get_queryset() should end with
+    `return self.apply_fieldset(queryset)`.
+    """
+
+    def get_fields_param(self):
+        if self.request.method != "GET":
+            return None
+        param = self.request.query_params.get("fields")
+        if not param:
+            return None
+
+        fields = [name.strip() for name in param.split(",") if name.strip()]
+        unknown = set(fields) - set(self.get_serializer_class().field_names())
+        if unknown:
+            raise ValidationError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return fields
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), "fields": self.get_fields_param()}
+
+    def apply_fieldset(self, queryset):
+        fields = self.get_fields_param()
+        plan = query_plan(self.get_serializer_class(), fields)
+        # Columns are only pruned for explicit fieldsets, full responses load whole rows
+        return plan.apply(queryset, prune_columns=fields is not None)
@@ -0,0 +1,276 @@
+"""
+DB-backed queue for cron work. A job stores its users as chunks of ids, which workers
+claim one at a time and checkpoint after every user, so crashed runs resume where they stopped.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from . import tasks
+from .models import CronJob, CronJobChunk, User
+from .profiling import CronProfiler
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "CHUNK_SIZE": 100,  # users per chunk
+    "LEASE_SECONDS": 300,  # running chunks not checkpointed within this window are reclaimed
+    "MAX_ATTEMPTS": 3,
+    "RUN_IN_PROCESS": True,  # start a worker thread when a job is triggered over HTTP
+}
+
+
+def get_setting(name):
+    return getattr(settings, "CRON_JOBS", {}).get(name, DEFAULTS[name])
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def enqueue_job(kind, chunk_size=None):
+    """Snapshots the users a cron job applies to and splits them into pending chunks"""
+    chunk_size = chunk_size or get_setting("CHUNK_SIZE")
+    get_users, _ = tasks.TASKS[kind]
+
+    user_ids = list(get_users().order_by("id").values_list("id", flat=True))
+    job = CronJob.objects.create(
+        kind=kind, chunk_size=chunk_size, total_users=len(user_ids)
+    )
+    CronJobChunk.objects.bulk_create(
+        CronJobChunk(job=job, index=index, user_ids=user_ids[start : start + chunk_size])
+        for index, start in enumerate(range(0, len(user_ids), chunk_size))
+    )
+
+    if not user_ids:
+        job.status = CronJob.Status.DONE
+        job.finished_at = timezone.now()
+        job.save(update_fields=["status", "finished_at"])
+
+    return job
+
+
+def claim_chunk(worker_id, job_id=None):
+    """
+    Claims the next pending (or abandoned) chunk for a worker.
+    Claims are compare-and-swap updates, so two workers never get the same chunk.
+    """
+    now = timezone.now()
+    stale = now - timedelta(seconds=get_setting("LEASE_SECONDS"))
+
+    claimable = CronJobChunk.objects.filter(
+        Q(status=CronJob.Status.PENDING)
+        | Q(status=CronJob.Status.RUNNING, claimed_at__lt=stale)
+    )
+    if job_id is not None:
+        claimable = claimable.filter(job_id=job_id)
+
+    for chunk in claimable.order_by("job_id", "index")[:10]:
+        claimed = CronJobChunk.objects.filter(
+            pk=chunk.pk, status=chunk.status, claimed_at=chunk.claimed_at
+        ).update(
+            status=CronJob.Status.RUNNING,
+            claimed_by=worker_id,
+            claimed_at=now,
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            chunk.refresh_from_db()
+            return chunk
+
+    return None
+
+
+def process_chunk(chunk, trace_memory=None, profile_dir=None):
+    """
+    Runs the job's task for each user in the chunk, starting from its checkpoint.
+    The chunk's timings are kept for the job's run report.
+    """
+    job = chunk.job
+    if job.status == CronJob.Status.PENDING:
+        CronJob.objects.filter(pk=job.pk, status=CronJob.Status.PENDING).update(
+            status=CronJob.Status.RUNNING, started_at=timezone.now()
+        )
+
+    if chunk.attempts > get_setting("MAX_ATTEMPTS"):
+        _finish_chunk(chunk, CronJob.Status.FAILED, "Exceeded maximum attempts")
+        return
+    lease = _lease(chunk)
+
+    _, run_task = tasks.TASKS[job.kind]
+    remaining_ids = chunk.user_ids[chunk.checkpoint :]
+    users = User.objects.in_bulk(remaining_ids)
+
+    profiler = CronProfiler(
+        job.kind,
+        trace_memory=trace_memory,
+        profile_dir=profile_dir,
+        profile_name=f"{job.kind}-job{job.pk}-chunk{chunk.index}",
+    )
+    with profiler:
+        for user_id in remaining_ids:
+            processed_plans = 0
+            failed = 0
+            error = None
+
+            if user := users.get(user_id):  # Users deleted since enqueueing are skipped
+                with profiler.user():
+                    try:
+                        processed_plans = run_task(user)
+                    except Exception as e:
+                        failed = 1
+                        error = f"User {user_id}: {e}"
+                        logger.exception(
+                            "Error processing %s job for user %s: %s", job.kind, user_id, e
+                        )
+                profiler.record(plans=processed_plans, failed=failed)
+
+            # Checkpoint after every user (also renews the chunk's lease)
+            updates = {
+                "checkpoint": F("checkpoint") + 1,
+                "processed_plans": F("processed_plans") + processed_plans,
+                "failed_users": F("failed_users") + failed,
+                "claimed_at": timezone.now(),
+            }
+            if error:
+                updates["error"] = error
+            if not lease.update(**updates):
+                logger.warning(
+                    "%s lost its lease on %s, another worker resumes it", chunk.claimed_by, chunk
+                )
+                return
+
+    _finish_chunk(chunk, CronJob.Status.DONE, timings=profiler.state())
+
+
+def _lease(chunk):
+    """
+    The chunk while this claim holds it. Every claim increments `attempts`, so it also
+    tells apart two claims by the same worker id.
+    """
+    return CronJobChunk.objects.filter(
+        pk=chunk.pk,
+        status=CronJob.Status.RUNNING,
+        claimed_by=chunk.claimed_by,
+        attempts=chunk.attempts,
+    )
+
+
+def _finish_chunk(chunk, status, error=None, timings=None):
+    updates = {"status": status, "finished_at": timezone.now()}
+    if error:
+        updates["error"] = error
+    if timings:
+        updates["timings"] = timings
+    if not _lease(chunk).update(**updates):
+        return  # Reclaimed by another worker, which finishes it
+
+    # Close the job once none of its chunks are left to run
+    job = chunk.job
+    if not job.chunks.exclude(
+        status__in=[CronJob.Status.DONE, CronJob.Status.FAILED]
+    ).exists():
+        failed = job.chunks.filter(status=CronJob.Status.FAILED).exists()
+        closed = CronJob.objects.filter(
+            pk=job.pk, status__in=[CronJob.Status.PENDING, CronJob.Status.RUNNING]
+        ).update(
+            status=CronJob.Status.FAILED if failed else CronJob.Status.DONE,
+            finished_at=timezone.now(),
+        )
+        if closed:  # Only the worker that closed the job reports it
+            job.refresh_from_db()
+            save_job_report(job)
+
+
+def save_job_report(job):
+    """Merges the timings of a finished job's chunks into its CronRunReport"""
+    profiler = CronProfiler(job.kind)
+    profile_paths = set()
+    for timings in job.chunks.values_list("timings", flat=True):
+        if not timings:  # Chunks that failed before running
+            continue
+        profiler.merge(timings)
+        if timings.get("profile_path"):
+            profile_paths.add(os.path.dirname(timings["profile_path"]))
+
+    profiler.started_at = job.started_at or job.created_at
+    profiler.wall_seconds = (job.finished_at - profiler.started_at).total_seconds()
+    workers = ",".join(
+        sorted(set(job.chunks.exclude(claimed_by="").values_list("claimed_by", flat=True)))
+    )
+    return profiler.save(
+        job=job, worker=workers[:100], profile_path=",".join(sorted(profile_paths))
+    )
+
+
+def run_worker(
+    worker_id=None,
+    job_id=None,
+    burst=True,
+    poll_interval=5,
+    trace_memory=None,
+    profile_dir=None,
+):
+    """
+    Processes chunks until the queue is empty (burst) or forever, polling for new work.
+    Returns the number of chunks processed.
+    """
+    worker_id = worker_id or default_worker_id()
+    processed = 0
+
+    while True:
+        chunk = claim_chunk(worker_id, job_id=job_id)
+        if chunk is None:
+            if burst:
+                return processed
+            time.sleep(poll_interval)
+            continue
+
+        process_chunk(chunk, trace_memory=trace_memory, profile_dir=profile_dir)
+        processed += 1
+
+
+def start_background_worker(job):
+    """Processes a freshly enqueued job on a daemon thread of the current process"""
+
+    def work():
+        try:
+            run_worker(job_id=job.pk)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=work, name=f"cron-job-{job.pk}", daemon=True)
+    thread.start()
+    return thread
+
+
+def get_job_progress(job):
+    """Summarizes the chunks of a job for status reporting"""
+    chunks = job.chunks.all()
+    totals = chunks.aggregate(
+        processed_users=Sum("checkpoint"),
+        processed_plans=Sum("processed_plans"),
+        failed_users=Sum("failed_users"),
+    )
+    processed_users = totals["processed_users"] or 0
+
+    return {
+        "total_chunks": chunks.count(),
+        "done_chunks": chunks.filter(status=CronJob.Status.DONE).count(),
+        "failed_chunks": chunks.filter(status=CronJob.Status.FAILED).count(),
+        "processed_users": processed_users,
+        "processed_plans": totals["processed_plans"] or 0,
+        "failed_users": totals["failed_users"] or 0,
+        "percent": round(processed_users / job.total_users * 100, 2)
+        if job.total_users
+        else 100.0,
+    }
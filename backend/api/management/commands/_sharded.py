@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import sharding
+
+
+class ShardedCronCommand(BaseCommand):
+    """Base for cron commands that split users into shards across a process pool"""
+
+    task_name = None
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=1, help="Number of worker processes (shards)"
+        )
+        parser.add_argument(
+            "--shard-by",
+            choices=sharding.SHARD_STRATEGIES,
+            default="range",
+            help="Split users into contiguous id ranges or by id hash",
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="Print the run summary as JSON"
+        )
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            default=None,
+            help="Record peak memory with tracemalloc (slower)",
+        )
+        parser.add_argument("--profile-dir", help="Write cProfile dumps to this directory")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        summary = sharding.run_sharded(
+            self.task_name,
+            strategy=options["shard_by"],
+            workers=options["workers"],
+            trace_memory=options["trace_memory"],
+            profile_dir=options["profile_dir"],
+        )
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        for shard in summary["shards"]:
+            self.stdout.write(
+                f"Shard {shard['shard']}: {shard['users']} users, {shard['plans']} plans, "
+                f"{shard['failed']} failed in {shard['seconds']}s"
+            )
+        profile = summary["profile"]
+        for name, phase in profile["phases"].items():
+            self.stdout.write(
+                f"  {name:<8} {phase['wall_seconds']:>9.3f}s wall "
+                f"{phase['cpu_seconds']:>9.3f}s cpu ({phase['calls']} calls)"
+            )
+        if profile["user_latency_ms"]:
+            self.stdout.write(
+                "  per user: "
+                + ", ".join(f"{k} {v} ms" for k, v in profile["user_latency_ms"].items())
+            )
+        if profile["peak_memory_kb"] is not None:
+            self.stdout.write(f"  peak memory: {profile['peak_memory_kb']} KiB")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Processed {summary['users']} users and {summary['plans']} plans "
+                f"in {summary['seconds']}s ({summary['users_per_sec']} users/sec, "
+                f"{summary['plans_per_sec']} plans/sec, {summary['failed']} failed), "
+                f"report #{summary['report']}"
+            )
+        )
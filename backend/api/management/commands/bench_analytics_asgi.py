@@ -0,0 +1,114 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+from rest_framework_simplejwt.tokens import AccessToken
+
+from ...models import User
+
+ENDPOINTS = [
+    "total-spending-per-period",
+    "average-spending-per-period",
+    "spending-by-category",
+    "usage-by-category",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Load benchmark of the analytics endpoints: sync views through the WSGI handler "
+        "vs async views through the ASGI handler, reporting requests/sec"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--username", required=True, help="User to authenticate as")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+        parser.add_argument("--concurrency", type=int, default=10)
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist")
+
+        token = str(AccessToken.for_user(user))
+
+        # The test clients send requests as "testserver"
+        with override_settings(ALLOWED_HOSTS=["testserver"]):
+            results = self._run(token, options)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for endpoint, result in results.items():
+            self.stdout.write(
+                f"{endpoint}: WSGI {result['wsgi']['requests_per_sec']} req/s, "
+                f"ASGI {result['asgi']['requests_per_sec']} req/s"
+            )
+
+    def _run(self, token, options):
+        results = {}
+        for endpoint in ENDPOINTS:
+            sync_url = reverse(endpoint)
+            async_url = reverse(f"async-{endpoint}")
+
+            results[endpoint] = {
+                "wsgi": self._bench_sync(sync_url, token, options),
+                "asgi": asyncio.run(self._bench_async(async_url, token, options)),
+            }
+        return results
+
+    def _bench_sync(self, url, token, options):
+        def worker(count):
+            client = Client()
+            client.cookies["access_token"] = token
+            errors = 0
+            for _ in range(count):
+                if client.get(url).status_code != 200:
+                    errors += 1
+            connection.close()
+            return errors
+
+        counts = _split(options["requests"], options["concurrency"])
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            errors = sum(pool.map(worker, counts))
+        return _summary(options["requests"], errors, time.perf_counter() - start)
+
+    async def _bench_async(self, url, token, options):
+        async def worker(count):
+            client = AsyncClient()
+            client.cookies["access_token"] = token
+            errors = 0
+            for _ in range(count):
+                response = await client.get(url)
+                if response.status_code != 200:
+                    errors += 1
+            return errors
+
+        counts = _split(options["requests"], options["concurrency"])
+        start = time.perf_counter()
+        errors = sum(await asyncio.gather(*(worker(count) for count in counts)))
+        return _summary(options["requests"], errors, time.perf_counter() - start)
+
+
+def _split(total, parts):
+    """Splits a request count evenly across concurrent workers"""
+    size, extra = divmod(total, parts)
+    return [size + (1 if i < extra else 0) for i in range(parts)]
+
+
+def _summary(requests, errors, elapsed):
+    return {
+        "requests": requests,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_sec": round(requests / elapsed, 2) if elapsed else 0.0,
+    }
@@ -0,0 +1,73 @@
+import gzip
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from ... import renderers
+from ...models import Subscription, UserPlan
+from ...serializers import SubscriptionSerializer, UserPlanSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks JSON rendering of catalog and list payloads with DRF's stdlib "
+        "renderer vs the orjson one, and their size on the wire with and without gzip"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--user-plans", type=int, default=1000, help="User plans in the list payload"
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        if renderers.orjson is None:
+            raise CommandError("orjson is not installed")
+
+        payloads = {
+            "catalog": SubscriptionSerializer(
+                Subscription.objects.prefetch_related("plans"), many=True
+            ).data,
+            "user plans": UserPlanSerializer(
+                UserPlan.objects.select_related("plan__subscription__category")[
+                    : options["user_plans"]
+                ],
+                many=True,
+            ).data,
+        }
+        if not payloads["user plans"]:
+            raise CommandError("No user plans to render, run seed_synthetic first")
+
+        for name, data in payloads.items():
+            rendered = {}
+            for renderer_name, renderer in [
+                ("stdlib", JSONRenderer()),
+                ("orjson", renderers.FastJSONRenderer()),
+            ]:
+                timings = []
+                for _ in range(options["repeat"]):
+                    start = time.perf_counter()
+                    body = renderer.render(data, "application/json")
+                    timings.append(time.perf_counter() - start)
+                rendered[renderer_name] = (min(timings), body)
+
+            stdlib_seconds, body = rendered["stdlib"]
+            orjson_seconds, fast_body = rendered["orjson"]
+            start = time.perf_counter()
+            compressed = gzip.compress(body, compresslevel=6)
+            gzip_seconds = time.perf_counter() - start
+
+            self.stdout.write(
+                f"{name} ({len(data)} items): "
+                f"stdlib {stdlib_seconds * 1000:.2f} ms, "
+                f"orjson {orjson_seconds * 1000:.2f} ms "
+                f"({stdlib_seconds / orjson_seconds:.1f}x), "
+                f"{'identical' if fast_body == body else 'DIFFERENT'} output"
+                + ("" if json.loads(fast_body) == json.loads(body) else ", DIFFERENT data")
+            )
+            self.stdout.write(
+                f"  {len(body)} bytes, {len(compressed)} gzipped "
+                f"({len(compressed) / len(body):.0%}, {gzip_seconds * 1000:.2f} ms)"
+            )
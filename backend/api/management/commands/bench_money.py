@@ -0,0 +1,73 @@
+import random
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from ...models import Plan
+from ...money import NormalizedTotal, from_cents, to_cents
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmarks normalized cost sums with Decimal objects vs integer cents "
+        "(plain ints and int64 arrays)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100_000)
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        periods = [value for value, _ in Plan.Period.choices]
+        costs = [
+            Decimal(rng.randint(99, 19999)) / 100 for _ in range(options["rows"])
+        ]
+        row_periods = [rng.choice(periods) for _ in range(options["rows"])]
+        target = Plan.Period.MONTH
+
+        cents = [to_cents(cost) for cost in costs]
+        cents_array = np.array(cents, dtype=np.int64)
+        periods_array = np.array(row_periods, dtype=np.int64)
+
+        def decimal_sum():
+            total = sum(
+                cost / period * target for cost, period in zip(costs, row_periods)
+            )
+            return float(total.quantize(Decimal("0.01")))
+
+        def int_sum():
+            total = NormalizedTotal()
+            for cost_cents, period in zip(cents, row_periods):
+                total.add(cost_cents, period)
+            return from_cents(total.cents(target))
+
+        def int64_sum():
+            # Group by period with integer sums, then normalize once per period
+            total = NormalizedTotal()
+            for period in np.unique(periods_array):
+                total.add(int(cents_array[periods_array == period].sum()), int(period))
+            return from_cents(total.cents(target))
+
+        results = {}
+        for name, fn in [
+            ("decimal", decimal_sum),
+            ("int cents", int_sum),
+            ("int64 array", int64_sum),
+        ]:
+            timings = []
+            for _ in range(options["repeat"]):
+                start = time.perf_counter()
+                value = fn()
+                timings.append(time.perf_counter() - start)
+            results[name] = (min(timings), value)
+
+        baseline = results["decimal"][0]
+        for name, (seconds, value) in results.items():
+            self.stdout.write(
+                f"{name:>12}: {seconds * 1000:9.2f} ms  "
+                f"({baseline / seconds:6.1f}x vs decimal)  total={value}"
+            )
@@ -0,0 +1,179 @@
+import json
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.test import override_settings
+
+from ...models import UserPlan
+from ...profiling import percentiles
+from ...services import PlanPortfolio, calculate_spending_by_category
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrency benchmark of the SQLite profiles: cron-like writers and dashboard "
+        "readers run against a copy of the database, reporting throughput and lock errors"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--profiles",
+            nargs="+",
+            default=["development", "production"],
+            help="SQLite profiles (settings.SQLITE_PROFILES) to compare",
+        )
+        parser.add_argument("--readers", type=int, default=8)
+        parser.add_argument(
+            "--writers", type=int, default=2, help="Concurrent cron workers"
+        )
+        parser.add_argument(
+            "--batch", type=int, default=20, help="Users updated per write transaction"
+        )
+        parser.add_argument("--duration", type=float, default=10, help="Seconds per profile")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        source = settings.DATABASES["default"]
+        if source["ENGINE"] != "django.db.backends.sqlite3":
+            raise CommandError("The default database is not SQLite")
+        for profile in options["profiles"]:
+            if profile not in settings.SQLITE_PROFILES:
+                raise CommandError(f"Unknown SQLite profile '{profile}'")
+
+        directory = tempfile.mkdtemp()
+        try:
+            results = {
+                profile: self._run_profile(profile, source["NAME"], directory, options)
+                for profile in options["profiles"]
+            }
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        for profile, result in results.items():
+            self.stdout.write(
+                f"{profile}: {result['reads_per_sec']} reads/s "
+                f"(p95 {result['read_p95_ms']} ms, {result['read_lock_errors']} lock errors), "
+                f"{result['writes_per_sec']} writes/s "
+                f"({result['write_lock_errors']} lock errors)"
+            )
+
+    def _run_profile(self, profile, source, directory, options):
+        # A private copy per profile, so runs start from the same data and journal mode
+        path = os.path.join(directory, f"{profile}.sqlite3")
+        with closing(sqlite3.connect(source)) as src, closing(sqlite3.connect(path)) as dst:
+            src.backup(dst)
+
+        alias = f"bench-{profile}"
+        connections.settings[alias] = connections.configure_settings(
+            {
+                "default": connections.settings["default"],
+                alias: {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": path,
+                    **settings.SQLITE_PROFILES[profile]["DATABASE"],
+                },
+            }
+        )[alias]
+
+        try:
+            with override_settings(SQLITE_PROFILE=profile):
+                user_ids = list(
+                    UserPlan.objects.using(alias).values_list("user_id", flat=True).distinct()
+                )
+                connections[alias].close()
+                if not user_ids:
+                    raise CommandError("No user plans to benchmark, run seed_synthetic first")
+                return self._run_workers(alias, user_ids, options)
+        finally:
+            del connections.settings[alias]
+
+    def _run_workers(self, alias, user_ids, options):
+        deadline = time.monotonic() + options["duration"]
+        stats = {"read_ms": [], "reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+        lock = threading.Lock()
+
+        def request(work, kind):
+            """Runs one unit of work like a request, ending it as Django's handlers would"""
+            start = time.perf_counter()
+            try:
+                work()
+                ok = True
+            except OperationalError as e:
+                if "locked" not in str(e):
+                    raise
+                ok = False
+            finally:
+                connections[alias].close_if_unusable_or_obsolete()
+            elapsed = (time.perf_counter() - start) * 1000
+
+            with lock:
+                if not ok:
+                    stats[f"{kind}_errors"] += 1
+                    return
+                stats[f"{kind}s"] += 1
+                if kind == "read":
+                    stats["read_ms"].append(elapsed)
+
+        def read():
+            # Dashboard: the user's portfolio, summarized by category
+            portfolio = PlanPortfolio.from_queryset(
+                UserPlan.objects.using(alias).filter(user_id=random.choice(user_ids))
+            )
+            calculate_spending_by_category(portfolio)
+
+        def write():
+            # Cron chunk: load a batch of users' plans and save new usage scores. Updated
+            # by pk rather than saved, so no signal receivers run: the writes stay in the
+            # copy and only the SQLite work is timed.
+            batch = random.sample(user_ids, min(options["batch"], len(user_ids)))
+            user_plans = UserPlan.objects.using(alias)
+            with transaction.atomic(using=alias):
+                for pk in user_plans.filter(user_id__in=batch).values_list("pk", flat=True):
+                    user_plans.filter(pk=pk).update(usage_score=random.randint(1, 10))
+
+        def worker(work, kind):
+            try:
+                while time.monotonic() < deadline:
+                    request(work, kind)
+            finally:
+                connections[alias].close()
+
+        threads = [
+            threading.Thread(target=worker, args=(read, "read"))
+            for _ in range(options["readers"])
+        ] + [
+            threading.Thread(target=worker, args=(write, "write"))
+            for _ in range(options["writers"])
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        read_ms = percentiles(stats["read_ms"], points=(50, 95)) or {"p50": 0.0, "p95": 0.0}
+        return {
+            "seconds": round(elapsed, 3),
+            "reads": stats["reads"],
+            "reads_per_sec": round(stats["reads"] / elapsed, 2),
+            "read_p50_ms": round(read_ms["p50"], 2),
+            "read_p95_ms": round(read_ms["p95"], 2),
+            "read_lock_errors": stats["read_errors"],
+            "writes": stats["writes"],
+            "writes_per_sec": round(stats["writes"] / elapsed, 2),
+            "write_lock_errors": stats["write_errors"],
+        }
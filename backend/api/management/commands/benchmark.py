@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import benchmarks
+from ...models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs the analytics and cron benchmark suite, reporting latency, query count "
+        "and peak memory, optionally compared against a stored baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            default="synthetic-0",
+            help="User the analytics cases run as (see seed_synthetic)",
+        )
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            choices=sorted(benchmarks.BENCHMARKS),
+            help="Cases to run (all by default)",
+        )
+        parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Allowed slowdown/memory growth vs the baseline (0.2 = 20%%)",
+        )
+        parser.add_argument("--save", help="Write the results as JSON to this path")
+        parser.add_argument("--json", action="store_true", help="Print results as JSON")
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options["username"])
+        except User.DoesNotExist:
+            raise CommandError(
+                f"User '{options['username']}' does not exist, run seed_synthetic first"
+            )
+
+        baseline = None
+        if options["baseline"]:
+            try:
+                with open(options["baseline"]) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline: {e}")
+
+        context = benchmarks.BenchmarkContext(user)
+        results = {
+            name: benchmarks.run_benchmark(name, context, repeat=options["repeat"])
+            for name in options["only"] or benchmarks.BENCHMARKS
+        }
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump(results, f, indent=2)
+
+        if options["json"]:
+            self.stdout.write(json.dumps(results, indent=2))
+        else:
+            for name, result in results.items():
+                self.stdout.write(
+                    f"{name:<32} {result['median_ms']:>10.2f} ms  "
+                    f"{result['queries']:>6} queries  {result['peak_kb']:>10.1f} KiB peak"
+                )
+
+        if baseline is not None:
+            regressions = benchmarks.compare_to_baseline(
+                results, baseline, threshold=options["threshold"]
+            )
+            for name, metric, previous, current in regressions:
+                self.stderr.write(f"Regression in {name}: {metric} {previous} -> {current}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against the baseline")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from ... import jobs, outbox
+
+
+class Command(BaseCommand):
+    help = "Delivers queued push notifications as per-user digests in OneSignal batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once no notifications are due instead of polling for new ones",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=10,
+            help="Seconds to wait between polls when no notifications are due",
+        )
+        parser.add_argument("--worker-id", help="Name recorded on claimed notifications")
+
+    def handle(self, *args, **options):
+        totals = outbox.run_delivery(
+            options["worker_id"] or jobs.default_worker_id(),
+            burst=options["burst"],
+            poll_interval=options["poll_interval"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Sent to {totals['sent']} users, skipped {totals['skipped']} "
+                f"unsubscribed, {totals['failed']} failed (will retry)"
+            )
+        )
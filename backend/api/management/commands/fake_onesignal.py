@@ -0,0 +1,93 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs a local fake of the OneSignal API for testing notification delivery "
+        "(point ONESIGNAL_API_URL at it)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8089)
+        parser.add_argument(
+            "--unsubscribed",
+            type=int,
+            nargs="*",
+            default=[],
+            help="User ids to report as not subscribed",
+        )
+        parser.add_argument(
+            "--fail-rate",
+            type=float,
+            default=0.0,
+            help="Fraction of notification calls answered with a 503",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.0, help="Seconds to wait before responding"
+        )
+
+    def handle(self, *args, **options):
+        stats = {"notifications": 0, "recipients": 0, "failures": 0}
+        lock = threading.Lock()
+        unsubscribed = {str(user_id) for user_id in options["unsubscribed"]}
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                time.sleep(options["latency"])
+                if self.path != "/notifications":
+                    return self._reply(404, {"errors": ["Not found"]})
+
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if random.random() < options["fail_rate"]:
+                    with lock:
+                        stats["failures"] += 1
+                    return self._reply(503, {"errors": ["Service unavailable"]})
+
+                user_ids = payload.get("include_external_user_ids", [])
+                invalid = [user_id for user_id in user_ids if user_id in unsubscribed]
+                with lock:
+                    stats["notifications"] += 1
+                    stats["recipients"] += len(user_ids) - len(invalid)
+                stdout.write(
+                    f"{payload.get('headings', {}).get('en')!r} -> {len(user_ids)} users "
+                    f"({len(invalid)} unsubscribed) {stats}"
+                )
+
+                if invalid and len(invalid) == len(user_ids):
+                    return self._reply(
+                        200, {"id": "", "errors": ["All included players are not subscribed"]}
+                    )
+                response = {"id": str(uuid.uuid4())}
+                if invalid:
+                    response["errors"] = {"invalid_external_user_ids": invalid}
+                self._reply(200, response)
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass  # Requests are summarized on stdout instead
+
+        server = ThreadingHTTPServer(("127.0.0.1", options["port"]), Handler)
+        self.stdout.write(f"Fake OneSignal listening on http://127.0.0.1:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Stopped: {stats}")
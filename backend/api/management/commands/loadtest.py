@@ -0,0 +1,327 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import date
+
+import requests
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+
+from ...profiling import percentiles
+
+# Weighted request mix of a dashboard session. Each route is a function of a virtual
+# user returning the Results of the requests it made.
+ROUTES = []
+
+Result = namedtuple("Result", ["route", "status", "ms", "ok"])
+
+
+def route(weight):
+    def register(fn):
+        ROUTES.append((fn, weight))
+        return fn
+
+    return register
+
+
+@route(20)
+def dashboard(user):
+    return [user.get("dashboard", "/api/analytics/dashboard/")]
+
+
+@route(20)
+def user_plans(user):
+    return [user.get("user_plans.list", "/api/user-plans/?page_size=30")]
+
+
+@route(10)
+def user_plans_filtered(user):
+    return [
+        user.get(
+            "user_plans.filtered",
+            "/api/user-plans/?period=month&cost_max=20&ordering=-cost",
+        )
+    ]
+
+
+@route(10)
+def catalog(user):
+    return [user.get("subscriptions", "/api/subscriptions/")]
+
+
+@route(10)
+def spending(user):
+    return [user.get("spending", "/api/analytics/total-spending-per-period/")]
+
+
+@route(5)
+def spending_by_category(user):
+    return [user.get("spending_by_category", "/api/analytics/spending-by-category/")]
+
+
+@route(5)
+def budget(user):
+    return [user.get("budget", "/api/analytics/set-budget/?budget=50&period=month")]
+
+
+@route(5)
+def settings(user):
+    return [user.get("settings", "/api/user/settings/")]
+
+
+@route(5)
+def toggle_usage(user):
+    if not user.plan_ids:
+        return []
+    result, _ = user.request(
+        "toggle_usage",
+        "PATCH",
+        f"/api/user-plans/{user.rng.choice(user.plan_ids)}/toggle-usage/",
+        json={"track_usage": user.rng.random() < 0.5},
+    )
+    return [result]
+
+
+@route(5)
+def add_and_remove_plan(user):
+    created, response = user.request(
+        "user_plans.create",
+        "POST",
+        "/api/user-plans/",
+        json={
+            "plan_id": user.rng.choice(user.catalog_plan_ids),
+            "payment_date": date.today().isoformat(),
+        },
+        expected=(201, 400),  # 400: the user already has the plan
+    )
+    if created.status != 201:
+        return [created]
+
+    deleted, _ = user.request(
+        "user_plans.delete",
+        "DELETE",
+        f"/api/user-plans/{response.json()['id']}/",
+        expected=(204,),
+    )
+    return [created, deleted]
+
+
+class VirtualUser:
+    """
+    One client session (used by one thread), logged in through /auth/login/. The auth
+    cookies are Secure, which HTTP clients don't send over plain HTTP, so they are sent
+    by hand.
+    """
+
+    def __init__(self, base_url, username, password, rng, conditional=False, timeout=30):
+        self.base_url = base_url
+        self.rng = rng
+        self.conditional = conditional
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.cookies = {}
+        self.etags = {}
+
+        result, _ = self.request(
+            "login",
+            "POST",
+            "/api/auth/login/",
+            json={"username": username, "password": password, "remember_me": True},
+        )
+        if not result.ok:
+            raise CommandError(f"Could not log in as '{username}' ({result.status})")
+
+        user_plans = self.setup_json("/api/user-plans/?fields=id&page_size=100")
+        self.plan_ids = [user_plan["id"] for user_plan in user_plans["results"]]
+        self.catalog_plan_ids = [plan["id"] for plan in self.setup_json("/api/plans/?fields=id")]
+
+    def setup_json(self, path):
+        result, response = self.request("setup", "GET", path)
+        if not result.ok:
+            raise CommandError(f"Setup request {path} failed ({result.status})")
+        return response.json()
+
+    def get(self, name, path):
+        result, _ = self.request(name, "GET", path, expected=(200, 304))
+        return result
+
+    def request(self, name, method, path, expected=(200,), **kwargs):
+        """Returns the Result and the response (None on connection errors)"""
+        headers = {"Cookie": "; ".join(f"{k}={v}" for k, v in self.cookies.items())}
+        if self.conditional and method == "GET" and path in self.etags:
+            headers["If-None-Match"] = self.etags[path]
+
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method,
+                self.base_url + path,
+                headers=headers,
+                allow_redirects=False,
+                timeout=self.timeout,
+                **kwargs,
+            )
+        except requests.RequestException:
+            return Result(name, None, (time.perf_counter() - start) * 1000, False), None
+        ms = (time.perf_counter() - start) * 1000
+
+        # Refreshed tokens (TokenRefreshMiddleware) replace the old ones
+        self.cookies.update(response.cookies.get_dict())
+        self.session.cookies.clear()
+        if etag := response.headers.get("ETag"):
+            self.etags[path] = etag
+
+        return Result(name, response.status_code, ms, response.status_code in expected), response
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end load test over HTTP: logs seeded users in through /auth/login/ and "
+        "replays a weighted mix of dashboard, list, budget and CRUD requests, reporting "
+        "throughput and p50/p95/p99 latency and error rates per route as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--url",
+            help="Base URL of a running server, e.g. http://127.0.0.1:8000 (by default a "
+            "threaded WSGI server is started in this process, which shares its CPU with "
+            "the load generator)",
+        )
+        parser.add_argument(
+            "--seed-users",
+            type=int,
+            default=0,
+            help="Generate this many users with seed_synthetic first (replacing them)",
+        )
+        parser.add_argument("--plans", type=int, default=10, help="Plans per seeded user")
+        parser.add_argument("--prefix", default="loadtest", help="Username prefix")
+        parser.add_argument("--password", default="synthetic-password")
+        parser.add_argument(
+            "--users", type=int, default=10, help="Accounts the client threads log in as"
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=10, help="Client threads, each with a session"
+        )
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to run")
+        parser.add_argument(
+            "--conditional",
+            action="store_true",
+            help="Revalidate GETs with If-None-Match, like a polling browser",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Random seed of the mix")
+        parser.add_argument("--output", help="Also write the JSON report to this file")
+
+    def handle(self, *args, **options):
+        if options["seed_users"]:
+            call_command(
+                "seed_synthetic",
+                users=options["seed_users"],
+                plans=options["plans"],
+                prefix=options["prefix"],
+                password=options["password"],
+                reset=True,
+                stdout=self.stderr,
+            )
+
+        server = None
+        base_url = options["url"]
+        if not base_url:
+            server = self._start_server()
+            host, port = server.server_address[:2]
+            base_url = f"http://{host}:{port}"
+
+        try:
+            report = self._run(base_url.rstrip("/"), options)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def _start_server(self):
+        server = ThreadedWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+        # Request threads close their own connections, like LiveServerThread's
+        server.daemon_threads = True
+        server.set_app(get_wsgi_application())
+        threading.Thread(target=server.serve_forever, name="loadtest-server", daemon=True).start()
+        return server
+
+    def _run(self, base_url, options):
+        # One session per client thread, spread over the accounts
+        virtual_users = [
+            VirtualUser(
+                base_url,
+                f"{options['prefix']}-{i % options['users']}",
+                options["password"],
+                random.Random(options["seed"] + i),
+                options["conditional"],
+            )
+            for i in range(options["concurrency"])
+        ]
+        connections.close_all()
+
+        functions = [fn for fn, _ in ROUTES]
+        weights = [weight for _, weight in ROUTES]
+        results = []
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        def worker(user):
+            done = []
+            while time.monotonic() < deadline:
+                done.extend(user.rng.choices(functions, weights)[0](user))
+            with lock:
+                results.extend(done)
+
+        threads = [threading.Thread(target=worker, args=(user,)) for user in virtual_users]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        return {
+            "url": base_url,
+            "seconds": round(elapsed, 3),
+            "concurrency": options["concurrency"],
+            "accounts": min(options["users"], options["concurrency"]),
+            "conditional": options["conditional"],
+            **_summary(results, elapsed),
+            "routes": {
+                name: _summary([result for result in results if result.route == name], elapsed)
+                for name in sorted({result.route for result in results})
+            },
+        }
+
+
+def _summary(results, elapsed):
+    statuses = Counter(
+        str(result.status) if result.status is not None else "connection_error"
+        for result in results
+    )
+    errors = sum(not result.ok for result in results)
+    latencies = percentiles([result.ms for result in results], points=(50, 95, 99))
+    return {
+        "requests": len(results),
+        "requests_per_sec": round(len(results) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / len(results), 4) if results else 0.0,
+        "statuses": dict(sorted(statuses.items())),
+        **{f"{point}_ms": round(value, 2) for point, value in latencies.items()},
+    }
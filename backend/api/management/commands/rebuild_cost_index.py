@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from ... import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Recomputes every plan's daily cost and the per-subscription cheapest plan index, "
+        "and backfills the cost and category copies on user plans (all otherwise "
+        "maintained on Plan/UserPlan writes)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=5000, help="User plans updated per statement"
+        )
+
+    def handle(self, *args, **options):
+        size = recommendations.rebuild_cost_index()
+        self.stdout.write(self.style.SUCCESS(f"Indexed the cheapest plan of {size} subscriptions"))
+
+        changed = recommendations.sync_user_plans(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {changed} user plans"))
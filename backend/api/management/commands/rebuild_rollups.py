@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from ... import rollups
+
+
+class Command(BaseCommand):
+    help = (
+        "Refreshes the platform-wide subscription and category rollups from user plans "
+        "changed since the last run (schedule nightly)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--full", action="store_true", help="Rebuild every rollup from scratch"
+        )
+
+    def handle(self, *args, **options):
+        run = rollups.run_rollups(full=options["full"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{'Full' if run.full else 'Incremental'} rollup refreshed "
+                f"{run.subscriptions} subscriptions in "
+                f"{(run.finished_at - run.started_at).total_seconds():.2f}s"
+            )
+        )
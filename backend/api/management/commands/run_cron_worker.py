@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+
+from ... import jobs
+
+
+class Command(BaseCommand):
+    help = "Processes queued cron job chunks (payment and unused updates)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--job", type=int, help="Only process chunks of this job id")
+        parser.add_argument(
+            "--burst",
+            action="store_true",
+            help="Exit once the queue is empty instead of polling for new jobs",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=5,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument("--worker-id", help="Name recorded on claimed chunks")
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            default=None,
+            help="Record peak memory with tracemalloc (slower)",
+        )
+        parser.add_argument("--profile-dir", help="Write cProfile dumps to this directory")
+
+    def handle(self, *args, **options):
+        worker_id = options["worker_id"] or jobs.default_worker_id()
+        self.stdout.write(f"Worker {worker_id} started")
+
+        processed = jobs.run_worker(
+            worker_id=worker_id,
+            job_id=options["job"],
+            burst=options["burst"],
+            poll_interval=options["poll_interval"],
+            trace_memory=options["trace_memory"],
+            profile_dir=options["profile_dir"],
+        )
+
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} chunk(s)"))
@@ -0,0 +1,186 @@
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from ... import utils
+from ...models import (
+    Category,
+    Plan,
+    Subscription,
+    SubscriptionAlias,
+    User,
+    UserPlan,
+)
+
+# Realistic catalog: category -> (emoji, subscriptions)
+CATALOG = {
+    "Streaming": ("🎬", ["Netflix", "Disney+", "Hulu", "Max", "Prime Video", "Crunchyroll"]),
+    "Music": ("🎵", ["Spotify", "Apple Music", "Tidal", "Deezer", "YouTube Music"]),
+    "Productivity": ("📝", ["Notion", "Todoist", "Evernote", "Microsoft 365", "Slack"]),
+    "Cloud Storage": ("☁️", ["Dropbox", "Google One", "iCloud+", "Box"]),
+    "Gaming": ("🎮", ["Xbox Game Pass", "PlayStation Plus", "Nintendo Switch Online"]),
+    "News": ("📰", ["The New York Times", "The Economist", "Medium"]),
+    "Fitness": ("💪", ["Strava", "Peloton", "Headspace", "Calm"]),
+    "Development": ("💻", ["GitHub", "JetBrains", "ChatGPT", "Figma"]),
+}
+
+# Plan tiers: (name, monthly cost range in cents)
+TIERS = [("Basic", (299, 999)), ("Standard", (999, 1999)), ("Premium", (1999, 4999))]
+
+# Billing periods weighted towards monthly plans
+PERIODS = [Plan.Period.MONTH] * 6 + [Plan.Period.YEAR] * 2 + [
+    Plan.Period.WEEK,
+    Plan.Period.QUARTER,
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Generates a reproducible synthetic dataset for benchmarks and load tests: "
+        "a subscription catalog plus N users with M plans each"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--plans", type=int, default=10, help="Plans per user")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument(
+            "--prefix", default="synthetic", help="Username prefix of generated users"
+        )
+        parser.add_argument(
+            "--password",
+            default="synthetic-password",
+            help="Password shared by all generated users",
+        )
+        parser.add_argument(
+            "--api-key-ratio",
+            type=float,
+            default=0.5,
+            help="Fraction of users with a (fake) RescueTime key, i.e. in the unused cron",
+        )
+        parser.add_argument(
+            "--notify-ratio",
+            type=float,
+            default=0.5,
+            help="Fraction of users with notifications enabled, i.e. in the payment cron",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Delete previously generated users with the same prefix first",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 0 or options["plans"] < 0:
+            raise CommandError("--users and --plans must not be negative")
+
+        rng = random.Random(options["seed"])
+        prefix = options["prefix"]
+
+        with transaction.atomic():
+            existing = User.objects.filter(username__startswith=f"{prefix}-")
+            if existing.exists():
+                if not options["reset"]:
+                    raise CommandError(
+                        f"Users prefixed '{prefix}-' already exist, use --reset to replace them"
+                    )
+                existing.delete()
+
+            plans = self._create_catalog(rng)
+            users = self._create_users(rng, options)
+            user_plans = self._create_user_plans(rng, users, plans, options["plans"])
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created {len(users)} users with {len(user_plans)} plans "
+                f"(catalog of {len(plans)} plans)"
+            )
+        )
+
+    def _create_catalog(self, rng):
+        """Creates the catalog once; reruns reuse it so plan ids stay stable"""
+        plans = []
+        for category_name, (emoji, subscription_names) in CATALOG.items():
+            category, _ = Category.objects.get_or_create(
+                name=category_name, defaults={"icon_emoji": emoji}
+            )
+            for subscription_name in subscription_names:
+                # Not Subscription.objects.create(), which looks up the icon over HTTP
+                subscription = Subscription.objects.filter(
+                    name=subscription_name, category=category
+                ).first()
+                if subscription is None:
+                    subscription = Subscription.objects.bulk_create(
+                        [Subscription(name=subscription_name, category=category)]
+                    )[0]
+
+                # Website activities, e.g. "netflix.com", count as usage too
+                domain = "".join(c for c in subscription_name.lower() if c.isalnum())
+                SubscriptionAlias.objects.get_or_create(
+                    subscription=subscription,
+                    pattern=f"{domain}.com",
+                    match_type=SubscriptionAlias.MatchType.EXACT,
+                )
+
+                for tier, (low, high) in TIERS:
+                    period = rng.choice(PERIODS)
+                    cost = Decimal(rng.randint(low, high) * period // 30) / 100
+                    plan, _ = Plan.objects.get_or_create(
+                        subscription=subscription,
+                        name=tier,
+                        defaults={
+                            "cost": cost,
+                            "period": period,
+                            "free_trial": rng.random() < 0.05,
+                        },
+                    )
+                    plans.append(plan)
+        return plans
+
+    def _create_users(self, rng, options):
+        password = make_password(options["password"])  # Hashed once for all users
+        users = []
+        for i in range(options["users"]):
+            username = f"{options['prefix']}-{i}"
+            has_key = rng.random() < options["api_key_ratio"]
+            users.append(
+                User(
+                    username=username,
+                    email=f"{username}@example.com",
+                    password=password,
+                    avatar_url=utils.get_avatar_url(username),
+                    allow_notifications=rng.random() < options["notify_ratio"],
+                    api_key_encrypted=f"synthetic-key-{i}" if has_key else None,
+                    advance_period=rng.choice([1, 3, 7]),
+                    unused_threshold=rng.randint(2, 5),
+                )
+            )
+        return User.objects.bulk_create(users, batch_size=1000)
+
+    def _create_user_plans(self, rng, users, plans, plans_per_user):
+        today = date.today()
+        user_plans = []
+        for user in users:
+            for plan in rng.sample(plans, min(plans_per_user, len(plans))):
+                # Mostly upcoming payments, with some overdue ones for the payment cron
+                payment_date = today + timedelta(
+                    days=rng.randint(-plan.period // 2, plan.period)
+                )
+                user_plans.append(
+                    UserPlan(
+                        user=user,
+                        plan=plan,
+                        payment_date=payment_date,
+                        track_usage=rng.random() < 0.6,
+                        usage_score=rng.randint(1, 10),
+                        average_usage=rng.randint(0, 7200),
+                        # bulk_create() skips UserPlan.save(), which copies these
+                        daily_cost_micros=plan.daily_cost_micros,
+                        category_id=plan.subscription.category_id,
+                    )
+                )
+        return UserPlan.objects.bulk_create(user_plans, batch_size=1000)
@@ -0,0 +1,6 @@
+from ._sharded import ShardedCronCommand
+
+
+class Command(ShardedCronCommand):
+    help = "Advances overdue payment dates and sends upcoming payment notifications"
+    task_name = "payment"
@@ -0,0 +1,9 @@
+from ._sharded import ShardedCronCommand
+
+
+class Command(ShardedCronCommand):
+    help = (
+        "Refreshes usage scores from RescueTime and sends unused subscription notifications "
+        "(each plan at most once per day, later runs that day skip it)"
+    )
+    task_name = "unused"
@@ -0,0 +1,267 @@
+"""
+Minimal metrics registry (counters and histograms) rendered in the Prometheus text format.
+With METRICS["MULTIPROCESS_DIR"] set, every worker process periodically writes its values
+to a file there and /metrics sums the files, so any worker can serve totals for all of them.
+"""
+
+import atexit
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "MULTIPROCESS_DIR": None,
+    "FLUSH_INTERVAL": 5,  # seconds between writes of a process's values
+    "TOKEN": None,  # bearer token required by /metrics
+    "ALLOW_UNAUTHENTICATED": False,  # serve /metrics without a token (when none is set)
+}
+
+OUTBOUND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+def get_setting(name):
+    return getattr(settings, "METRICS", {}).get(name, DEFAULTS[name])
+
+
+def status_class(status_code):
+    """Groups HTTP status codes (e.g. 404 -> "4xx") to keep label cardinality low"""
+    return f"{status_code // 100}xx"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name, help, labelnames):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # label values tuple -> value
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.check_pid()
+            self.values[key] = self.values.get(key, 0) + amount
+        self.registry.maybe_flush()
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, registry, name, help, labelnames, buckets):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.registry.lock:
+            self.registry.check_pid()
+            # Per-bucket (non-cumulative) counts, the +Inf bucket last, then sum
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+        self.registry.maybe_flush()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.last_flush = 0.0
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=REQUEST_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def check_pid(self):
+        """Forked workers start from zero instead of re-reporting their parent's values"""
+        if os.getpid() != self.pid:
+            self.pid = os.getpid()
+            self.last_flush = 0.0
+            for metric in self.metrics.values():
+                metric.values = {}
+
+    def snapshot(self):
+        """This process's values, keyed by metric name then JSON-encoded label values"""
+        with self.lock:
+            return {
+                name: {json.dumps(key): value for key, value in metric.values.items()}
+                for name, metric in self.metrics.items()
+            }
+
+    def maybe_flush(self):
+        directory = get_setting("MULTIPROCESS_DIR")
+        if directory and time.monotonic() - self.last_flush >= get_setting("FLUSH_INTERVAL"):
+            self.flush(directory)
+
+    def flush(self, directory=None):
+        """Atomically writes this process's values to the multiprocess directory"""
+        directory = directory or get_setting("MULTIPROCESS_DIR")
+        if not directory:
+            return
+        self.last_flush = time.monotonic()
+        path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", path, e)
+
+    def collect(self):
+        """Values summed across all processes (or just this one without a multiprocess dir)"""
+        directory = get_setting("MULTIPROCESS_DIR")
+        if not directory:
+            return self.snapshot()
+
+        self.flush(directory)
+        totals = {}
+        for path in glob.glob(os.path.join(directory, "metrics-*.json")):
+            try:
+                with open(path) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue  # Being replaced by its process
+            for name, values in snapshot.items():
+                merged = totals.setdefault(name, {})
+                for key, value in values.items():
+                    if key not in merged:
+                        merged[key] = value
+                    elif isinstance(value, list):
+                        merged[key] = [a + b for a, b in zip(merged[key], value)]
+                    else:
+                        merged[key] += value
+        return totals
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        values = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for key, value in sorted(values.get(name, {}).items()):
+                labels = dict(zip(metric.labelnames, json.loads(key)))
+                if metric.type == "counter":
+                    lines.append(f"{name}{_format_labels(labels)} {value}")
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.buckets + ("+Inf",), value[:-1]):
+                    cumulative += count
+                    bucket_labels = _format_labels({**labels, "le": str(bound)})
+                    lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {value[-1]}")
+                lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+outbound_requests = registry.counter(
+    "outbound_requests_total",
+    "Calls to external services by endpoint and response status class",
+    ["service", "endpoint", "status"],
+)
+outbound_duration = registry.histogram(
+    "outbound_request_duration_seconds",
+    "Latency of calls to external services",
+    ["service", "endpoint"],
+    buckets=OUTBOUND_BUCKETS,
+)
+request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Latency of API requests by route",
+    ["method", "route", "status"],
+    buckets=REQUEST_BUCKETS,
+)
+
+
+class OutboundCall:
+    """Lets a tracked block report the response it got"""
+
+    def __init__(self, service, endpoint):
+        self.service = service
+        self.endpoint = endpoint
+        self.status = "error"  # unless a response is recorded
+        self.start = time.perf_counter()
+        self.streamed = False
+        self.observed = False
+
+    def record(self, response, stream=False):
+        """
+        Records the response's status. A streamed response is timed until it is closed,
+        so the latency includes reading its body.
+        """
+        self.status = status_class(response.status_code)
+        if stream:
+            self.streamed = True
+            close = response.close
+
+            def close_and_observe():
+                close()
+                self.observe()
+
+            response.close = close_and_observe
+        return response
+
+    def observe(self):
+        if not self.observed:
+            self.observed = True
+            outbound_duration.observe(
+                time.perf_counter() - self.start, service=self.service, endpoint=self.endpoint
+            )
+
+
+@contextmanager
+def track_outbound(service, endpoint):
+    """
+    Counts and times a call to an external service. Record the response with
+    `call.record(response)`; calls that raise are counted with status "error".
+    """
+    call = OutboundCall(service, endpoint)
+    try:
+        yield call
+    finally:
+        if not call.streamed:
+            call.observe()
+        outbound_requests.inc(service=service, endpoint=endpoint, status=call.status)
@@ -1,51 +1,299 @@
+import abc
+import json
+import logging
+import random
+import time
+from collections import Counter
+from contextlib import ExitStack
 from datetime import datetime, timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.middleware.gzip import GZipMiddleware
+from django.utils.deprecation import MiddlewareMixin
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
+from . import metrics, routers
 
-class TokenRefreshMiddleware:
-    def __init__(self, get_response):
-        self.get_response = get_response
+logger = logging.getLogger("api.performance")
+
+
+class AsyncCapableMiddleware(MiddlewareMixin, metaclass=abc.ABCMeta):
+    """
+    Base for middlewares with a sync handle() and an async __acall__(), both required.
+    Django picks the one matching the request path, so requests to async views stay on
+    the event loop instead of being adapted onto a thread by every sync-only middleware.
+    """
 
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        return self.handle(request)
+
+    @abc.abstractmethod
+    def handle(self, request):
+        """Processes a request from a sync view, calling self.get_response(request)"""
+
+    @abc.abstractmethod
+    async def __acall__(self, request):
+        """Processes a request from an async view, awaiting self.get_response(request)"""
+
+
+class TokenRefreshMiddleware(AsyncCapableMiddleware):
+    def handle(self, request):
         response = self.get_response(request)
+        if self.should_refresh(request):
+            self.refresh_tokens(request, response)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        if self.should_refresh(request):
+            # Rotating the refresh token reads and writes the blacklist
+            await sync_to_async(self.refresh_tokens)(request, response)
+        return response
 
+    def should_refresh(self, request):
         # Retrieve the access token from the HTTPOnly cookie
         access_token = request.COOKIES.get("access_token")
         refresh_token = request.COOKIES.get("refresh_token")
         remember_me = request.COOKIES.get("remember_me") == "True"
 
         if not (remember_me and access_token and refresh_token):
-            return response
+            return False
 
         try:
             # Parse the access token and check expiration
             access = AccessToken(access_token)
             token_expiry = datetime.fromtimestamp(access["exp"])
+        except Exception as e:
+            return False
 
-            # Check if token is about to expire
-            if datetime.now() > token_expiry - timedelta(minutes=10):
-                # Refresh the token
-                refresh = RefreshToken(refresh_token)
-                new_access = refresh.access_token
-
-                response.set_cookie(
-                    key="access_token",
-                    value=str(new_access),
-                    httponly=True,
-                    secure=True,
-                    samesite="None",
-                    max_age=new_access.lifetime,
-                )
+        # Check if token is about to expire
+        return datetime.now() > token_expiry - timedelta(minutes=10)
 
-                response.set_cookie(
-                    key="refresh_token",
-                    value=str(refresh),
-                    httponly=True,
-                    secure=True,
-                    samesite="None",
-                    max_age=refresh.lifetime,
-                )
+    def refresh_tokens(self, request, response):
+        try:
+            # Refresh the token
+            refresh = RefreshToken(request.COOKIES["refresh_token"])
+            new_access = refresh.access_token
+
+            response.set_cookie(
+                key="access_token",
+                value=str(new_access),
+                httponly=True,
+                secure=True,
+                samesite="None",
+                max_age=new_access.lifetime,
+            )
+
+            response.set_cookie(
+                key="refresh_token",
+                value=str(refresh),
+                httponly=True,
+                secure=True,
+                samesite="None",
+                max_age=refresh.lifetime,
+            )
         except Exception as e:
             pass
 
+
+class QueryStats:
+    """execute_wrapper that counts queries, sums their time and tracks repeated statements"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+        self.statement_durations = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.count += 1
+            self.duration += duration
+            self.statements[sql] += 1
+            self.statement_durations[sql] += duration
+
+    def repeated(self, threshold):
+        """Statements run at least `threshold` times (e.g. N+1 queries)"""
+        return {sql: n for sql, n in self.statements.items() if n >= threshold}
+
+    def top(self, limit):
+        """The statements with the most total DB time"""
+        return [
+            {
+                "sql": sql,
+                "count": self.statements[sql],
+                "ms": round(duration * 1000, 2),
+            }
+            for sql, duration in self.statement_durations.most_common(limit)
+        ]
+
+
+class QueryInstrumentationMiddleware(AsyncCapableMiddleware):
+    """
+    Counts DB queries and time per request, adds a Server-Timing header and logs slow
+    requests or repeated statements with their top SQL. Only a sample of requests is
+    instrumented (QUERY_INSTRUMENTATION["SAMPLE_RATE"]) to keep it cheap in production.
+    """
+
+    DEFAULTS = {
+        "SAMPLE_RATE": 1.0,
+        "SLOW_REQUEST_MS": 500,
+        "REPEATED_QUERY_THRESHOLD": 5,
+        "TOP_QUERIES": 5,
+    }
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.config = {
+            **self.DEFAULTS,
+            **getattr(settings, "QUERY_INSTRUMENTATION", {}),
+        }
+
+    def handle(self, request):
+        if random.random() >= self.config["SAMPLE_RATE"]:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            self.wrap_connections(stack, stats)
+            response = self.get_response(request)
+        return self.report(request, response, stats, start)
+
+    async def __acall__(self, request):
+        if random.random() >= self.config["SAMPLE_RATE"]:
+            return await self.get_response(request)
+
+        stats = QueryStats()
+        start = time.perf_counter()
+        # The async ORM runs queries on the request's thread-sensitive executor thread,
+        # whose connections are the ones to wrap
+        with ExitStack() as stack:
+            await sync_to_async(self.wrap_connections)(stack, stats)
+            try:
+                response = await self.get_response(request)
+            finally:
+                await sync_to_async(stack.close)()
+        return self.report(request, response, stats, start)
+
+    def wrap_connections(self, stack, stats):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(stats))
+
+    def report(self, request, response, stats, start):
+        total_ms = (time.perf_counter() - start) * 1000
+        db_ms = stats.duration * 1000
+
+        response["Server-Timing"] = (
+            f'db;dur={db_ms:.1f};desc="{stats.count} queries", '
+            f"app;dur={total_ms - db_ms:.1f}, total;dur={total_ms:.1f}"
+        )
+
+        slow = total_ms >= self.config["SLOW_REQUEST_MS"]
+        repeated = stats.repeated(self.config["REPEATED_QUERY_THRESHOLD"])
+        if slow or repeated:
+            logger.warning(
+                json.dumps(
+                    {
+                        "event": "slow_request" if slow else "repeated_queries",
+                        "method": request.method,
+                        "path": request.path,
+                        "status": response.status_code,
+                        "total_ms": round(total_ms, 2),
+                        "db_ms": round(db_ms, 2),
+                        "queries": stats.count,
+                        "repeated": [
+                            {"sql": sql, "count": n} for sql, n in repeated.items()
+                        ],
+                        "top_queries": stats.top(self.config["TOP_QUERIES"]),
+                    }
+                )
+            )
+
+        return response
+
+
+class MetricsMiddleware(AsyncCapableMiddleware):
+    """Records request durations per route (the URL pattern, not the path) for /metrics"""
+
+    def handle(self, request):
+        start = time.perf_counter()
+        return self.observe(request, self.get_response(request), start)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        return self.observe(request, await self.get_response(request), start)
+
+    def observe(self, request, response, start):
+        match = request.resolver_match
+        metrics.request_duration.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=match.route if match else "unmatched",
+            status=metrics.status_class(response.status_code),
+        )
+        return response
+
+
+class DatabaseRoutingMiddleware(AsyncCapableMiddleware):
+    """
+    Tracks whether a request writes (see api/routers.py), keeping its user's reads on the
+    primary database for a while afterwards so they see their own writes.
+    """
+
+    def handle(self, request):
+        with routers.routing_scope() as state:
+            response = self.get_response(request)
+        if state.wrote:
+            self.pin_user(request)
+        return response
+
+    async def __acall__(self, request):
+        with routers.routing_scope() as state:
+            response = await self.get_response(request)
+        if state.wrote:
+            # request.user may be a lazy session lookup, which is sync only
+            await sync_to_async(self.pin_user)(request)
         return response
+
+    def pin_user(self, request):
+        user = getattr(request, "user", None)
+        if user is not None and user.is_authenticated:
+            routers.pin_to_primary(user.pk)
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """
+    Gzips responses for clients that accept it, above a size threshold (smaller bodies
+    gain little for the CPU spent) and only for text payloads such as JSON.
+    """
+
+    DEFAULTS = {
+        "MIN_SIZE": 1024,  # bytes
+        "CONTENT_TYPES": ("application/json", "text/"),
+    }
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.config = {**self.DEFAULTS, **getattr(settings, "COMPRESSION", {})}
+
+    async def __acall__(self, request):
+        # Compression doesn't touch the database, so unlike MiddlewareMixin's __acall__
+        # it runs on the event loop rather than a thread
+        return self.process_response(request, await self.get_response(request))
+
+    def process_response(self, request, response):
+        content_type = response.get("Content-Type", "")
+        if not content_type.startswith(tuple(self.config["CONTENT_TYPES"])):
+            return response
+        if not response.streaming and len(response.content) < self.config["MIN_SIZE"]:
+            return response
+        return super().process_response(request, response)
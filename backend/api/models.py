@@ -1,14 +1,45 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
-from . import screentime
+import re
 from datetime import date, timedelta
 
 from . import utils
+from .money import daily_micros, to_cents
 
 USAGE_SCORE_CHOICES = [(i, i) for i in range(0, 11)]
 
 
+class LoadedValuesMixin:
+    """
+    Remembers the `tracked_fields` (attnames) as last loaded or saved, so signal receivers
+    can tell what a save changes, e.g. the subscription a plan is moved away from.
+    """
+
+    tracked_fields = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._remember_loaded_values()
+
+    def _remember_loaded_values(self):
+        self._loaded_values = {
+            name: self.__dict__[name] for name in self.tracked_fields if name in self.__dict__
+        }
+
+    def loaded_value(self, name):
+        """The field's value as loaded or last saved (None for unsaved instances)"""
+        return getattr(self, "_loaded_values", {}).get(name)
+
+
 class User(AbstractUser):
     DEFAULT_AVATAR_URL = 'https://i.sstatic.net/l60Hf.png'
 
@@ -19,13 +50,25 @@ class User(AbstractUser):
     api_key_encrypted = models.CharField(max_length=255, blank=True, null=True)
     advance_period = models.IntegerField(default=3)
     unused_threshold = models.IntegerField(default=3, choices=USAGE_SCORE_CHOICES)
+    # Bumped on every change to the user's data, for ETags (see conditional.py)
+    data_version = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.username
     
     def save(self, *args, **kwargs):
         self.avatar_url = utils.get_avatar_url(self.username)
+        if self._state.adding:
+            super().save(*args, **kwargs)
+            return
+
+        # Incremented in SQL, so concurrent bumps are never overwritten
+        self.data_version = models.F("data_version") + 1
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "data_version"}
         super().save(*args, **kwargs)
+        self.refresh_from_db(fields=["data_version"])
 
 
 class Category(models.Model):
@@ -40,7 +83,7 @@ class Category(models.Model):
 class Subscription(models.Model):
     DEFAULT_ICON_URL=  "https://icons.veryicon.com/png/o/business/settlement-platform-icon/default-16.png"
 
-    name = models.CharField(max_length=100)
+    name = models.CharField(max_length=100, db_index=True)  # Searched by name prefix
     icon_url = models.URLField(
         default=DEFAULT_ICON_URL
     )
@@ -54,9 +97,46 @@ class Subscription(models.Model):
     def save(self, *args, **kwargs):
         self.icon_url = utils.get_icon_url(self.name)
         super().save(*args, **kwargs)
+        # Keep the denormalized category of user plans in sync (in the database saved to)
+        UserPlan.objects.using(self._state.db).filter(plan__subscription=self).exclude(
+            category_id=self.category_id
+        ).update(category_id=self.category_id, updated_at=timezone.now())
+
+
+class SubscriptionAlias(models.Model):
+    """
+    A RescueTime activity name that counts as usage of a subscription (see aliases.py).
+    Subscriptions always match their own name, aliases add e.g. "netflix.com".
+    """
+
+    class MatchType(models.TextChoices):
+        EXACT = "exact", "exact"
+        CONTAINS = "contains", "contains"
+        REGEX = "regex", "regex"
+
+    subscription = models.ForeignKey(
+        Subscription, on_delete=models.CASCADE, related_name="aliases"
+    )
+    pattern = models.CharField(max_length=255)
+    match_type = models.CharField(
+        max_length=10, choices=MatchType.choices, default=MatchType.EXACT
+    )
+
+    def __str__(self):
+        return f"{self.pattern} ({self.match_type}) -> {self.subscription.name}"
+
+    def clean(self):
+        if self.match_type == self.MatchType.REGEX:
+            try:
+                re.compile(self.pattern)
+            except re.error as e:
+                raise ValidationError({"pattern": f"Invalid regular expression: {e}"})
+
+    class Meta:
+        unique_together = ("subscription", "pattern", "match_type")
 
 
-class Plan(models.Model):
+class Plan(LoadedValuesMixin, models.Model):
     # Source: https://stackoverflow.com/questions/1117564/set-django-integerfield-by-choices-name
     class Period(models.IntegerChoices):
         DAY = 1, "day"
@@ -91,48 +171,350 @@ class Plan(models.Model):
     cost = models.DecimalField(max_digits=10, decimal_places=2)
     period = models.IntegerField(choices=Period.choices, default=Period.MONTH)
     free_trial = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)  # For rollups.py
+    # Cost normalized per day (see money.daily_micros), kept in sync with cost and period
+    daily_cost_micros = models.BigIntegerField(default=0, db_index=True, editable=False)
+
+    tracked_fields = ("subscription_id",)  # Moves refresh both subscriptions' stats
 
     def cost_per_period(self, target_period):
         return (self.cost / self.period) * target_period
 
+    def save(self, *args, **kwargs):
+        self.daily_cost_micros = daily_micros(to_cents(self.cost), self.period)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and {"cost", "period"} & set(update_fields):
+            kwargs["update_fields"] = {*update_fields, "daily_cost_micros"}
+        super().save(*args, **kwargs)
+        # Keep the denormalized cost and category of user plans in sync (in the database
+        # saved to)
+        db = self._state.db
+        category_id = (
+            Subscription.objects.using(db)
+            .values_list("category_id", flat=True)
+            .get(pk=self.subscription_id)
+        )
+        UserPlan.objects.using(db).filter(plan=self).exclude(
+            daily_cost_micros=self.daily_cost_micros, category_id=category_id
+        ).update(
+            daily_cost_micros=self.daily_cost_micros,
+            category_id=category_id,
+            updated_at=timezone.now(),
+        )
+
     def __str__(self):
         return f"{self.name} - {self.subscription.name}"
 
 
-class UserPlan(models.Model):
+class UserPlan(LoadedValuesMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="user_plans")
     plan = models.ForeignKey(Plan, on_delete=models.CASCADE)
 
     payment_date = models.DateField()
     last_updated = models.DateField(null=True, blank=True)
-    total_spent = models.IntegerField(default=0)
+    total_spent_cents = models.BigIntegerField(default=0)
 
     track_usage = models.BooleanField(default=False)
     usage_score = models.IntegerField(default=1, choices=USAGE_SCORE_CHOICES)
     average_usage = models.IntegerField(default=0)
 
+    usage_checked = models.DateField(null=True, blank=True)
+
+    # Last change to the row, for incremental rollups (see rollups.py). Set it explicitly
+    # in queryset update() calls and save(update_fields=...), which skip auto_now.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Copies of plan.daily_cost_micros and plan.subscription.category_id, so cost and
+    # category filters and cost ordering are index scans. Synced by Plan/Subscription.save().
+    daily_cost_micros = models.BigIntegerField(default=0, editable=False)
+    category = models.ForeignKey(
+        Category,
+        on_delete=models.SET_NULL,
+        null=True,
+        editable=False,
+        related_name="+",
+        db_index=False,  # Covered by the (user, category) index
+    )
+
+    tracked_fields = ("plan_id",)  # Plan changes refresh both subscriptions' rollups
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "plan" in update_fields:
+            self.daily_cost_micros = self.plan.daily_cost_micros
+            self.category_id = self.plan.subscription.category_id
+            if update_fields is not None:
+                kwargs["update_fields"] = {*update_fields, "daily_cost_micros", "category"}
+        super().save(*args, **kwargs)
+
     def update_payment_date(self):
+        """
+        Advances an overdue payment date by one period. The update is a compare-and-swap
+        on the current payment date, so concurrent cron runs never advance it twice.
+        Returns whether this call advanced the date (callers bump the user's data_version).
+        """
         today = date.today()
 
         if self.payment_date < today:
             if self.plan.free_trial:
-                return
+                return False
 
             if not self.plan.period:
                 raise ValueError("Period must be set for the plan.")
 
-            self.payment_date += timedelta(days=self.plan.period)
-            self.total_spent += self.plan.cost
+            next_payment_date = self.payment_date + timedelta(days=self.plan.period)
+            advanced = UserPlan.objects.filter(
+                pk=self.pk, payment_date=self.payment_date
+            ).update(
+                payment_date=next_payment_date,
+                total_spent_cents=models.F("total_spent_cents")
+                + to_cents(self.plan.cost),
+                last_updated=today,
+                updated_at=timezone.now(),
+            )
+
+            if not advanced:  # Another run got there first
+                self.refresh_from_db(
+                    fields=["payment_date", "total_spent_cents", "last_updated"]
+                )
+                return False
+
+            self.payment_date = next_payment_date
+            self.total_spent_cents += to_cents(self.plan.cost)
             self.last_updated = today
+            return True
 
-            self.save()
+        return False
 
-    def update_usage_score(self, subscription_name, df):
-        self.usage_score = screentime.calculate_usage(subscription_name, df)
-        self.save()
+    def claim_usage_check(self):
+        """
+        Claims the plan for today's usage update, so overlapping runs skip it
+        (callers bump the user's data_version). Claims last for the calendar day: later
+        runs that day skip the plan too, and clearing usage_checked forces a new check.
+        """
+        today = date.today()
+        claimed = (
+            UserPlan.objects.filter(pk=self.pk)
+            .exclude(usage_checked=today)
+            .update(usage_checked=today, updated_at=timezone.now())
+        )
+        if claimed:
+            self.usage_checked = today
+        return bool(claimed)
 
     def __str__(self):
         return f"{self.user.username}'s {self.plan.subscription.name} - {self.plan.name}"
 
     class Meta:
         ordering = ["plan__name"]
+        indexes = [
+            models.Index(fields=["user", "daily_cost_micros"]),
+            models.Index(fields=["user", "category"]),
+        ]
+
+
+class CronJob(models.Model):
+    """A cron run split into chunks of user ids, processed by background workers"""
+
+    class Kind(models.TextChoices):
+        PAYMENT = "payment", "payment"
+        UNUSED = "unused", "unused"
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "pending"
+        RUNNING = "running", "running"
+        DONE = "done", "done"
+        FAILED = "failed", "failed"
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    chunk_size = models.IntegerField(default=100)
+    total_users = models.IntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} job #{self.pk} ({self.status})"
+
+    class Meta:
+        ordering = ["-created_at"]
+
+
+class CronJobChunk(models.Model):
+    """
+    A slice of a cron job's users. `checkpoint` counts the users already processed,
+    so a chunk reclaimed after a crash resumes where the previous worker stopped.
+    """
+
+    job = models.ForeignKey(CronJob, on_delete=models.CASCADE, related_name="chunks")
+    index = models.IntegerField()
+    user_ids = models.JSONField(default=list)
+
+    status = models.CharField(
+        max_length=10, choices=CronJob.Status.choices, default=CronJob.Status.PENDING
+    )
+    checkpoint = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    processed_plans = models.IntegerField(default=0)
+    failed_users = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    timings = models.JSONField(default=dict, blank=True)  # see profiling.CronProfiler.state()
+
+    claimed_by = models.CharField(max_length=100, blank=True, default="")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Chunk {self.index} of job #{self.job_id} ({self.status})"
+
+    class Meta:
+        ordering = ["job", "index"]
+        unique_together = ("job", "index")
+        indexes = [models.Index(fields=["status", "claimed_at"])]
+
+
+class CronRunReport(models.Model):
+    """Timings of one cron run (see profiling.py), kept to compare runs"""
+
+    kind = models.CharField(max_length=20, choices=CronJob.Kind.choices)
+    job = models.ForeignKey(
+        CronJob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="reports",
+    )
+    worker = models.CharField(max_length=100, blank=True, default="")
+
+    started_at = models.DateTimeField()
+    wall_seconds = models.FloatField()
+    cpu_seconds = models.FloatField()
+
+    users = models.IntegerField(default=0)
+    plans = models.IntegerField(default=0)
+    failed_users = models.IntegerField(default=0)
+
+    phases = models.JSONField(default=dict)  # name -> calls, wall and cpu seconds
+    user_latency_ms = models.JSONField(default=dict)  # p50, p90, p99 and max
+    peak_memory_kb = models.FloatField(null=True, blank=True)
+    profile_path = models.CharField(max_length=255, blank=True, default="")
+
+    def __str__(self):
+        return f"{self.kind} run at {self.started_at:%Y-%m-%d %H:%M} ({self.wall_seconds:.1f}s)"
+
+    class Meta:
+        ordering = ["-started_at"]
+
+
+class NotificationEvent(models.Model):
+    """
+    A push notification waiting in the outbox (see outbox.py). Events are delivered
+    per user as a digest, and `dedupe_key` keeps cron re-runs from queueing them twice.
+    """
+
+    class Kind(models.TextChoices):
+        UPCOMING_PAYMENT = "upcoming_payment", "upcoming payment"
+        UNUSED_SUBSCRIPTION = "unused_subscription", "unused subscription"
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "pending"
+        SENDING = "sending", "sending"
+        SENT = "sent", "sent"
+        SKIPPED = "skipped", "skipped"  # the user has no push subscription
+        FAILED = "failed", "failed"
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="notification_events"
+    )
+    kind = models.CharField(max_length=30, choices=Kind.choices)
+    title = models.CharField(max_length=100)
+    message = models.CharField(max_length=255)
+    dedupe_key = models.CharField(max_length=100, unique=True)
+
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField()
+    claimed_by = models.CharField(max_length=100, blank=True, default="")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default="")
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} for {self.user_id} ({self.status})"
+
+    class Meta:
+        ordering = ["created_at"]
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+
+class SubscriptionRollup(models.Model):
+    """Platform-wide stats of a subscription's user plans, maintained by rollups.py"""
+
+    subscription = models.OneToOneField(
+        Subscription, on_delete=models.CASCADE, primary_key=True, related_name="rollup"
+    )
+    user_plans = models.IntegerField(default=0, db_index=True)
+    tracked_plans = models.IntegerField(default=0)
+    monthly_cost_cents = models.BigIntegerField(default=0)  # Sum over all user plans
+    usage_histogram = models.JSONField(default=list)  # Tracked plans per usage score
+    dirty = models.BooleanField(default=False)  # A user plan left since the rollup
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Rollup of subscription {self.subscription_id}"
+
+
+class CategoryRollup(models.Model):
+    """Platform-wide stats of a category, summed from its subscriptions' rollups"""
+
+    category = models.OneToOneField(
+        Category, on_delete=models.CASCADE, primary_key=True, related_name="rollup"
+    )
+    subscriptions = models.IntegerField(default=0)  # With at least one user plan
+    user_plans = models.IntegerField(default=0)
+    tracked_plans = models.IntegerField(default=0)
+    monthly_cost_cents = models.BigIntegerField(default=0)
+    usage_histogram = models.JSONField(default=list)
+    refreshed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Rollup of category {self.category_id}"
+
+
+class RollupRun(models.Model):
+    """A rollup rebuild. Incremental runs refresh what changed since the last finished run."""
+
+    started_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+    subscriptions = models.IntegerField(default=0)  # Subscription rollups refreshed
+
+    def __str__(self):
+        return f"{'Full' if self.full else 'Incremental'} rollup at {self.started_at}"
+
+    class Meta:
+        ordering = ["-started_at"]
+
+
+class SubscriptionCostIndex(models.Model):
+    """
+    A subscription's cheapest plan per day (free trials excluded), refreshed on Plan writes
+    (see recommendations.py), so cheaper alternatives are found with a single join.
+    """
+
+    subscription = models.OneToOneField(
+        Subscription, on_delete=models.CASCADE, primary_key=True, related_name="cost_index"
+    )
+    cheapest_plan = models.ForeignKey(Plan, on_delete=models.CASCADE, related_name="+")
+    cheapest_daily_cost_micros = models.BigIntegerField()
+
+    def __str__(self):
+        return f"Cheapest plan of subscription {self.subscription_id}"
@@ -0,0 +1,95 @@
+"""
+Fixed-point money helpers. Amounts are handled as integer cents, so analytics can sum
+plain ints (or int64 arrays) instead of Decimal objects, and every result is rounded the
+same way: half up, once, at the end of a calculation.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+from math import lcm
+
+CENTS_PER_UNIT = 100
+
+
+def to_cents(amount):
+    """Converts a Decimal, float, int or numeric string amount to integer cents"""
+    if not isinstance(amount, Decimal):
+        amount = Decimal(str(amount))
+    return int((amount * CENTS_PER_UNIT).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_cents(cents):
+    """Converts cents to a float amount, for JSON responses"""
+    return cents / CENTS_PER_UNIT
+
+
+def cents_to_decimal(cents):
+    return Decimal(cents) / CENTS_PER_UNIT
+
+
+def div_round(numerator, denominator):
+    """Integer division rounded half up (away from zero)"""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+MICROS_PER_CENT = 10000
+
+
+def daily_micros(cents, period):
+    """Cost of `cents` per `period` days as integer micro-units per day, for exact comparisons"""
+    return div_round(cents * MICROS_PER_CENT, period)
+
+
+def micros_to_cents(micros):
+    return div_round(micros, MICROS_PER_CENT)
+
+
+def normalize_cents(cents, period, target_days):
+    """Cost of `cents` per `period` days, normalized to `target_days` (rounded to a cent)"""
+    return div_round(cents * target_days, period)
+
+
+class NormalizedTotal:
+    """
+    Exact sum of costs normalized to a target period.
+    Costs are grouped by billing period and divided once per period when rounding,
+    so summing many plans never accumulates per-row rounding errors.
+    """
+
+    def __init__(self):
+        self.cents_by_period = {}
+
+    def add(self, cents, period):
+        self.cents_by_period[period] = self.cents_by_period.get(period, 0) + cents
+
+    def fraction(self, target_days):
+        """The normalized total as an exact (numerator, denominator) pair of cents"""
+        if not self.cents_by_period:
+            return 0, 1
+        denominator = lcm(*self.cents_by_period)
+        numerator = sum(
+            cents * target_days * (denominator // period)
+            for period, cents in self.cents_by_period.items()
+        )
+        return numerator, denominator
+
+    def cents(self, target_days, divisor=1):
+        """The normalized total (optionally divided, e.g. for averages) rounded to cents"""
+        numerator, denominator = self.fraction(target_days)
+        return div_round(numerator, denominator * divisor)
+
+    def percentage_of(self, total):
+        """This total's share of another, as a percentage rounded to 2 decimal places"""
+        part_numerator, part_denominator = self.fraction(1)
+        total_numerator, total_denominator = total.fraction(1)
+        if not total_numerator:
+            return 0.0
+        return (
+            div_round(
+                part_numerator * total_denominator * 100 * 100,
+                part_denominator * total_numerator,
+            )
+            / 100
+        )
@@ -1,42 +1,24 @@
+import logging
 import os
-import requests
 from dotenv import load_dotenv # Loads environment variables
 
+from . import outbound
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 ONESIGNAL_API_KEY = os.getenv("ONESIGNAL_API_KEY")
 ONESIGNAL_APP_ID = os.getenv("ONESIGNAL_APP_ID")
-ONESIGNAL_API_URL = "https://api.onesignal.com"
-
-
-def check_user_subscription(user_id):
-    """ Checks if a user is resgistered and subscribed to notifications (via OneSignal external_id tag) """
-    url = f"{ONESIGNAL_API_URL}/apps/{ONESIGNAL_APP_ID}/users/by/external_id/{user_id}"
-    headers = {"Authorization": f"Basic {ONESIGNAL_API_KEY}"}
-
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        user_data = response.json()
-
-        # Check if the user is subscribed
-        return user_data.get("subscriptions", [{}])[0].get("notification_types") == 1
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch user data for user {user_id}: {e}")
-        return False
-
-
-def send_push_notification(title, message, *user_ids):
-    """ Sends targeted push notification to the list of subscribed users """
-
-    # Filter valid (subscribed) user IDs
-    valid_user_ids = [str(user_id) for user_id in user_ids if check_user_subscription(user_id)]
+ONESIGNAL_API_URL = os.getenv("ONESIGNAL_API_URL", "https://api.onesignal.com")  # e.g. a fake_onesignal server
 
-    if not valid_user_ids:
-        print("No subscribed users to send notifications to.")
-        return
 
-    # Prepare the notification payload
+def send_batch(title, message, user_ids):
+    """
+    Sends one notification to many users (at most 2000 per OneSignal call) without
+    checking their subscriptions first. Returns the ids OneSignal reported as not
+    subscribed; raises RequestException if the call failed and should be retried.
+    """
     url = f"{ONESIGNAL_API_URL}/notifications"
     headers = {
         "Content-Type": "application/json",
@@ -46,19 +28,17 @@ def send_push_notification(title, message, *user_ids):
         "app_id": ONESIGNAL_APP_ID,
         "headings": {"en": title},
         "contents": {"en": message},
-        "include_external_user_ids": valid_user_ids,
+        "include_external_user_ids": [str(user_id) for user_id in user_ids],
         "target_channel": "push",
     }
 
-    # Send the notification
-    try:
-        response = requests.post(url, json=data, headers=headers)
-        response.raise_for_status()  # Raise an exception for HTTP errors
-        response_data = response.json()
+    response = outbound.post("onesignal", "notifications", url, json=data, headers=headers)
+    response.raise_for_status()
+    errors = response.json().get("errors")
 
-        if "errors" in response_data:
-            print(f"Failed to send notification: {response_data['errors']}")
-        else:
-            print(f"Notification sent successfully: {response_data}")
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to send notification: {e}")
\ No newline at end of file
+    if isinstance(errors, dict):  # Sent, except to these ids
+        return {int(user_id) for user_id in errors.get("invalid_external_user_ids", [])}
+    if errors:  # e.g. "All included players are not subscribed"
+        logger.info("Notification not sent: %s", errors)
+        return set(user_ids)
+    return set()
@@ -0,0 +1,214 @@
+"""
+Shared client for calls to external services (logo.dev, RescueTime, OneSignal).
+Each host gets a pooled keep-alive session with default timeouts, retries with backoff
+for idempotent methods, a circuit breaker and a token-bucket rate limiter, so an outage
+fails calls fast instead of stalling a whole cron run. Calls are recorded in metrics.
+"""
+
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import metrics
+
+DEFAULTS = {
+    "CONNECT_TIMEOUT": 3.05,  # seconds
+    "READ_TIMEOUT": 10,
+    "RETRIES": 2,  # retries of idempotent calls (connection errors, 429 and 5xx)
+    "BACKOFF": 0.5,  # seconds, doubled on every retry
+    "POOL_SIZE": 10,  # keep-alive connections per host
+    "FAILURE_THRESHOLD": 5,  # consecutive failures that open the circuit
+    "RESET_SECONDS": 30,  # how long an open circuit rejects calls before a trial call
+    "RATE": 10,  # calls per second
+    "BURST": 20,
+    "MAX_WAIT": 5,  # longest wait for the rate limiter before failing a call
+}
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def get_setting(name, host=None):
+    config = getattr(settings, "OUTBOUND", {})
+    host_config = config.get("HOSTS", {}).get(host, {})
+    return host_config.get(name, config.get(name, DEFAULTS[name]))
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """The host failed repeatedly and calls to it are rejected for a while"""
+
+
+class RateLimitedError(requests.exceptions.RequestException):
+    """The host's rate limit would have delayed the call for too long"""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_seconds`, then lets a single trial call through (half open) to decide
+    whether to close again. Every allowed call ends in success(), failure() or, if it
+    never got an answer from the host, release().
+    """
+
+    def __init__(self, failure_threshold, reset_seconds):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if self.trial_running or time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self.trial_running = True
+            return True
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_running = False
+
+    def release(self):
+        """Ends a trial call without an outcome, so the next call is let through instead"""
+        with self.lock:
+            self.trial_running = False
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, max_wait):
+        """Takes a token, waiting up to `max_wait` seconds; returns whether it got one"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class HostClient:
+    """Pooled session, circuit breaker and rate limiter for one host"""
+
+    def __init__(self, host):
+        self.host = host
+        self.timeout = (
+            get_setting("CONNECT_TIMEOUT", host),
+            get_setting("READ_TIMEOUT", host),
+        )
+        self.max_wait = get_setting("MAX_WAIT", host)
+        self.breaker = CircuitBreaker(
+            get_setting("FAILURE_THRESHOLD", host), get_setting("RESET_SECONDS", host)
+        )
+        self.bucket = TokenBucket(get_setting("RATE", host), get_setting("BURST", host))
+
+        retry = Retry(
+            total=get_setting("RETRIES", host),
+            backoff_factor=get_setting("BACKOFF", host),
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # idempotent methods only
+            respect_retry_after_header=True,
+            raise_on_status=False,  # return the last response rather than raising
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=get_setting("POOL_SIZE", host), max_retries=retry
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, service, endpoint, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+
+        with metrics.track_outbound(service, endpoint) as call:
+            if not self.breaker.allow():
+                call.status = "circuit_open"
+                raise CircuitOpenError(f"Circuit open for {self.host}")
+            try:
+                if not self.bucket.acquire(self.max_wait):
+                    call.status = "rate_limited"
+                    raise RateLimitedError(f"Rate limit exceeded for {self.host}")
+
+                try:
+                    response = call.record(
+                        self.session.request(method, url, **kwargs),
+                        stream=kwargs.get("stream", False),
+                    )
+                except requests.exceptions.RequestException:
+                    self.breaker.failure()
+                    raise
+                if response.status_code >= 500:
+                    self.breaker.failure()
+                else:
+                    self.breaker.success()
+            finally:
+                # A half-open trial that was rate limited or failed in our code would
+                # otherwise keep the circuit rejecting calls for good
+                self.breaker.release()
+        return response
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(host):
+    # Keyed by pid as well, so forked workers never share their parent's sockets
+    key = (os.getpid(), host)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key) or _clients.setdefault(key, HostClient(host))
+    return client
+
+
+def request(service, endpoint, method, url, **kwargs):
+    """
+    Sends a request through the host's shared client. Raises a RequestException
+    subclass on connection errors, timeouts, an open circuit or rate limiting.
+    """
+    return get_client(urlsplit(url).netloc).request(
+        service, endpoint, method, url, **kwargs
+    )
+
+
+def get(service, endpoint, url, **kwargs):
+    return request(service, endpoint, "GET", url, **kwargs)
+
+
+def post(service, endpoint, url, **kwargs):
+    return request(service, endpoint, "POST", url, **kwargs)
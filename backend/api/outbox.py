@@ -0,0 +1,206 @@
+"""
+DB-backed outbox for push notifications. Cron tasks enqueue events (deduplicated by key),
+and a delivery worker coalesces each user's due events into one digest, then sends users
+with identical digests together in OneSignal batches, retrying failures with backoff.
+
+A OneSignal call has the same content for every user it targets, so digests are templates
+of the event kinds and counts ("3 subscription payments are due soon"), not the events'
+own messages: users with the same counts then share a batch. The per-plan details stay on
+the events (and in the app).
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import notifications
+from .models import NotificationEvent
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    "DIGEST_DELAY": 60,  # seconds events wait for others to coalesce with
+    "BATCH_SIZE": 2000,  # users per OneSignal call (its include_external_user_ids limit)
+    "CLAIM_USERS": 5000,  # users whose events are claimed per delivery round
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_SECONDS": 60,  # doubled after every failed attempt
+    "MAX_BACKOFF_SECONDS": 3600,
+    "LEASE_SECONDS": 300,  # events claimed longer ago are assumed abandoned
+}
+
+
+# Digest title and (singular, plural) line per event kind, see make_digest()
+DIGEST_TEMPLATES = {
+    NotificationEvent.Kind.UPCOMING_PAYMENT: (
+        "Upcoming payment",
+        ("{count} subscription payment is due soon", "{count} subscription payments are due soon"),
+    ),
+    NotificationEvent.Kind.UNUSED_SUBSCRIPTION: (
+        "Unused subscription",
+        ("{count} subscription went unused", "{count} subscriptions went unused"),
+    ),
+}
+
+
+def get_setting(name):
+    return getattr(settings, "NOTIFICATIONS", {}).get(name, DEFAULTS[name])
+
+
+def make_event(user_id, kind, title, message, dedupe_key):
+    return NotificationEvent(
+        user_id=user_id,
+        kind=kind,
+        title=title,
+        message=message,
+        dedupe_key=dedupe_key,
+        next_attempt_at=timezone.now() + timedelta(seconds=get_setting("DIGEST_DELAY")),
+    )
+
+
+def enqueue(events):
+    """Queues events, skipping any whose dedupe key was queued before"""
+    if events:
+        NotificationEvent.objects.bulk_create(events, ignore_conflicts=True)
+
+
+def claim_events(worker_id):
+    """Claims due events with a compare-and-swap, returning them grouped by user"""
+    now = timezone.now()
+    stale = now - timedelta(seconds=get_setting("LEASE_SECONDS"))
+    due = NotificationEvent.objects.filter(
+        Q(status=NotificationEvent.Status.PENDING, next_attempt_at__lte=now)
+        | Q(status=NotificationEvent.Status.SENDING, claimed_at__lt=stale)
+    )
+    # Whole users at a time, so their digests are complete
+    user_ids = list(
+        due.order_by("user_id")
+        .values_list("user_id", flat=True)
+        .distinct()[: get_setting("CLAIM_USERS")]
+    )
+    if not user_ids:
+        return {}
+
+    due.filter(user_id__in=user_ids).update(
+        status=NotificationEvent.Status.SENDING, claimed_by=worker_id, claimed_at=now
+    )
+
+    events_by_user = defaultdict(list)
+    for event in NotificationEvent.objects.filter(
+        status=NotificationEvent.Status.SENDING, claimed_by=worker_id, claimed_at=now
+    ).order_by("created_at"):
+        events_by_user[event.user_id].append(event)
+    return events_by_user
+
+
+def make_digest(events):
+    """One (title, message) for all of a user's due events, from their kinds and counts"""
+    counts = Counter(event.kind for event in events)
+    lines = []
+    for kind, (_, (singular, plural)) in DIGEST_TEMPLATES.items():
+        if counts[kind]:
+            lines.append((singular if counts[kind] == 1 else plural).format(count=counts[kind]))
+    if len(lines) == 1:
+        return DIGEST_TEMPLATES[next(iter(counts))][0], lines[0]
+    return "Subscription updates", "\n".join(lines)
+
+
+def deliver(events_by_user):
+    """Sends digests in batches of users with identical digests; returns counts by outcome"""
+    users_by_digest = defaultdict(list)
+    for user_id, events in events_by_user.items():
+        users_by_digest[make_digest(events)].append(user_id)
+
+    counts = {"sent": 0, "skipped": 0, "failed": 0}
+    batch_size = get_setting("BATCH_SIZE")
+    for (title, message), user_ids in users_by_digest.items():
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start : start + batch_size]
+            batch_events = [event for user_id in batch for event in events_by_user[user_id]]
+            try:
+                unsubscribed = notifications.send_batch(title, message, batch)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Failed to send notifications to %d users: %s", len(batch), e)
+                _retry_later(batch_events, str(e))
+                counts["failed"] += len(batch)
+                continue
+
+            _mark(
+                [e for e in batch_events if e.user_id in unsubscribed],
+                NotificationEvent.Status.SKIPPED,
+            )
+            _mark(
+                [e for e in batch_events if e.user_id not in unsubscribed],
+                NotificationEvent.Status.SENT,
+            )
+            counts["skipped"] += len(set(batch) & unsubscribed)
+            counts["sent"] += len(set(batch) - unsubscribed)
+    return counts
+
+
+def _mark(events, status):
+    if events:
+        NotificationEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+            status=status, attempts=F("attempts") + 1, sent_at=timezone.now()
+        )
+
+
+def _retry_later(events, error):
+    """Backs events off exponentially, giving up after MAX_ATTEMPTS"""
+    now = timezone.now()
+    pks_by_attempts = defaultdict(list)
+    for event in events:
+        pks_by_attempts[event.attempts + 1].append(event.pk)
+
+    for attempts, pks in pks_by_attempts.items():
+        backoff = min(
+            get_setting("BACKOFF_SECONDS") * 2 ** (attempts - 1),
+            get_setting("MAX_BACKOFF_SECONDS"),
+        )
+        NotificationEvent.objects.filter(pk__in=pks).update(
+            status=NotificationEvent.Status.FAILED
+            if attempts >= get_setting("MAX_ATTEMPTS")
+            else NotificationEvent.Status.PENDING,
+            attempts=attempts,
+            next_attempt_at=now + timedelta(seconds=backoff),
+            error=error,
+        )
+
+
+def run_delivery(worker_id, burst=True, poll_interval=10):
+    """
+    Delivers due events until none are left (burst) or forever, polling for new ones.
+    Returns counts by outcome.
+    """
+    totals = {"sent": 0, "skipped": 0, "failed": 0}
+    while True:
+        events_by_user = claim_events(worker_id)
+        if not events_by_user:
+            if burst:
+                return totals
+            time.sleep(poll_interval)
+            continue
+
+        for outcome, count in deliver(events_by_user).items():
+            totals[outcome] += count
+
+
+def start_background_delivery(worker_id):
+    """Delivers due events on a daemon thread of the current process"""
+
+    def work():
+        try:
+            run_delivery(worker_id)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=work, name=f"notifications-{worker_id}", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,211 @@
+"""
+Instrumentation for cron runs: per-phase wall and CPU timers, per-user latencies and
+optional tracemalloc peak memory and cProfile dumps, persisted as a CronRunReport.
+Tasks mark their phases with `phase()`, which is a no-op outside a profiled run.
+"""
+
+import cProfile
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import CronRunReport
+
+DEFAULTS = {
+    "TRACE_MEMORY": False,  # tracemalloc peak memory (slows runs down noticeably)
+    "PROFILE_DIR": None,  # directory for cProfile dumps, disabled if unset
+}
+
+_current = ContextVar("cron_profiler", default=None)
+
+
+def get_setting(name):
+    return getattr(settings, "CRON_PROFILING", {}).get(name, DEFAULTS[name])
+
+
+@contextmanager
+def phase(name):
+    """Times a block as a phase of the current profiled run, if any"""
+    profiler = _current.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.phase(name):
+        yield
+
+
+def percentiles(values, points=(50, 90, 99)):
+    """Nearest-rank percentiles of a list of values"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    result = {
+        f"p{point}": ordered[max(0, -(-point * len(ordered) // 100) - 1)]
+        for point in points
+    }
+    result["max"] = ordered[-1]
+    return result
+
+
+class CronProfiler:
+    """
+    Collects the timings of one cron run (a worker run or one shard of a command run).
+    Use as a context manager around the run, then save() the report. CPU time is the
+    running thread's (time.thread_time()), for the run and its phases alike, so other
+    threads of the process (web requests, other workers) don't count towards it.
+    """
+
+    def __init__(self, kind, trace_memory=None, profile_dir=None, profile_name=None):
+        self.kind = kind
+        self.trace_memory = (
+            get_setting("TRACE_MEMORY") if trace_memory is None else trace_memory
+        )
+        self.profile_dir = profile_dir or get_setting("PROFILE_DIR")
+        self.profile_name = profile_name
+        self.profile_path = None
+
+        self.phases = {}  # name -> [calls, wall seconds, cpu seconds]
+        self.user_latencies = []
+        self.users = self.plans = self.failed = 0
+        self.peak_memory = None
+        self.wall_seconds = self.cpu_seconds = 0.0
+
+        self._profile = None
+        self._owns_tracemalloc = False
+
+    def __enter__(self):
+        self.started_at = timezone.now()
+        self._token = _current.set(self)
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._owns_tracemalloc = True
+        if self.profile_dir:
+            name = self.profile_name or f"{self.kind}-{self.started_at:%Y%m%d-%H%M%S}"
+            self.profile_path = os.path.join(self.profile_dir, f"{name}-{os.getpid()}.prof")
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_seconds = time.perf_counter() - self._wall_start
+        self.cpu_seconds = time.thread_time() - self._cpu_start
+
+        if self._profile:
+            self._profile.disable()
+            self._profile.dump_stats(self.profile_path)
+        if self._owns_tracemalloc:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.peak_memory = peak
+
+        _current.reset(self._token)
+        return False
+
+    @contextmanager
+    def phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += time.perf_counter() - wall
+            stats[2] += time.thread_time() - cpu
+
+    @contextmanager
+    def user(self):
+        """Times the processing of one user"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.user_latencies.append(time.perf_counter() - start)
+            self.users += 1
+
+    def record(self, plans=0, failed=0):
+        self.plans += plans
+        self.failed += failed
+
+    def state(self):
+        """Picklable raw timings, for merging the runs of worker processes"""
+        return {
+            "phases": self.phases,
+            "user_latencies": self.user_latencies,
+            "users": self.users,
+            "plans": self.plans,
+            "failed": self.failed,
+            "peak_memory": self.peak_memory,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "profile_path": self.profile_path,
+        }
+
+    def merge(self, state):
+        """Adds the timings of another (e.g. a shard's) run"""
+        for name, (calls, wall, cpu) in state["phases"].items():
+            stats = self.phases.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += calls
+            stats[1] += wall
+            stats[2] += cpu
+        self.user_latencies.extend(state["user_latencies"])
+        self.users += state["users"]
+        self.plans += state["plans"]
+        self.failed += state["failed"]
+        self.cpu_seconds += state["cpu_seconds"]
+        if state["peak_memory"] is not None:
+            self.peak_memory = max(self.peak_memory or 0, state["peak_memory"])
+
+    def summary(self):
+        return {
+            "users": self.users,
+            "plans": self.plans,
+            "failed": self.failed,
+            "wall_seconds": round(self.wall_seconds, 3),
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "phases": {
+                name: {
+                    "calls": calls,
+                    "wall_seconds": round(wall, 4),
+                    "cpu_seconds": round(cpu, 4),
+                }
+                for name, (calls, wall, cpu) in sorted(
+                    self.phases.items(), key=lambda item: -item[1][1]
+                )
+            },
+            "user_latency_ms": {
+                name: round(seconds * 1000, 2)
+                for name, seconds in percentiles(self.user_latencies).items()
+            },
+            "peak_memory_kb": round(self.peak_memory / 1024, 1)
+            if self.peak_memory is not None
+            else None,
+        }
+
+    def save(self, job=None, worker="", profile_path=None):
+        """Persists the run as a CronRunReport"""
+        summary = self.summary()
+        return CronRunReport.objects.create(
+            kind=self.kind,
+            job=job,
+            worker=worker,
+            started_at=self.started_at,
+            wall_seconds=summary["wall_seconds"],
+            cpu_seconds=summary["cpu_seconds"],
+            users=self.users,
+            plans=self.plans,
+            failed_users=self.failed,
+            phases=summary["phases"],
+            user_latency_ms=summary["user_latency_ms"],
+            peak_memory_kb=summary["peak_memory_kb"],
+            profile_path=profile_path or self.profile_path or "",
+        )
@@ -0,0 +1,127 @@
+"""
+Cheaper plan recommendations. Each subscription's cheapest plan per day is kept in
+SubscriptionCostIndex, refreshed whenever one of its plans is saved or deleted, so a user's
+plans with a cheaper sibling are found with one query joining through the index.
+"""
+
+from django.db.models import F, OuterRef, Subquery
+
+from .models import Plan, SubscriptionCostIndex, UserPlan
+from .money import daily_micros, from_cents, micros_to_cents, to_cents
+
+YEAR_DAYS = Plan.Period.YEAR
+
+
+def refresh_cost_index(subscription_id, using=None):
+    """Points the subscription's index entry at its cheapest plan (or drops it)"""
+    cheapest = (
+        Plan.objects.using(using)
+        .filter(subscription_id=subscription_id, free_trial=False)
+        .order_by("daily_cost_micros", "pk")
+        .first()
+    )
+    if cheapest is None:
+        SubscriptionCostIndex.objects.using(using).filter(subscription_id=subscription_id).delete()
+        return
+
+    SubscriptionCostIndex.objects.using(using).update_or_create(
+        subscription_id=subscription_id,
+        defaults={
+            "cheapest_plan": cheapest,
+            "cheapest_daily_cost_micros": cheapest.daily_cost_micros,
+        },
+    )
+
+
+def plan_changed(sender, instance, using, **kwargs):
+    """post_save/post_delete receiver for Plan (a moved plan leaves its old subscription)"""
+    refresh_cost_index(instance.subscription_id, using)
+    old_subscription_id = instance.loaded_value("subscription_id")
+    if old_subscription_id not in (None, instance.subscription_id):
+        refresh_cost_index(old_subscription_id, using)
+
+
+def rebuild_cost_index():
+    """Recomputes every plan's daily cost and the whole index; returns the index size"""
+    plans = list(Plan.objects.all())
+    for plan in plans:
+        plan.daily_cost_micros = daily_micros(to_cents(plan.cost), plan.period)
+    Plan.objects.bulk_update(plans, ["daily_cost_micros"], batch_size=1000)
+
+    cheapest = {}
+    for plan in sorted(plans, key=lambda plan: (plan.daily_cost_micros, plan.pk)):
+        if not plan.free_trial:
+            cheapest.setdefault(plan.subscription_id, plan)
+
+    SubscriptionCostIndex.objects.all().delete()
+    SubscriptionCostIndex.objects.bulk_create(
+        SubscriptionCostIndex(
+            subscription_id=subscription_id,
+            cheapest_plan=plan,
+            cheapest_daily_cost_micros=plan.daily_cost_micros,
+        )
+        for subscription_id, plan in cheapest.items()
+    )
+    return len(cheapest)
+
+
+def sync_user_plans(batch_size=5000):
+    """
+    Copies each plan's daily cost and category onto its user plans (UserPlan.save() and
+    Plan/Subscription.save() keep them in sync, bulk writes don't). Updates pk ranges so
+    each statement stays short; returns how many user plans changed.
+    """
+    plans = Plan.objects.filter(pk=OuterRef("plan_id"))
+    cost = Subquery(plans.values("daily_cost_micros")[:1])
+    category = Subquery(plans.values("subscription__category_id")[:1])
+
+    last_pk = UserPlan.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+    changed = 0
+    for start in range(0, last_pk, batch_size):
+        changed += (
+            UserPlan.objects.filter(pk__gt=start, pk__lte=start + batch_size)
+            .exclude(daily_cost_micros=cost, category_id=category)
+            .update(daily_cost_micros=cost, category_id=category)
+        )
+    return changed
+
+
+def find_cheaper_plans(user):
+    """The user's plans with a cheaper plan of the same subscription, biggest savings first"""
+    user_plans = (
+        UserPlan.objects.filter(
+            user=user,
+            plan__free_trial=False,
+            plan__daily_cost_micros__gt=F(
+                "plan__subscription__cost_index__cheapest_daily_cost_micros"
+            ),
+        )
+        .select_related("plan__subscription__cost_index__cheapest_plan")
+        .annotate(
+            savings_micros=F("plan__daily_cost_micros")
+            - F("plan__subscription__cost_index__cheapest_daily_cost_micros")
+        )
+        .order_by("-savings_micros", "pk")
+    )
+
+    return [
+        {
+            "user_plan_id": user_plan.pk,
+            "subscription": user_plan.plan.subscription.name,
+            "current_plan": _plan_data(user_plan.plan),
+            "cheaper_plan": _plan_data(user_plan.plan.subscription.cost_index.cheapest_plan),
+            "annual_savings": from_cents(
+                micros_to_cents(user_plan.savings_micros * YEAR_DAYS)
+            ),
+        }
+        for user_plan in user_plans
+    ]
+
+
+def _plan_data(plan):
+    return {
+        "id": plan.pk,
+        "name": plan.name,
+        "cost": float(plan.cost),
+        "period": Plan.Period.get_label(plan.period),
+    }
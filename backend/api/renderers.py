@@ -0,0 +1,45 @@
+"""
+JSON renderer and parser backed by orjson when it is installed (DRF's stdlib json ones
+otherwise). The output matches JSONRenderer's: compact, UTF-8, Decimals as numbers
+(COERCE_DECIMAL_TO_STRING is off), datetimes and other types through DRF's encoder.
+"""
+
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # Optional, the stdlib json renderer is used instead
+    orjson = None
+
+if orjson is not None:
+    # Datetimes go through DRF's encoder too, so their format is unchanged
+    DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+
+class FastJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Indented output (e.g. "Accept: application/json; indent=4") is left to DRF
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=DUMPS_OPTIONS)
+        # Escaped like JSONRenderer does, for JSON embedded in JavaScript
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+class FastJSONParser(JSONParser):
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError(f"JSON parse error - {exc}")
@@ -0,0 +1,187 @@
+"""
+Platform-wide rollups of user plans per subscription and category (popularity, normalized
+costs and usage score histograms), so catalog stats are served without scanning UserPlan.
+Runs are incremental: only subscriptions whose user plans or plans changed since the last
+run (UserPlan/Plan.updated_at), or lost a user plan (the dirty flag), are re-aggregated.
+"""
+
+import logging
+import threading
+
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import (
+    USAGE_SCORE_CHOICES,
+    CategoryRollup,
+    Plan,
+    RollupRun,
+    SubscriptionRollup,
+    UserPlan,
+)
+from .money import normalize_cents, to_cents
+
+logger = logging.getLogger(__name__)
+
+SCORES = [score for score, _ in USAGE_SCORE_CHOICES]
+MONTH_DAYS = Plan.Period.MONTH
+ID_BATCH_SIZE = 500  # subscription ids per query, below SQLite's variable limit
+
+
+def changed_subscription_ids(since):
+    """Subscriptions whose rollups are out of date since `since`"""
+    ids = set(
+        UserPlan.objects.filter(updated_at__gte=since)
+        .order_by()
+        .values_list("plan__subscription_id", flat=True)
+        .distinct()
+    )
+    ids.update(
+        Plan.objects.filter(updated_at__gte=since).values_list("subscription_id", flat=True)
+    )
+    ids.update(SubscriptionRollup.objects.filter(dirty=True).values_list("pk", flat=True))
+    return ids
+
+
+def aggregate_subscriptions(user_plans):
+    """Rollups (unsaved) of the subscriptions of the given user plans, keyed by subscription id"""
+    rows = (
+        user_plans.order_by()  # No default ordering in the GROUP BY
+        .values("plan__subscription_id", "plan__cost", "plan__period")
+        .annotate(
+            count=Count("id"),
+            tracked=Count("id", filter=Q(track_usage=True)),
+            **{
+                f"score_{score}": Count("id", filter=Q(track_usage=True, usage_score=score))
+                for score in SCORES
+            },
+        )
+    )
+
+    rollups = {}
+    for row in rows:
+        subscription_id = row["plan__subscription_id"]
+        rollup = rollups.get(subscription_id)
+        if rollup is None:
+            rollup = rollups[subscription_id] = SubscriptionRollup(
+                subscription_id=subscription_id, usage_histogram=[0] * len(SCORES)
+            )
+        rollup.user_plans += row["count"]
+        rollup.tracked_plans += row["tracked"]
+        rollup.monthly_cost_cents += row["count"] * normalize_cents(
+            to_cents(row["plan__cost"]), row["plan__period"], MONTH_DAYS
+        )
+        for i, score in enumerate(SCORES):
+            rollup.usage_histogram[i] += row[f"score_{score}"]
+    return rollups
+
+
+def refresh_subscriptions(subscription_ids=None):
+    """Re-aggregates the given subscriptions (all if None); returns how many were refreshed"""
+    if subscription_ids is None:
+        rollups = aggregate_subscriptions(UserPlan.objects.all())
+        SubscriptionRollup.objects.all().delete()
+        SubscriptionRollup.objects.bulk_create(rollups.values(), batch_size=1000)
+        return len(rollups)
+
+    subscription_ids = list(subscription_ids)
+    for start in range(0, len(subscription_ids), ID_BATCH_SIZE):
+        batch = subscription_ids[start : start + ID_BATCH_SIZE]
+        rollups = aggregate_subscriptions(
+            UserPlan.objects.filter(plan__subscription_id__in=batch)
+        )
+        # Subscriptions left without user plans simply lose their rollup
+        SubscriptionRollup.objects.filter(pk__in=batch).delete()
+        SubscriptionRollup.objects.bulk_create(rollups.values())
+    return len(subscription_ids)
+
+
+def refresh_categories():
+    """Sums subscription rollups per category (cheap: one row per catalog subscription)"""
+    rollups = {}
+    for subscription_rollup in SubscriptionRollup.objects.select_related("subscription"):
+        category_id = subscription_rollup.subscription.category_id
+        rollup = rollups.get(category_id)
+        if rollup is None:
+            rollup = rollups[category_id] = CategoryRollup(
+                category_id=category_id, usage_histogram=[0] * len(SCORES)
+            )
+        rollup.subscriptions += 1
+        rollup.user_plans += subscription_rollup.user_plans
+        rollup.tracked_plans += subscription_rollup.tracked_plans
+        rollup.monthly_cost_cents += subscription_rollup.monthly_cost_cents
+        for i, count in enumerate(subscription_rollup.usage_histogram):
+            rollup.usage_histogram[i] += count
+
+    CategoryRollup.objects.all().delete()
+    CategoryRollup.objects.bulk_create(rollups.values())
+    return len(rollups)
+
+
+def run_rollups(full=False):
+    """
+    Refreshes the rollups, incrementally unless `full` or no run has finished yet.
+    Changes made during a run are picked up by the next one. Returns the RollupRun.
+    """
+    last_run = RollupRun.objects.filter(finished_at__isnull=False).first()
+    run = RollupRun.objects.create(full=full or last_run is None)
+
+    with transaction.atomic():
+        if run.full:
+            run.subscriptions = refresh_subscriptions()
+        else:
+            run.subscriptions = refresh_subscriptions(
+                changed_subscription_ids(last_run.started_at)
+            )
+        refresh_categories()
+
+    run.finished_at = timezone.now()
+    run.save(update_fields=["subscriptions", "finished_at"])
+    logger.info(
+        "%s rollup refreshed %d subscriptions in %.2fs",
+        "Full" if run.full else "Incremental",
+        run.subscriptions,
+        (run.finished_at - run.started_at).total_seconds(),
+    )
+    return run
+
+
+def start_background_rollups(full=False):
+    """Runs the rollups on a daemon thread of the current process"""
+
+    def work():
+        try:
+            run_rollups(full=full)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=work, name="rollups", daemon=True)
+    thread.start()
+    return thread
+
+
+def mark_dirty(sender, instance, using, **kwargs):
+    """post_delete receiver flagging the rollup of a deleted user plan's subscription"""
+    SubscriptionRollup.objects.using(using).filter(subscription__plans=instance.plan_id).update(
+        dirty=True
+    )
+
+
+def user_plan_moved(sender, instance, created, using, **kwargs):
+    """
+    post_save receiver for UserPlan. A user plan switched to another plan is picked up by
+    its new subscription's updated_at check, so only the one it left is flagged.
+    """
+    old_plan_id = instance.loaded_value("plan_id")
+    if not created and old_plan_id is not None and old_plan_id != instance.plan_id:
+        SubscriptionRollup.objects.using(using).filter(subscription__plans=old_plan_id).update(
+            dirty=True
+        )
+
+
+def plan_moved(sender, instance, created, using, **kwargs):
+    """post_save receiver for Plan, flagging the subscription a plan was moved away from"""
+    old_subscription_id = instance.loaded_value("subscription_id")
+    if not created and old_subscription_id not in (None, instance.subscription_id):
+        SubscriptionRollup.objects.using(using).filter(pk=old_subscription_id).update(dirty=True)
@@ -0,0 +1,124 @@
+"""
+Primary/replica database routing. Only code that opts in (views using ReplicaReadMixin,
+or `with replica_reads():`) reads from the replica; everything else, and every write,
+uses the primary. Once a request writes, its remaining reads stay on the primary, and the
+user's next requests do too for REPLICATION_LAG seconds, so they always see their writes.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.permissions import SAFE_METHODS
+
+DEFAULTS = {
+    "REPLICA": "replica",  # alias in settings.DATABASES, routing is off without it
+    "REPLICATION_LAG": 5,  # seconds a user's reads stay on the primary after a write
+}
+
+
+def get_setting(name):
+    return getattr(settings, "DATABASE_ROUTING", {}).get(name, DEFAULTS[name])
+
+
+def replica_alias():
+    """The configured replica's alias, or None if there is no replica"""
+    alias = get_setting("REPLICA")
+    return alias if alias in settings.DATABASES else None
+
+
+class RoutingState:
+    """Per request (or block) routing state, shared by reference with sync_to_async threads"""
+
+    def __init__(self):
+        self.use_replica = False
+        self.wrote = False
+
+
+_state = ContextVar("database_routing", default=None)
+
+
+@contextmanager
+def routing_scope():
+    """Tracks writes for the duration of the block (see DatabaseRoutingMiddleware)"""
+    state = RoutingState()
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def replica_reads():
+    """Sends reads in the block to the replica, until the block writes"""
+    state = _state.get()
+    if state is None:
+        with routing_scope() as state:
+            state.use_replica = True
+            yield state
+        return
+
+    previous = state.use_replica
+    state.use_replica = True
+    try:
+        yield state
+    finally:
+        state.use_replica = previous
+
+
+def _pin_key(user_id):
+    return f"database-routing:primary:{user_id}"
+
+
+def pin_to_primary(user_id):
+    """Keeps the user's reads on the primary until the replica has caught up"""
+    lag = get_setting("REPLICATION_LAG")
+    if lag:
+        cache.set(_pin_key(user_id), True, lag)
+
+
+def is_pinned(user_id):
+    return cache.get(_pin_key(user_id), False)
+
+
+async def ais_pinned(user_id):
+    return await cache.aget(_pin_key(user_id), False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is not None and state.use_replica and not state.wrote:
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data, so objects from either database may be related
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Serves a DRF view's safe (read-only) requests from the replica. Authentication still
+    reads from the primary, and users who wrote recently are kept on it.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        state = _state.get()
+        if (
+            state is not None
+            and request.method in SAFE_METHODS
+            and not is_pinned(request.user.pk)
+        ):
+            state.use_replica = True
@@ -1,13 +1,19 @@
+import csv
+import logging
+from array import array
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 
-from io import StringIO
-import requests
+from . import outbound
+
+logger = logging.getLogger(__name__)
 
 
-def fetch_data(api_key, start_date, end_date):
+def fetch_lines(api_key, start_date, end_date):
     """
-    Fetch RescueTime's summary data analytics from start_date and end_date.
+    Stream RescueTime's summary data analytics from start_date and end_date as CSV lines.
     Dates is in YYYY-MM-DD form.
     """
     url = "https://www.rescuetime.com/anapi/data"
@@ -20,25 +26,69 @@ def fetch_data(api_key, start_date, end_date):
         "format": "csv",
     }
 
-    # Format url with query params
-    full_url = url + "?" + "&".join([f"{key}={value}" for key, value in params.items()])
+    response = outbound.get("rescuetime", "data", url, params=params, stream=True)
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()  # Ends the call's latency measurement (see metrics.OutboundCall)
+        raise
+    response.encoding = response.encoding or "utf-8"
+    return _iter_lines(response)
 
-    response = requests.get(url, params=params)
-    print(response.text)
-    if response.ok:
-        data = StringIO(response.text) # converts response character stream into a file-object
-        df = pd.read_csv(data) # parses file as a csv dataframe
 
-        # Preprocess data
-        df["Date"] = pd.to_datetime(df["Date"]) # convert date strings to datetime type
-        df = df.rename(columns={"Time Spent (seconds)": "Time"})
-        df = df.groupby(["Date", "Activity"])["Time"].sum().reset_index() # merge duplicates
-        df = df.pivot(index="Date", columns="Activity", values="Time") # organize by date
-        df = df.fillna(0) # assume 0 for missing cells
+def _iter_lines(response):
+    """Yields the response body line by line, without holding all of it in memory"""
+    with response:
+        yield from response.iter_lines(decode_unicode=True)
 
-        return df
-    else:
-        response.raise_for_status()
+
+def parse_csv(lines, activities=None):
+    """
+    Parses RescueTime CSV lines into a dataframe of time spent per activity (columns) per day (rows).
+    Rows are read one at a time into integer codes, and only `activities` (all if None) are kept,
+    so the (int32) frame holds just the columns the caller needs.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if not header:
+        return pd.DataFrame(dtype="int32")
+
+    date_col = header.index("Date")
+    time_col = header.index("Time Spent (seconds)")
+    activity_col = header.index("Activity")
+    width = max(date_col, time_col, activity_col)
+
+    date_codes = {}
+    activity_codes = {}
+    rows = array("i")  # flat (date code, activity code, seconds) triples
+
+    for row in reader:
+        if len(row) <= width:  # blank or truncated lines
+            continue
+        # Every date is kept, so days without tracked activity count as zero usage
+        date_code = date_codes.setdefault(row[date_col], len(date_codes))
+        activity = row[activity_col]
+        if activities is not None and activity not in activities:
+            continue
+        activity_code = activity_codes.setdefault(activity, len(activity_codes))
+        rows.extend((date_code, activity_code, int(row[time_col])))
+
+    # Sum duplicate (date, activity) pairs straight into the pivoted matrix
+    triples = np.frombuffer(rows, dtype=np.int32).reshape(-1, 3)
+    matrix = np.zeros((len(date_codes), len(activity_codes)), dtype=np.int32)
+    np.add.at(matrix, (triples[:, 0], triples[:, 1]), triples[:, 2])
+
+    df = pd.DataFrame(
+        matrix,
+        index=pd.DatetimeIndex(pd.to_datetime(list(date_codes)), name="Date"),
+        columns=pd.Index(list(activity_codes), name="Activity"),
+    )
+    return df.sort_index() # organize by date
+
+
+def fetch_data(api_key, start_date, end_date, activities=None):
+    """Fetch and parse RescueTime's summary data analytics (see fetch_lines and parse_csv)"""
+    return parse_csv(fetch_lines(api_key, start_date, end_date), activities)
 
 def _calculate_moving_average(data, window_size):
     """
@@ -61,27 +111,27 @@ def _calculate_moving_average(data, window_size):
     return moving_averages
 
 
-def calculate_usage(subscription_name, df, threshold=300, window_size=7, trend_period=14, trend_threshold=0.8):
+def calculate_usage(usage, name="subscription", threshold=300, window_size=7, trend_period=14, trend_threshold=0.8):
     """
-    Grades a subscription's usage from 1 to 10 based on screentime data.
-    It analyzes usage patterns over time, including a moving average
+    Grades a subscription's usage from 1 to 10 based on its daily screentime series
+    (see aliases.AliasIndex.usage). It analyzes usage patterns over time, including a moving average
     for more stable results and compares with trends in historical data to detect if it's downward.
     """
 
-    if subscription_name not in df.columns:
-        print(f"Warning: '{subscription_name}' not found in the data.")
+    if usage is None:
+        logger.warning("'%s' not found in the data.", name)
         return 0
     
-    if len(df) < trend_period:
-        print(f"Warning: Not enough data to calculate the moving average for {subscription_name}.")
+    if len(usage) < trend_period:
+        logger.warning("Not enough data to calculate the moving average for %s.", name)
         return 0
 
     # Call to calculate the moving average with an internal method
-    df[f"{subscription_name}_MA"] = _calculate_moving_average(df[subscription_name], window_size)
+    moving_averages = _calculate_moving_average(usage.to_numpy(dtype="float64"), window_size)
 
     # Get the most recent and older moving averages
-    recent_ma = df[f"{subscription_name}_MA"].iloc[-1]  # most recent moving average
-    older_ma = df[f"{subscription_name}_MA"].iloc[-trend_period]  # moving average for trend_period days ago
+    recent_ma = moving_averages[-1]  # most recent moving average
+    older_ma = moving_averages[-trend_period]  # moving average for trend_period days ago
 
     # Calculate the base score (0 to 10) based on the moving average and threshold
     if recent_ma >= threshold:
@@ -106,7 +156,10 @@ def display_data(df): # Maintenance function: Plots usage data for all subscript
 def display_subscriptions(subscription_name, df): # Maintenance function: Plots usage data for one subscription
     if subscription_name in df.columns:
         # Use a dataframe with only subscription related column
-        plot_df = df[[subscription_name, f"{subscription_name}_MA"]]
+        plot_df = df[[subscription_name]].copy()
+        plot_df[f"{subscription_name}_MA"] = _calculate_moving_average(
+            plot_df[subscription_name].to_numpy(), 7
+        )
 
         # Plot the data
         plt.figure(figsize=(12, 6))
@@ -1,7 +1,20 @@
+from decimal import Decimal
+
 from rest_framework import serializers
 from django.contrib.auth import authenticate
 
-from .models import User, Category, Subscription, Plan, UserPlan
+from .models import (
+    User,
+    Category,
+    Subscription,
+    Plan,
+    UserPlan,
+    CronJob,
+    CronRunReport,
+)
+from .fieldsets import SparseFieldsetSerializerMixin
+from .jobs import get_job_progress
+from .money import from_cents
 
 
 class LoginUserSerializer(serializers.Serializer):
@@ -75,15 +88,32 @@ class PeriodQueryParamSerializer(serializers.Serializer):
         return None
 
 
-class PlanSerializer(serializers.ModelSerializer):
+class BudgetRequestSerializer(PeriodQueryParamSerializer):
+    """JSON body of a budget with optional per-category caps, in the period's currency"""
+
+    budget = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal(0))
+    category_caps = serializers.DictField(
+        child=serializers.DecimalField(max_digits=10, decimal_places=2, min_value=Decimal(0)),
+        required=False,
+        default=dict,
+    )
+
+    def validate_category_caps(self, value):
+        try:
+            return {int(category_id): cap for category_id, cap in value.items()}
+        except ValueError:
+            raise serializers.ValidationError("Category ids must be integers")
+
+
+class PlanSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     period = PeriodField()
 
     class Meta:
         model = Plan
-        fields = "__all__"
+        exclude = ["daily_cost_micros"]  # Internal, derived in Plan.save()
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     plans = PlanSerializer(many=True, required=False)
 
     class Meta:
@@ -91,27 +121,35 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class UserPlanSerializer(serializers.ModelSerializer):
-    plan_id = serializers.IntegerField(source="plan.id", read_only=True)
+class UserPlanSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
+    plan_id = serializers.IntegerField(read_only=True)
     plan_name = serializers.CharField(source="plan.name", read_only=True)
     period = PeriodField(source="plan.period", read_only=True)
     free_trial = serializers.BooleanField(source="plan.free_trial", read_only=True)
 
     subscription_id = serializers.IntegerField(
-        source="plan.subscription.id", read_only=True
+        source="plan.subscription_id", read_only=True
     )
     subscription_name = serializers.CharField(
         source="plan.subscription.name", read_only=True
     )
     icon_url = serializers.URLField(source="plan.subscription.icon_url", read_only=True)
-    category_id = serializers.IntegerField(
-        source="plan.subscription.category.id", read_only=True
-    )
+    category_id = serializers.IntegerField(read_only=True)  # Denormalized copy
+    total_spent = serializers.SerializerMethodField()
 
     class Meta:
         model = UserPlan
-        fields = "__all__"
+        exclude = ["total_spent_cents", "daily_cost_micros", "category"]
         read_only_fields = ("user",)
+        # What fields set outside of their source read (see fieldsets.py)
+        field_sources = {
+            "total_spent": ["total_spent_cents"],
+            "cost": ["plan.cost"],  # Unless annotated by the view
+            "user": ["user.username"],
+        }
+
+    def get_total_spent(self, instance):
+        return from_cents(instance.total_spent_cents)
 
     def validate(self, data):
         user = self.context["request"].user
@@ -130,12 +168,47 @@ class UserPlanSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
 
         # Handle annotated cost from view calculations
-        annotated_cost = getattr(instance, "cost", None)
-        representation["cost"] = (
-            annotated_cost if annotated_cost is not None else instance.plan.cost
-        )
+        if self.wants("cost"):
+            annotated_cost = getattr(instance, "cost", None)
+            representation["cost"] = (
+                annotated_cost if annotated_cost is not None else instance.plan.cost
+            )
 
         # Format user information
-        representation["user"] = instance.user.username
+        if "user" in representation:
+            representation["user"] = instance.user.username
 
         return representation
+
+
+class CronRunReportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CronRunReport
+        exclude = ["job"]
+
+
+class CronJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+    report = serializers.SerializerMethodField()
+
+    class Meta:
+        model = CronJob
+        fields = [
+            "id",
+            "kind",
+            "status",
+            "chunk_size",
+            "total_users",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "progress",
+            "report",
+        ]
+
+    def get_progress(self, job):
+        return get_job_progress(job)
+
+    def get_report(self, job):
+        report = job.reports.first()
+        return CronRunReportSerializer(report).data if report else None
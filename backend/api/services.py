@@ -1,10 +1,59 @@
+from collections import namedtuple
 from datetime import date, timedelta
 
-from decimal import Decimal
-from django.db.models import DecimalField, ExpressionWrapper, F, Avg
-from django.db.models.functions import Coalesce
 from django.utils import timezone
 
+from .models import Plan
+from .money import NormalizedTotal, from_cents, to_cents
+
+
+PortfolioRow = namedtuple(
+    "PortfolioRow",
+    ["cost_cents", "period", "payment_date", "usage_score", "category", "icon"],
+)
+
+
+class PlanPortfolio:
+    """
+    Compact in-memory snapshot of a user's plans, loaded with a single query.
+    All analytics calculations run on it, so a dashboard can share one fetch.
+    Costs are held as integer cents (see money.py).
+    """
+
+    FIELDS = [
+        "plan__cost",
+        "plan__period",
+        "payment_date",
+        "usage_score",
+        "plan__subscription__category__name",
+        "plan__subscription__category__icon_emoji",
+    ]
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    @staticmethod
+    def _make_row(cost, *values):
+        return PortfolioRow(to_cents(cost), *values)
+
+    @classmethod
+    def from_queryset(cls, user_plans):
+        return cls(
+            [cls._make_row(*row) for row in user_plans.values_list(*cls.FIELDS)]
+        )
+
+    @classmethod
+    async def afrom_queryset(cls, user_plans):
+        """Async from_queryset() for async views"""
+        # values() rather than values_list(): Django 5.1 runs a values_list() query
+        # eagerly inside aiterator(), i.e. synchronously in the event loop
+        return cls(
+            [
+                cls._make_row(*(row[field] for field in cls.FIELDS))
+                async for row in user_plans.values(*cls.FIELDS).aiterator()
+            ]
+        )
+
 
 class SpendingCalculator:
     """Calculating subscription spending statistics."""
@@ -17,8 +66,8 @@ class SpendingCalculator:
         ("year", 365),
     ]
 
-    def __init__(self, user_plans):
-        self.user_plans = user_plans.select_related("plan")
+    def __init__(self, portfolio):
+        self.portfolio = portfolio
 
     def calculate_spending(self, periods):
         """Calculates total spending over each of the time periods."""
@@ -28,7 +77,7 @@ class SpendingCalculator:
         for period_name, days in periods:
             start_date = end_date - timedelta(days=days)
             total = self._calculate_range_spending(start_date, end_date)
-            results[period_name] = round(total, 2)
+            results[period_name] = from_cents(total)
 
         return results
 
@@ -36,30 +85,29 @@ class SpendingCalculator:
         """Calculate spending over a custom time period (__ days)"""
         end_date = timezone.localdate()
         start_date = end_date - timedelta(days=days)
-        return round(self._calculate_range_spending(start_date, end_date), 2)
+        return from_cents(self._calculate_range_spending(start_date, end_date))
 
     def _calculate_range_spending(self, start_date, end_date):
-        """Calculates the spending within a range"""
-        total = 0.0
+        """Calculates the spending (in cents) within a range"""
+        total = 0
 
-        for user_plan in self.user_plans:
-            plan = user_plan.plan
-            if plan.period <= 0:
+        for row in self.portfolio.rows:
+            if row.period <= 0:
                 continue
 
-            payment_date = user_plan.payment_date
+            payment_date = row.payment_date
             if payment_date > end_date:
                 payment_date = self._adjust_payment_date(
-                    payment_date, end_date, plan.period
+                    payment_date, end_date, row.period
                 )
 
             if payment_date < start_date:
                 continue
 
             num_payments = self._count_payments_in_range(
-                payment_date, start_date, plan.period
+                payment_date, start_date, row.period
             )
-            total += num_payments * float(plan.cost)
+            total += num_payments * row.cost_cents
 
         return total
 
@@ -80,32 +128,72 @@ class SpendingCalculator:
 class AverageSpendingCalculator:
     """Calculating average (normalized) spending statistics"""
 
-    def __init__(self, user_plans):
-        self.queryset = user_plans.select_related("plan").only(
-            "plan__cost", "plan__period"
-        )
+    def __init__(self, portfolio):
+        self.portfolio = portfolio
 
     def calculate_averages(self, periods):
         """Calculate normalized averages for multiple periods"""
         results = {}
 
+        # Costs only need summing once, normalizing to each period is exact
+        total = NormalizedTotal()
+        count = 0
+        for row in self.portfolio.rows:
+            if row.period:  # Avoid divide by zero error
+                total.add(row.cost_cents, row.period)
+                count += 1
+
         for period_days, period_label in periods:
-            avg = self._calculate_normalized_average(period_days)
-            results[period_label] = round(avg, 2)
+            avg = total.cents(period_days, divisor=count) if count else 0
+            results[period_label] = from_cents(avg)
 
         return results
 
-    def _calculate_normalized_average(self, period_days: int) -> float:
-        """Core calculation for a single period"""
-        queryset = self.queryset.annotate(
-            normalized_cost=ExpressionWrapper(
-                F("plan__cost") * period_days / F("plan__period"),
-                output_field=DecimalField(max_digits=10, decimal_places=2),
-            )
-        )
 
-        aggregate = queryset.aggregate(
-            average=Coalesce(Avg("normalized_cost"), Decimal(0))
-        )
+def calculate_spending_by_category(portfolio):
+    """Normalized spending and share of total spending per category, for each period"""
+    # Get all periods from Plan model
+    periods = Plan.Period.choices
+    totals = NormalizedTotal()
+    category_totals = {}
+    icons = {}
+
+    for row in portfolio.rows:
+        if row.period == 0:  # Avoid divide by zero error
+            continue
+
+        if row.category not in category_totals:
+            category_totals[row.category] = NormalizedTotal()
+            icons[row.category] = row.icon
+
+        category_totals[row.category].add(row.cost_cents, row.period)
+        totals.add(row.cost_cents, row.period)
+
+    # Normalize to each period and format response (shares are the same for all periods)
+    spending_data = {}
+    for category, category_total in category_totals.items():
+        share = category_total.percentage_of(totals)
+        spending_data[category] = {
+            "icon": icons[category],
+            "costs": {
+                label: from_cents(category_total.cents(days)) for days, label in periods
+            },
+            "percentages": {label: share for _, label in periods},
+        }
+
+    return spending_data
+
+
+def calculate_usage_by_category(portfolio):
+    """Sums usage scores per category"""
+    usage_by_category = {}
+
+    for row in portfolio.rows:
+        category = row.category
+        usage_score = row.usage_score
+
+        if category not in usage_by_category:
+            usage_by_category[category] = 0
+        usage_by_category[category] += usage_score
 
-        return float(aggregate["average"])
+    return usage_by_category
@@ -0,0 +1,142 @@
+"""
+Runs cron tasks over shards of users on a process pool (see the update_payment_plans
+and update_unused_plans management commands). Plans are protected from double processing
+by the row locks and claim markers in the tasks themselves, so shards may safely overlap
+with other runs.
+"""
+
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.db import connections
+from django.db.models import F
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from . import tasks
+from .profiling import CronProfiler
+
+logger = logging.getLogger(__name__)
+
+SHARD_STRATEGIES = ["range", "hash"]
+
+
+def get_range_bounds(user_ids, num_shards):
+    """Splits sorted user ids into contiguous, evenly sized (lower, upper) id ranges"""
+    bounds = []
+    size, extra = divmod(len(user_ids), num_shards)
+    start = 0
+    for shard in range(num_shards):
+        end = start + size + (1 if shard < extra else 0)
+        if start < end:
+            bounds.append((user_ids[start], user_ids[end - 1]))
+        start = end
+    return bounds
+
+
+def get_shards(task_name, strategy, num_shards):
+    """Describes each shard as a picklable spec a worker process can turn into a queryset"""
+    if strategy == "hash":
+        return [("hash", shard, num_shards) for shard in range(num_shards)]
+
+    get_users, _ = tasks.TASKS[task_name]
+    user_ids = list(get_users().order_by("id").values_list("id", flat=True))
+    return [
+        ("range", lower, upper)
+        for lower, upper in get_range_bounds(user_ids, num_shards)
+    ]
+
+
+def get_shard_users(task_name, shard):
+    get_users, _ = tasks.TASKS[task_name]
+    users = get_users()
+
+    strategy, first, second = shard
+    if strategy == "hash":
+        return users.annotate(shard=Mod(F("id"), second)).filter(shard=first)
+    return users.filter(id__range=(first, second))
+
+
+def run_shard(task_name, shard, trace_memory=None, profile_dir=None):
+    """Processes one shard, returning its timings (see CronProfiler.state())"""
+    _, run_task = tasks.TASKS[task_name]
+    profiler = CronProfiler(
+        task_name,
+        trace_memory=trace_memory,
+        profile_dir=profile_dir,
+        profile_name=f"{task_name}-{shard[0]}-{shard[1]}-{shard[2]}",
+    )
+
+    with profiler:
+        for user in get_shard_users(task_name, shard).order_by("id").iterator():
+            plans = failed = 0
+            with profiler.user():
+                try:
+                    plans = run_task(user)
+                except Exception as e:
+                    failed = 1
+                    logger.exception(
+                        "Error processing %s task for user %s: %s", task_name, user.id, e
+                    )
+            profiler.record(plans=plans, failed=failed)
+
+    connections.close_all()
+    return profiler.state()
+
+
+def _init_worker():
+    django.setup()  # No-op for forked workers, required for spawned ones
+    connections.close_all()  # Never reuse a connection inherited from the parent
+
+
+def run_sharded(task_name, strategy="range", workers=1, trace_memory=None, profile_dir=None):
+    """
+    Runs a cron task over `workers` shards in parallel and saves a CronRunReport.
+    Returns totals including overall throughput in users/sec and plans/sec.
+    """
+    shards = get_shards(task_name, strategy, workers)
+    options = {"trace_memory": trace_memory, "profile_dir": profile_dir}
+    started_at = timezone.now()
+    start = time.perf_counter()
+
+    if workers == 1:
+        results = [run_shard(task_name, shard, **options) for shard in shards]
+    else:
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = [
+                pool.submit(run_shard, task_name, shard, **options) for shard in shards
+            ]
+            results = [future.result() for future in futures]
+
+    # Report the shards merged into a single run
+    profiler = CronProfiler(task_name, profile_dir=profile_dir)
+    profiler.started_at = started_at
+    profiler.wall_seconds = time.perf_counter() - start
+    for result in results:
+        profiler.merge(result)
+    report = profiler.save(worker=f"{strategy} x{workers}", profile_path=profiler.profile_dir)
+
+    elapsed = profiler.wall_seconds
+    return {
+        "shards": [
+            {
+                "shard": shard,
+                "users": result["users"],
+                "plans": result["plans"],
+                "failed": result["failed"],
+                "seconds": round(result["wall_seconds"], 3),
+            }
+            for shard, result in zip(shards, results)
+        ],
+        "users": profiler.users,
+        "plans": profiler.plans,
+        "failed": profiler.failed,
+        "seconds": round(elapsed, 3),
+        "users_per_sec": round(profiler.users / elapsed, 2) if elapsed else 0.0,
+        "plans_per_sec": round(profiler.plans / elapsed, 2) if elapsed else 0.0,
+        "report": report.pk,
+        "profile": profiler.summary(),
+    }
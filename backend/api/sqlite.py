@@ -0,0 +1,23 @@
+"""
+Applies the SQLite pragmas of the active profile (settings.SQLITE_PROFILES) to every new
+connection. The production profile uses WAL, so dashboard reads run alongside cron writes
+instead of waiting for them, and a busy timeout, so writers queue instead of failing with
+"database is locked".
+"""
+
+from django.conf import settings
+
+
+def get_pragmas(profile=None):
+    profile = profile or getattr(settings, "SQLITE_PROFILE", None)
+    return getattr(settings, "SQLITE_PROFILES", {}).get(profile, {}).get("PRAGMAS", {})
+
+
+def configure_connection(sender, connection, **kwargs):
+    """connection_created receiver"""
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in get_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,147 @@
+import datetime
+import logging
+from contextlib import nullcontext
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import aliases, conditional, outbox, screentime
+from .models import NotificationEvent, User, UserPlan
+from .profiling import phase
+
+logger = logging.getLogger(__name__)
+
+
+def get_payment_users():
+    """Users whose payment dates are advanced by the payment cron"""
+    return User.objects.filter(allow_notifications=True)
+
+
+def get_unused_users():
+    """Users with a RescueTime key, whose usage scores are refreshed by the unused cron"""
+    return User.objects.exclude(api_key_encrypted__isnull=True)
+
+
+def update_payment_plans(user):
+    """
+    Advances the user's overdue payment dates and notifies them of upcoming payments.
+    Rows locked by another run are skipped (on backends with SELECT ... FOR UPDATE).
+    Returns the number of plans processed.
+    """
+    today = datetime.datetime.today().date()
+
+    # SQLite has no row locks (the compare-and-swap in update_payment_date still applies),
+    # and a read-then-write transaction there fails instead of waiting for other writers
+    locking = connection.features.has_select_for_update
+
+    with transaction.atomic() if locking else nullcontext():
+        with phase("load"):
+            user_plans = list(
+                UserPlan.objects.select_for_update(skip_locked=True, of=("self",))
+                .filter(user=user)
+                .select_related("plan__subscription")
+            )
+        with phase("save"):
+            advanced = [user_plan.update_payment_date() for user_plan in user_plans]
+    if any(advanced):  # Queryset updates don't send the signals that bump it
+        conditional.bump_data_version([user.id])
+
+    # Queue notifications after the locks are released
+    with phase("notify"):
+        outbox.enqueue(
+            [
+                outbox.make_event(
+                    user.id,
+                    NotificationEvent.Kind.UPCOMING_PAYMENT,
+                    "Upcoming payment",
+                    f"{user_plan.plan.subscription.name} is due at {user_plan.payment_date}",
+                    dedupe_key=f"payment:{user_plan.pk}:{user_plan.payment_date}",
+                )
+                for user_plan in user_plans
+                if user_plan.payment_date - today <= datetime.timedelta(days=3)
+            ]
+        )
+
+    return len(user_plans)
+
+
+def update_unused_plans(user):
+    """
+    Refreshes usage scores of the user's tracked plans from RescueTime data
+    and notifies them of unused subscriptions. Returns the number of plans processed.
+    Each plan is claimed once per day (see UserPlan.claim_usage_check), so a second run
+    on the same day skips the plans the first one handled, unless it failed to fetch
+    or parse the data (the claims are then released).
+    """
+    with phase("load"):
+        user_plans = [
+            user_plan
+            for user_plan in UserPlan.objects.filter(
+                user=user, track_usage=True
+            ).select_related("plan__subscription")
+            if user_plan.claim_usage_check()
+        ]
+    if not user_plans:  # Nothing left to update today
+        return 0
+    conditional.bump_data_version([user.id])  # The claims changed usage_checked
+
+    # Fetch screen time data, keeping only activities matching the user's subscriptions
+    alias_index = aliases.get_index()
+    subscription_ids = {user_plan.plan.subscription_id for user_plan in user_plans}
+    start_date = (datetime.date.today() - datetime.timedelta(days=30)).isoformat()
+    end_date = datetime.date.today().isoformat()
+    try:
+        with phase("fetch"):
+            lines = screentime.fetch_lines(user.api_key_encrypted, start_date, end_date)
+        with phase("parse"):  # Includes streaming the response body
+            df = screentime.parse_csv(
+                lines, activities=alias_index.activity_filter(subscription_ids)
+            )
+    except Exception:
+        # Release the claims so a later run can retry today
+        UserPlan.objects.filter(pk__in=[up.pk for up in user_plans]).update(
+            usage_checked=None, updated_at=timezone.now()
+        )
+        raise
+
+    # Update usage scores
+    with phase("match"):
+        usage = alias_index.usage(df, subscription_ids)
+    for user_plan in user_plans:
+        subscription_name = user_plan.plan.subscription.name
+        try:
+            with phase("score"):
+                user_plan.usage_score = screentime.calculate_usage(
+                    usage.get(user_plan.plan.subscription_id), name=subscription_name
+                )
+            with phase("save"):
+                user_plan.save(update_fields=["usage_score", "updated_at"])
+        except Exception as e:
+            logger.exception("Error processing %s for user %s: %s", subscription_name, user.id, e)
+
+    # Queue notifications for unused subscriptions
+    if user.allow_notifications:
+        today = datetime.date.today()
+        with phase("notify"):
+            outbox.enqueue(
+                [
+                    outbox.make_event(
+                        user.id,
+                        NotificationEvent.Kind.UNUSED_SUBSCRIPTION,
+                        "Unused Subscription",
+                        f"The subscription '{user_plan.plan.subscription.name}' is unused.",
+                        dedupe_key=f"unused:{user_plan.pk}:{today}",
+                    )
+                    for user_plan in user_plans
+                    if user_plan.usage_score < user.unused_threshold
+                ]
+            )
+
+    return len(user_plans)
+
+
+# Cron tasks by name: (users the task applies to, per-user task)
+TASKS = {
+    "payment": (get_payment_users, update_payment_plans),
+    "unused": (get_unused_users, update_unused_plans),
+}
@@ -1,3 +1,1563 @@
-from django.test import TestCase
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from itertools import combinations
+from unittest import mock
 
-# Removed tests due to the file size.
\ No newline at end of file
+import pandas as pd
+import requests
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import (
+    LiveServerTestCase,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone as dj_timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    aliases,
+    benchmarks,
+    jobs,
+    metrics,
+    outbound,
+    outbox,
+    routers,
+    screentime,
+    sharding,
+    tasks,
+    user_cache,
+)
+from .admin import EstimatedCountPaginator
+from .management.commands import loadtest
+from .authentication import CookieJWTAuthentication
+from .conditional import bump_data_version
+from .middleware import (
+    AsyncCapableMiddleware,
+    CompressionMiddleware,
+    QueryInstrumentationMiddleware,
+    QueryStats,
+)
+from .models import (
+    Category,
+    CronJob,
+    CronJobChunk,
+    NotificationEvent,
+    Plan,
+    Subscription,
+    SubscriptionAlias,
+    SubscriptionCostIndex,
+    SubscriptionRollup,
+    User,
+    UserPlan,
+)
+from .money import (
+    CENTS_PER_UNIT,
+    NormalizedTotal,
+    daily_micros,
+    div_round,
+    micros_to_cents,
+    normalize_cents,
+    to_cents,
+)
+from .profiling import CronProfiler
+from .renderers import FastJSONParser, FastJSONRenderer
+from .rollups import run_rollups
+from .services import (
+    AverageSpendingCalculator,
+    PlanPortfolio,
+    PortfolioRow,
+    calculate_spending_by_category,
+)
+from .utils import budget_plans_by_category
+
+# Removed tests due to the file size.
+
+# A separate SQLite file standing in for the read replica, so reads that reach it
+# only see what was written there. Registered before the test databases are created.
+if "replica" not in connections.settings:
+    connections.settings["replica"] = connections.configure_settings(
+        {
+            "default": connections.settings["default"],
+            "replica": {
+                "ENGINE": "django.db.backends.sqlite3",
+                "NAME": "replica.sqlite3",
+                "TEST": {"NAME": os.path.join(tempfile.mkdtemp(), "replica.sqlite3")},
+            },
+        }
+    )["replica"]
+
+
+class PrimaryReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+
+    def test_reads_use_primary_by_default(self):
+        self.assertIsNone(self.router.db_for_read(Category))
+        with routers.routing_scope():
+            self.assertIsNone(self.router.db_for_read(Category))
+
+    def test_replica_reads(self):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(Category), "replica")
+
+    def test_reads_after_a_write_use_primary(self):
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_write(Category), "default")
+            self.assertIsNone(self.router.db_for_read(Category))
+
+    def test_without_replica_configured(self):
+        with self.settings(DATABASE_ROUTING={"REPLICA": "missing"}):
+            with routers.replica_reads():
+                self.assertIsNone(self.router.db_for_read(Category))
+
+
+class ReplicaRoutingTests(TestCase):
+    databases = {"default", "replica"}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="reader", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        Category.objects.create(name="Primary")
+        Category.objects.using("replica").create(name="Replica")
+
+    def category_names(self):
+        response = self.client.get("/api/categories/")
+        self.assertEqual(response.status_code, 200)
+        return [category["name"] for category in response.json()]
+
+    def test_catalog_reads_use_replica(self):
+        self.assertEqual(self.category_names(), ["Replica"])
+
+    def test_catalog_writes_use_primary(self):
+        response = self.client.post("/api/categories/", {"name": "Created"})
+
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Category.objects.filter(name="Created").exists())
+        self.assertFalse(Category.objects.using("replica").filter(name="Created").exists())
+
+    def test_reads_after_a_write_use_primary(self):
+        self.client.post("/api/categories/", {"name": "Created"})
+
+        # Pinned to the primary until the replica catches up
+        self.assertEqual(self.category_names(), ["Primary", "Created"])
+        cache.clear()
+        self.assertEqual(self.category_names(), ["Replica"])
+
+    def test_no_pinning_without_replication_lag(self):
+        with self.settings(DATABASE_ROUTING={"REPLICATION_LAG": 0}):
+            self.client.post("/api/categories/", {"name": "Created"})
+            self.assertEqual(self.category_names(), ["Replica"])
+
+    def test_other_views_use_primary(self):
+        with self.assertNumQueries(0, using="replica"):
+            response = self.client.get("/api/plans/")
+        self.assertEqual(response.status_code, 200)
+
+
+class AdminChangelistTests(TestCase):
+    def setUp(self):
+        admin_user = User.objects.create_superuser("admin", "admin@example.com", "password")
+        self.client.force_login(admin_user)
+        self.category = Category.objects.create(name="Streaming")
+        self.rows = 0
+
+    def add_rows(self, count):
+        """Adds a subscription, plan and user plan (of a new user) per row"""
+        start, self.rows = self.rows, self.rows + count
+        # bulk_create() skips Subscription.save(), which looks up the icon over HTTP
+        subscriptions = Subscription.objects.bulk_create(
+            Subscription(name=f"Subscription {i}", category=self.category)
+            for i in range(start, self.rows)
+        )
+        plans = Plan.objects.bulk_create(
+            Plan(subscription=subscription, name="Basic", cost=5)
+            for subscription in subscriptions
+        )
+        users = User.objects.bulk_create(
+            User(username=f"user-{i}") for i in range(start, self.rows)
+        )
+        UserPlan.objects.bulk_create(
+            UserPlan(user=user, plan=plan, payment_date=date.today())
+            for user, plan in zip(users, plans)
+        )
+
+    def changelist_queries(self, model):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f"admin:api_{model}_changelist"))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        for model in ["subscription", "plan", "userplan", "notificationevent"]:
+            with self.subTest(model=model):
+                self.add_rows(2)
+                few = self.changelist_queries(model)
+                self.add_rows(20)
+                self.assertEqual(self.changelist_queries(model), few)
+
+    def test_unfiltered_count_is_estimated(self):
+        self.add_rows(3)
+        UserPlan.objects.first().delete()
+
+        with mock.patch.object(EstimatedCountPaginator, "threshold", 0):
+            paginator = EstimatedCountPaginator(UserPlan.objects.all(), 100)
+            self.assertEqual(paginator.count, UserPlan.objects.latest("pk").pk)
+
+            filtered = EstimatedCountPaginator(UserPlan.objects.filter(track_usage=False), 100)
+            self.assertEqual(filtered.count, 2)
+
+
+class MoneyTests(SimpleTestCase):
+    def test_to_cents_rounds_half_up(self):
+        self.assertEqual(to_cents(Decimal("9.99")), 999)
+        self.assertEqual(to_cents("0.005"), 1)
+        self.assertEqual(to_cents(2.675), 268)  # Through str(), not the binary float
+        self.assertEqual(to_cents(0.1 + 0.2), 30)
+        self.assertEqual((div_round(5, 2), div_round(-5, 2), div_round(4, 3)), (3, -3, 1))
+
+    def test_normalized_costs(self):
+        weekly, yearly, monthly = 999, 9999, 1549
+        cases = [
+            (weekly, Plan.Period.WEEK, Plan.Period.DAY, 143),  # 142.71
+            (weekly, Plan.Period.WEEK, Plan.Period.MONTH, 4281),  # 4281.43
+            (weekly, Plan.Period.WEEK, Plan.Period.QUARTER, 12844),  # 12844.29
+            (weekly, Plan.Period.WEEK, Plan.Period.YEAR, 52091),  # 52090.71
+            (yearly, Plan.Period.YEAR, Plan.Period.WEEK, 192),  # 191.76
+            (yearly, Plan.Period.YEAR, Plan.Period.MONTH, 822),  # 821.84
+            (monthly, Plan.Period.MONTH, Plan.Period.YEAR, 18846),  # 18846.17
+        ]
+        for cents, period, target, expected in cases:
+            with self.subTest(cents=cents, period=period, target=target):
+                self.assertEqual(normalize_cents(cents, period, target), expected)
+                # The per-day micros of the cost index round to the same cents
+                self.assertEqual(
+                    micros_to_cents(daily_micros(cents, period) * target), expected
+                )
+
+    def test_totals_round_once(self):
+        total = NormalizedTotal()
+        for _ in range(3):
+            total.add(999, Plan.Period.WEEK)
+        # 3 x 4281.43, not 3 x 4281
+        self.assertEqual(total.cents(Plan.Period.MONTH), 12844)
+
+        mixed = NormalizedTotal()
+        mixed.add(999, Plan.Period.WEEK)
+        mixed.add(9999, Plan.Period.YEAR)
+        self.assertEqual(mixed.cents(Plan.Period.MONTH), 5103)  # 4281.43 + 821.84
+        self.assertEqual(mixed.cents(Plan.Period.MONTH, divisor=2), 2552)  # 2551.63
+        self.assertEqual(total.percentage_of(mixed), 251.69)  # 251.6877
+
+    def test_analytics_amounts(self):
+        portfolio = PlanPortfolio(
+            [
+                PortfolioRow(999, Plan.Period.WEEK, date.today(), 5, "Streaming", None),
+                PortfolioRow(1549, Plan.Period.MONTH, date.today(), 5, "Streaming", None),
+                PortfolioRow(9999, Plan.Period.YEAR, date.today(), 5, "Music", None),
+            ]
+        )
+        streaming = calculate_spending_by_category(portfolio)["Streaming"]
+        self.assertEqual(streaming["costs"]["week"], 13.6)  # 9.99 + 3.6143
+        self.assertEqual(streaming["costs"]["month"], 58.3)  # 42.8143 + 15.49
+        self.assertEqual(streaming["costs"]["year"], 709.37)  # 520.9071 + 188.4617
+        self.assertEqual(streaming["percentages"]["month"], 87.65)  # 87.6458
+
+        averages = AverageSpendingCalculator(portfolio).calculate_averages(
+            Plan.Period.choices
+        )
+        self.assertEqual(averages["month"], 22.17)  # (42.8143 + 15.49 + 8.2184) / 3
+        self.assertEqual(averages["year"], 269.79)  # (520.9071 + 188.4617 + 99.99) / 3
+
+
+@override_settings(DATABASE_ROUTING={"REPLICA": "missing"})
+class DashboardTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="dashboard", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        plans = [
+            ("Streaming", "Netflix", Decimal("15.49"), Plan.Period.MONTH, 10, 8),
+            ("Streaming", "Hulu", Decimal("9.99"), Plan.Period.WEEK, 3, 2),
+            ("Music", "Spotify", Decimal("99.99"), Plan.Period.YEAR, 200, 5),
+            ("Cloud", "Dropbox", Decimal("29.97"), Plan.Period.QUARTER, 40, 0),
+        ]
+        categories = {}
+        for category_name, name, cost, period, days_ago, usage_score in plans:
+            if category_name not in categories:
+                categories[category_name] = Category.objects.create(name=category_name)
+            subscription = Subscription.objects.bulk_create(
+                [Subscription(name=name, category=categories[category_name])]
+            )[0]
+            plan = Plan.objects.create(
+                subscription=subscription, name="Basic", cost=cost, period=period
+            )
+            UserPlan.objects.create(
+                user=self.user,
+                plan=plan,
+                payment_date=date.today() - timedelta(days=days_ago),
+                usage_score=usage_score,
+            )
+
+    def get(self, name, params=""):
+        response = self.client.get(f"{reverse(name)}{params}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_sections_match_the_individual_endpoints(self):
+        for params in ["", "?days=45&period=month", "?period=week"]:
+            with self.subTest(params=params):
+                dashboard = self.get("dashboard", params)
+                self.assertEqual(
+                    dashboard,
+                    {
+                        "total_spending": self.get("total-spending-per-period", params),
+                        "average_spending": self.get("average-spending-per-period", params),
+                        "spending_by_category": self.get("spending-by-category"),
+                        "usage_by_category": self.get("usage-by-category"),
+                    },
+                )
+
+    def test_sections_param(self):
+        dashboard = self.get("dashboard", "?sections=usage_by_category,total_spending")
+        self.assertEqual(set(dashboard), {"usage_by_category", "total_spending"})
+        response = self.client.get(reverse("dashboard"), {"sections": "unknown"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ParseCSVTests(SimpleTestCase):
+    def export_lines(self):
+        """30 days of a browser used daily and Netflix used every 3rd day"""
+        lines = ["Date,Time Spent (seconds),Number of People,Activity,Category,Productivity"]
+        start = date.today() - timedelta(days=29)
+        for day in range(30):
+            timestamp = f"{start + timedelta(days=day)}T00:00:00"
+            lines.append(f"{timestamp},1200,1,Firefox,Browsers,0")
+            if day % 3 == 0:
+                lines.append(f"{timestamp},3600,1,Netflix,Video,-2")
+                lines.append(f"{timestamp},600,1,Netflix,Video,-2")  # Summed per day
+        return lines
+
+    def test_filtered_parse_matches_unfiltered_columns(self):
+        df = screentime.parse_csv(iter(self.export_lines()))
+        filtered = screentime.parse_csv(iter(self.export_lines()), activities={"Netflix"})
+
+        self.assertEqual(len(filtered), 30)  # Days without Netflix are zeros, not missing
+        pd.testing.assert_frame_equal(filtered, df[["Netflix"]])
+        self.assertEqual(filtered["Netflix"].sum(), 10 * 4200)
+        self.assertEqual(
+            screentime.calculate_usage(filtered["Netflix"]),
+            screentime.calculate_usage(df["Netflix"]),
+        )
+
+    def test_untracked_activities_only(self):
+        filtered = screentime.parse_csv(iter(self.export_lines()), activities={"Hulu"})
+        self.assertEqual(filtered.shape, (30, 0))
+
+
+class BudgetPlansByCategoryTests(SimpleTestCase):
+    def plans(self, rng, count):
+        return [
+            {
+                "id": i,
+                "usage_score": rng.randint(0, 10),
+                "cost_cents": rng.randint(1, 60) * 50,
+                "category": rng.choice(["streaming", "music", "cloud"]),
+            }
+            for i in range(count)
+        ]
+
+    def spend(self, plans, ids, category=None):
+        return sum(
+            div_round(p["cost_cents"], CENTS_PER_UNIT)
+            for p in plans
+            if p["id"] in ids and category in (None, p["category"])
+        )
+
+    def feasible(self, plans, ids, budget_cents, caps):
+        return self.spend(plans, ids) <= div_round(budget_cents, CENTS_PER_UNIT) and all(
+            self.spend(plans, ids, category) <= div_round(cap, CENTS_PER_UNIT)
+            for category, cap in caps.items()
+        )
+
+    def score(self, plans, ids):
+        return sum(p["usage_score"] for p in plans if p["id"] in ids)
+
+    def assertOptimal(self, plans, budget_cents, caps):
+        selected = budget_plans_by_category(plans, budget_cents, caps)
+        self.assertEqual(len(selected), len(set(selected)))
+        self.assertTrue(self.feasible(plans, set(selected), budget_cents, caps))
+        best = max(
+            self.score(plans, set(ids))
+            for size in range(len(plans) + 1)
+            for ids in combinations([p["id"] for p in plans], size)
+            if self.feasible(plans, set(ids), budget_cents, caps)
+        )
+        self.assertEqual(self.score(plans, set(selected)), best)
+        return selected
+
+    def test_matches_exhaustive_search(self):
+        rng = random.Random(0)
+        for trial in range(200):
+            plans = self.plans(rng, rng.randint(0, 8))
+            # Some categories capped, the rest only limited by the total
+            caps = {
+                category: rng.randint(0, 40) * 50
+                for category in ["streaming", "music", "cloud"]
+                if rng.random() < 0.5
+            }
+            budget_cents = rng.randint(0, 120) * 50
+            with self.subTest(trial=trial, plans=plans, budget=budget_cents, caps=caps):
+                self.assertOptimal(plans, budget_cents, caps)
+
+    def test_infeasible_cap(self):
+        plans = [
+            {"id": 1, "usage_score": 9, "cost_cents": 1000, "category": "streaming"},
+            {"id": 2, "usage_score": 1, "cost_cents": 500, "category": "music"},
+        ]
+        # The cap is below every streaming plan, so only music fits
+        self.assertEqual(self.assertOptimal(plans, 5000, {"streaming": 900}), [2])
+
+    def test_budget_below_every_cost(self):
+        plans = [
+            {"id": 1, "usage_score": 5, "cost_cents": 1000, "category": "streaming"},
+            {"id": 2, "usage_score": 3, "cost_cents": 800, "category": "music"},
+        ]
+        self.assertEqual(budget_plans_by_category(plans, 700, {}), [])
+
+
+class AliasIndexTests(TestCase):
+    def setUp(self):
+        aliases.invalidate()
+        category = Category.objects.create(name="Streaming")
+        self.youtube, self.music, self.netflix = Subscription.objects.bulk_create(
+            [
+                Subscription(name=name, category=category)
+                for name in ["YouTube", "YouTube Music", "Netflix"]
+            ]
+        )
+        for subscription, pattern, match_type in [
+            (self.youtube, "youtube", "contains"),
+            (self.music, "youtube music", "contains"),
+            (self.netflix, "netflix.com", "exact"),
+            (self.netflix, r"^netflix (app|desktop)$", "regex"),
+        ]:
+            SubscriptionAlias.objects.create(
+                subscription=subscription, pattern=pattern, match_type=match_type
+            )
+
+    def test_match_types(self):
+        index = aliases.get_index()
+        for activity, expected in [
+            ("YouTube", {self.youtube}),  # Own name
+            ("  NETFLIX.com ", {self.netflix}),  # Exact, normalized
+            ("netflix.com/browse", set()),
+            ("music.youtube.com", {self.youtube}),  # Contains
+            ("YouTube Music Desktop", {self.music}),  # The longest substring wins
+            ("Netflix Desktop", {self.netflix}),  # Regex, case-insensitive
+            ("Netflix Desktop 2", set()),
+        ]:
+            with self.subTest(activity=activity):
+                self.assertEqual(index.match(activity), {s.pk for s in expected})
+
+    def test_changes_rebuild_the_index(self):
+        index = aliases.get_index()
+        self.assertIs(aliases.get_index(), index)
+        SubscriptionAlias.objects.create(subscription=self.netflix, pattern="nflx")
+        rebuilt = aliases.get_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(rebuilt.match("nflx"), {self.netflix.pk})
+
+    def test_invalid_regex(self):
+        alias = SubscriptionAlias(subscription=self.netflix, pattern="(", match_type="regex")
+        with self.assertRaises(ValidationError):
+            alias.full_clean()
+
+        # Saved anyway: skipped by the index instead of breaking it for everyone
+        alias.save()
+        with self.assertLogs("api.aliases", "WARNING"):
+            index = aliases.get_index()
+        self.assertEqual(index.match("Netflix App"), {self.netflix.pk})
+
+    def test_cached_matches_are_bounded(self):
+        index = aliases.get_index()
+        with mock.patch.object(aliases, "MAX_CACHED_MATCHES", 3):
+            for i in range(10):
+                index.match(f"activity-{i}")
+                self.assertLessEqual(len(index._matches), 3)
+            self.assertEqual(index.match("YouTube"), {self.youtube.pk})
+
+
+class CronProfilerTests(SimpleTestCase):
+    def test_cpu_time_is_the_runs_thread_only(self):
+        stop = threading.Event()
+
+        def spin():
+            while not stop.is_set():
+                pass
+
+        other = threading.Thread(target=spin)
+        other.start()
+        try:
+            with CronProfiler("payment") as profiler:
+                with profiler.phase("wait"):
+                    time.sleep(0.3)  # While another thread burns CPU
+        finally:
+            stop.set()
+            other.join()
+
+        self.assertLess(profiler.cpu_seconds, 0.1)
+        self.assertLessEqual(profiler.phases["wait"][2], profiler.cpu_seconds)
+        self.assertGreaterEqual(profiler.wall_seconds, 0.3)
+
+
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="synthetic-0", allow_notifications=True)
+        category = Category.objects.create(name="Streaming")
+        subscription = Subscription.objects.bulk_create(
+            [Subscription(name="Netflix", category=category)]
+        )[0]
+        # The daily plan is due again within the notice period, the monthly one isn't
+        for period in [Plan.Period.DAY, Plan.Period.MONTH]:
+            plan = Plan.objects.create(
+                subscription=subscription, name=f"Every {period} days", cost=5, period=period
+            )
+            UserPlan.objects.create(
+                user=self.user, plan=plan, payment_date=date.today() + timedelta(days=2)
+            )
+
+    def test_cron_cases_are_rolled_back_and_start_from_due_plans(self):
+        payment_dates = list(UserPlan.objects.values_list("payment_date", flat=True))
+        advanced = []
+        update_payment_date = UserPlan.update_payment_date
+
+        def advance(user_plan):
+            advanced.append(update_payment_date(user_plan))
+            return advanced[-1]
+
+        with mock.patch.object(UserPlan, "update_payment_date", advance):
+            result = benchmarks.run_benchmark(
+                "cron.payment", benchmarks.BenchmarkContext(self.user), repeat=3
+            )
+
+        # Each of the 3 timed calls and the traced one advanced both plans
+        self.assertEqual(advanced, [True] * 8)
+        self.assertGreater(result["queries"], 0)
+        self.assertEqual(
+            list(UserPlan.objects.values_list("payment_date", flat=True)), payment_dates
+        )
+        self.assertFalse(NotificationEvent.objects.exists())
+        self.assertFalse(CronJob.objects.exists())
+
+
+class UnusedCronTests(TestCase):
+    def setUp(self):
+        aliases.invalidate()
+        category = Category.objects.create(name="Streaming")
+        subscription = Subscription.objects.bulk_create(
+            [Subscription(name="Netflix", category=category)]
+        )[0]
+        plan = Plan.objects.create(subscription=subscription, name="Basic", cost=10)
+        self.users = []
+        for i in range(5):
+            user = User.objects.create_user(username=f"tracked-{i}", api_key_encrypted="key")
+            UserPlan.objects.create(
+                user=user, plan=plan, payment_date=date.today(), track_usage=True
+            )
+            self.users.append(user)
+        User.objects.create_user(username="no-key")  # Not an unused cron user
+
+        day = date.today().isoformat()
+        self.fetch = mock.Mock(
+            side_effect=lambda *args: iter(
+                [
+                    "Date,Time Spent (seconds),Number of People,Activity,Category,Productivity",
+                    f"{day}T00:00:00,3600,1,Netflix,Video,-2",
+                ]
+            )
+        )
+        fetch_patch = mock.patch.object(screentime, "fetch_lines", self.fetch)
+        fetch_patch.start()
+        self.addCleanup(fetch_patch.stop)
+
+    def test_plans_are_claimed_once_a_day(self):
+        user = self.users[0]
+        self.assertEqual(tasks.update_unused_plans(user), 1)
+        self.assertEqual(UserPlan.objects.get(user=user).usage_checked, date.today())
+        # Same day: nothing left to claim, RescueTime isn't called again
+        self.assertEqual(tasks.update_unused_plans(user), 0)
+        self.assertEqual(self.fetch.call_count, 1)
+
+        # The next day's run claims the plan again
+        UserPlan.objects.filter(user=user).update(usage_checked=date.today() - timedelta(days=1))
+        self.assertEqual(tasks.update_unused_plans(user), 1)
+
+    def test_claims_are_released_when_fetching_fails(self):
+        user = self.users[0]
+        self.fetch.side_effect = requests.exceptions.ConnectionError
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            tasks.update_unused_plans(user)
+        self.assertIsNone(UserPlan.objects.get(user=user).usage_checked)
+
+        self.fetch.side_effect = None
+        self.fetch.return_value = iter([])
+        self.assertEqual(tasks.update_unused_plans(user), 1)
+
+    def test_shards_cover_every_user_once(self):
+        self.assertEqual(
+            sharding.get_range_bounds([1, 2, 3, 5, 8, 13, 21], 3), [(1, 3), (5, 8), (13, 21)]
+        )
+        self.assertEqual(sharding.get_range_bounds([1, 2], 3), [(1, 1), (2, 2)])
+
+        user_ids = sorted(user.pk for user in self.users)
+        for strategy in sharding.SHARD_STRATEGIES:
+            with self.subTest(strategy=strategy):
+                shard_user_ids = [
+                    list(sharding.get_shard_users("unused", shard).values_list("id", flat=True))
+                    for shard in sharding.get_shards("unused", strategy, 3)
+                ]
+                self.assertEqual(sorted(sum(shard_user_ids, [])), user_ids)
+
+    def test_sharded_run(self):
+        summary = sharding.run_sharded("unused", workers=1)
+        self.assertEqual((summary["users"], summary["plans"], summary["failed"]), (5, 5, 0))
+        # A second run on the same day finds every plan claimed
+        summary = sharding.run_sharded("unused", workers=1)
+        self.assertEqual((summary["users"], summary["plans"]), (5, 0))
+
+
+class CronJobQueueTests(TestCase):
+    def setUp(self):
+        self.user_ids = [
+            User.objects.create_user(username=f"cron-{i}", allow_notifications=True).pk
+            for i in range(3)
+        ]
+        self.processed = []
+        tasks_patch = mock.patch.dict(
+            tasks.TASKS,
+            {"payment": (tasks.get_payment_users, self.run_task)},
+        )
+        tasks_patch.start()
+        self.addCleanup(tasks_patch.stop)
+
+    def run_task(self, user):
+        self.processed.append(user.pk)
+        return 1
+
+    def expire_lease(self, chunk):
+        lease = timedelta(seconds=jobs.get_setting("LEASE_SECONDS") + 1)
+        CronJobChunk.objects.filter(pk=chunk.pk).update(claimed_at=dj_timezone.now() - lease)
+
+    def test_claims_are_exclusive(self):
+        jobs.enqueue_job(CronJob.Kind.PAYMENT, chunk_size=2)
+        first = jobs.claim_chunk("worker-1")
+        second = jobs.claim_chunk("worker-2")
+        self.assertNotEqual(first.pk, second.pk)
+        # Both chunks are leased, so there is nothing left to claim
+        self.assertIsNone(jobs.claim_chunk("worker-3"))
+
+        # An expired lease is claimed by one worker only
+        self.expire_lease(first)
+        self.assertEqual(jobs.claim_chunk("worker-3").pk, first.pk)
+        self.assertIsNone(jobs.claim_chunk("worker-4"))
+
+    def test_reclaimed_chunk_resumes_from_checkpoint(self):
+        job = jobs.enqueue_job(CronJob.Kind.PAYMENT)
+        chunk = jobs.claim_chunk("crashed")
+        # The worker crashed after checkpointing the first user
+        CronJobChunk.objects.filter(pk=chunk.pk).update(checkpoint=1)
+        self.assertIsNone(jobs.claim_chunk("worker"))  # Still leased
+
+        self.expire_lease(chunk)
+        reclaimed = jobs.claim_chunk("worker")
+        self.assertEqual((reclaimed.pk, reclaimed.attempts), (chunk.pk, 2))
+        jobs.process_chunk(reclaimed)
+
+        self.assertEqual(self.processed, self.user_ids[1:])
+        reclaimed.refresh_from_db()
+        self.assertEqual((reclaimed.status, reclaimed.checkpoint), (CronJob.Status.DONE, 3))
+        job.refresh_from_db()
+        self.assertEqual(job.status, CronJob.Status.DONE)
+
+    def test_worker_stops_after_losing_its_lease(self):
+        jobs.enqueue_job(CronJob.Kind.PAYMENT)
+        stale = jobs.claim_chunk("slow")
+
+        def reclaim_during_first_user(user):
+            self.expire_lease(stale)
+            self.assertIsNotNone(jobs.claim_chunk("worker"))
+            return self.run_task(user)
+
+        with mock.patch.dict(
+            tasks.TASKS, {"payment": (tasks.get_payment_users, reclaim_during_first_user)}
+        ):
+            jobs.process_chunk(stale)
+
+        # The slow worker neither checkpoints nor finishes the chunk it no longer holds
+        self.assertEqual(self.processed, self.user_ids[:1])
+        chunk = CronJobChunk.objects.get(pk=stale.pk)
+        self.assertEqual(
+            (chunk.status, chunk.claimed_by, chunk.checkpoint),
+            (CronJob.Status.RUNNING, "worker", 0),
+        )
+
+        jobs.process_chunk(chunk)
+        chunk.refresh_from_db()
+        self.assertEqual((chunk.status, chunk.checkpoint), (CronJob.Status.DONE, 3))
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Streaming")
+        self.old, self.new = Subscription.objects.bulk_create(
+            [Subscription(name=name, category=category) for name in ["Netflix", "Hulu"]]
+        )
+        self.plan = Plan.objects.create(
+            subscription=self.old, name="Basic", cost=Decimal("10.00"), period=Plan.Period.MONTH
+        )
+        self.other_plan = Plan.objects.create(
+            subscription=self.new, name="Basic", cost=Decimal("20.00"), period=Plan.Period.MONTH
+        )
+        user = User.objects.create_user(username="rollups")
+        self.user_plan = UserPlan.objects.create(
+            user=user, plan=self.plan, payment_date=date.today()
+        )
+        UserPlan.objects.create(user=user, plan=self.other_plan, payment_date=date.today())
+        run_rollups(full=True)
+
+    def assertRollups(self, expected):
+        run_rollups()
+        self.assertEqual(
+            {
+                rollup.pk: (rollup.user_plans, rollup.monthly_cost_cents)
+                for rollup in SubscriptionRollup.objects.all()
+            },
+            expected,
+        )
+
+    def test_moving_a_plan_between_subscriptions(self):
+        # Loaded fresh, as the receivers compare against the values loaded from the database
+        plan = Plan.objects.get(pk=self.plan.pk)
+        plan.subscription = self.new
+        plan.save()
+        self.assertRollups({self.new.pk: (2, 3000)})
+
+    def test_moving_a_user_plan_between_subscriptions(self):
+        self.user_plan.plan = self.other_plan
+        self.user_plan.save()
+        self.assertRollups({self.new.pk: (2, 4000)})
+
+
+class CostIndexTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name="Streaming")
+        self.old, self.new = Subscription.objects.bulk_create(
+            [Subscription(name=name, category=category) for name in ["Netflix", "Hulu"]]
+        )
+        self.cheap, self.expensive, self.other = [
+            Plan.objects.create(subscription=subscription, name=name, cost=cost)
+            for subscription, name, cost in [
+                (self.old, "Basic", Decimal("5.00")),
+                (self.old, "Premium", Decimal("15.00")),
+                (self.new, "Basic", Decimal("10.00")),
+            ]
+        ]
+
+    def cheapest_plans(self):
+        return dict(SubscriptionCostIndex.objects.values_list("pk", "cheapest_plan"))
+
+    def test_moving_a_plan_between_subscriptions(self):
+        plan = Plan.objects.get(pk=self.cheap.pk)
+        plan.subscription = self.new
+        plan.save()
+        self.assertEqual(
+            self.cheapest_plans(), {self.old.pk: self.expensive.pk, self.new.pk: self.cheap.pk}
+        )
+
+        # Moving the last plan away drops the subscription's entry
+        plan = Plan.objects.get(pk=self.expensive.pk)
+        plan.subscription = self.new
+        plan.save()
+        self.assertEqual(self.cheapest_plans(), {self.new.pk: self.cheap.pk})
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="poller", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        category = Category.objects.create(name="Streaming")
+        # bulk_create() skips Subscription.save(), which looks up the icon over HTTP
+        subscription = Subscription.objects.bulk_create(
+            [Subscription(name="Netflix", category=category)]
+        )[0]
+        self.plan = Plan.objects.create(subscription=subscription, name="Basic", cost=10)
+        self.user_plan = UserPlan.objects.create(
+            user=self.user, plan=self.plan, payment_date=date.today()
+        )
+
+    def get(self, url, etag=None):
+        # Re-read the user like the JWT authentication does on every request
+        self.client.force_authenticate(User.objects.get(pk=self.user.pk))
+        headers = {"If-None-Match": etag} if etag else {}
+        return self.client.get(url, headers=headers)
+
+    def test_unchanged_data_is_not_modified(self):
+        for url in ["/api/user-plans/", "/api/user/settings/", "/api/analytics/dashboard/"]:
+            with self.subTest(url=url):
+                response = self.get(url)
+                self.assertEqual(response.status_code, 200)
+
+                with self.assertNumQueries(1):  # Only the user, for authentication
+                    not_modified = self.get(url, response["ETag"])
+                self.assertEqual(not_modified.status_code, 304)
+                self.assertEqual(not_modified["ETag"], response["ETag"])
+                self.assertEqual(not_modified.content, b"")
+
+    def test_etag_depends_on_params(self):
+        etag = self.get("/api/user-plans/?period=month")["ETag"]
+        self.assertEqual(self.get("/api/user-plans/?period=year", etag).status_code, 200)
+
+    def test_changes_invalidate_etags(self):
+        changes = [
+            lambda: UserPlan.objects.get(pk=self.user_plan.pk).save(),
+            lambda: setattr(self.plan, "cost", 12) or self.plan.save(),
+            lambda: User.objects.get(pk=self.user.pk).save(),
+            lambda: self.client.patch(
+                f"/api/user-plans/{self.user_plan.pk}/toggle-usage/",
+                {"track_usage": True},
+                format="json",
+            ),
+            lambda: UserPlan.objects.get(pk=self.user_plan.pk).delete(),
+        ]
+        for i, change in enumerate(changes):
+            with self.subTest(change=i):
+                etag = self.get("/api/user-plans/")["ETag"]
+                change()
+                self.assertEqual(self.get("/api/user-plans/", etag).status_code, 200)
+
+
+@override_settings(
+    DATABASE_ROUTING={"REPLICA": "missing"},  # Both requests read the test database
+    QUERY_INSTRUMENTATION={"SAMPLE_RATE": 1.0},
+)
+class ReceiverDatabaseTests(TestCase):
+    databases = {"default", "replica"}
+
+    def test_receivers_write_to_the_saved_instances_database(self):
+        with self.assertNumQueries(0, using="default"):
+            user = User.objects.db_manager("replica").create_user(username="elsewhere")
+            category = Category.objects.using("replica").create(name="Streaming")
+            old, new = Subscription.objects.using("replica").bulk_create(
+                [Subscription(name=name, category=category) for name in ["Netflix", "Hulu"]]
+            )
+            plan = Plan(subscription=old, name="Basic", cost=10)
+            plan.save(using="replica")
+            user_plan = UserPlan(user=user, plan=plan, payment_date=date.today())
+            user_plan.save(using="replica")
+            SubscriptionRollup.objects.using("replica").create(subscription=old)
+
+            plan.subscription = new
+            plan.save(using="replica")
+            user_plan.delete(using="replica")
+
+        self.assertEqual(User.objects.using("replica").get(pk=user.pk).data_version, 3)
+        self.assertTrue(SubscriptionRollup.objects.using("replica").get(pk=old.pk).dirty)
+        cost_index = SubscriptionCostIndex.objects.using("replica")
+        self.assertEqual(dict(cost_index.values_list("pk", "cheapest_plan")), {new.pk: plan.pk})
+
+
+class AsyncRequestPathTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="async", password="password")
+        category = Category.objects.create(name="Streaming")
+        subscription = Subscription.objects.bulk_create(
+            [Subscription(name="Netflix", category=category)]
+        )[0]
+        plan = Plan.objects.create(subscription=subscription, name="Basic", cost=10)
+        UserPlan.objects.create(user=self.user, plan=plan, payment_date=date.today())
+
+    def test_middlewares_run_in_async_mode(self):
+        async def view(request):
+            return HttpResponse()
+
+        for path in settings.MIDDLEWARE:
+            with self.subTest(middleware=path):
+                self.assertTrue(iscoroutinefunction(import_string(path)(view)))
+
+    def test_both_paths_are_required(self):
+        class SyncOnlyMiddleware(AsyncCapableMiddleware):
+            def handle(self, request):
+                return self.get_response(request)
+
+        with self.assertRaises(TypeError):
+            SyncOnlyMiddleware(lambda request: HttpResponse())
+
+    async def test_async_view_matches_sync_view(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        expected = (await sync_to_async(client.get)(reverse("spending-by-category"))).json()
+
+        self.async_client.cookies["access_token"] = str(AccessToken.for_user(self.user))
+        response = await self.async_client.get(reverse("async-spending-by-category"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected)
+        # The queries run through the async ORM were counted
+        self.assertRegex(response["Server-Timing"], r'desc="[1-9]\d* queries"')
+
+
+class QueryInstrumentationTests(TestCase):
+    def setUp(self):
+        self.request = RequestFactory().get("/api/user/plans/")
+
+    def middleware(self, queries, **config):
+        def view(request):
+            for _ in range(queries):
+                User.objects.filter(username="nobody").exists()
+            return HttpResponse()
+
+        with self.settings(
+            QUERY_INSTRUMENTATION={"SAMPLE_RATE": 1.0, "SLOW_REQUEST_MS": 10_000, **config}
+        ):
+            return QueryInstrumentationMiddleware(view)
+
+    def test_stats_count_time_and_repeats(self):
+        stats = QueryStats()
+        with connection.execute_wrapper(stats):
+            for _ in range(3):
+                User.objects.filter(username="nobody").exists()
+            Plan.objects.count()
+
+        self.assertEqual(stats.count, 4)
+        self.assertGreater(stats.duration, 0)
+        (repeated,) = stats.repeated(3)
+        self.assertIn("api_user", repeated)
+        self.assertEqual(stats.repeated(3)[repeated], 3)
+        top = stats.top(1)
+        self.assertEqual(len(top), 1)
+        self.assertEqual(set(top[0]), {"sql", "count", "ms"})
+
+    def test_server_timing_header(self):
+        response = self.middleware(queries=2)(self.request)
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="2 queries", app;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+    def test_repeated_queries_are_logged(self):
+        with self.assertNoLogs("api.performance"):
+            self.middleware(queries=2, REPEATED_QUERY_THRESHOLD=3)(self.request)
+
+        with self.assertLogs("api.performance", "WARNING") as logs:
+            self.middleware(queries=3, REPEATED_QUERY_THRESHOLD=3, TOP_QUERIES=1)(
+                self.request
+            )
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["event"], "repeated_queries")
+        self.assertEqual(entry["path"], "/api/user/plans/")
+        self.assertEqual(entry["queries"], 3)
+        self.assertEqual(entry["repeated"][0]["count"], 3)
+        self.assertEqual(len(entry["top_queries"]), 1)
+        self.assertIn("api_user", entry["top_queries"][0]["sql"])
+
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs("api.performance", "WARNING") as logs:
+            self.middleware(queries=1, SLOW_REQUEST_MS=0)(self.request)
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry["event"], "slow_request")
+        self.assertEqual(entry["repeated"], [])
+
+    def test_unsampled_requests_are_not_instrumented(self):
+        with self.assertNoLogs("api.performance"):
+            response = self.middleware(queries=1, SAMPLE_RATE=0, SLOW_REQUEST_MS=0)(
+                self.request
+            )
+        self.assertFalse(response.has_header("Server-Timing"))
+
+
+class UserCacheTests(TestCase):
+    def setUp(self):
+        user_cache.clear()
+        cache.clear()
+        self.user = User.objects.create_user(username="cached", password="password")
+        self.token = str(AccessToken.for_user(self.user))
+
+    def authenticate(self, token=None):
+        request = RequestFactory().get("/api/user/settings/")
+        request.COOKIES["access_token"] = token or self.token
+        user, _ = CookieJWTAuthentication().authenticate(request)
+        return user
+
+    def test_repeated_requests_skip_the_user_query(self):
+        with self.assertNumQueries(1):
+            self.authenticate()
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(user.username, "cached")
+        self.assertEqual(user.get_deferred_fields(), {"password"})
+        self.assertIsNot(user, self.authenticate())
+
+    def test_changes_invalidate_the_cached_user(self):
+        changes = [
+            lambda: setattr(self.user, "advance_period", 7) or self.user.save(),
+            lambda: self.user.set_password("new-password") or self.user.save(),
+            lambda: bump_data_version([self.user.pk]),
+        ]
+        for i, change in enumerate(changes):
+            with self.subTest(change=i):
+                self.authenticate()
+                change()
+                with self.assertNumQueries(1):
+                    user = self.authenticate()
+                fresh = User.objects.get(pk=self.user.pk)
+                self.assertEqual(user.advance_period, fresh.advance_period)
+                self.assertEqual(user.data_version, fresh.data_version)
+
+    def test_saving_a_cached_user_keeps_the_password(self):
+        user = self.authenticate()
+        user.allow_notifications = True
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password("password"))
+
+    def test_logout_invalidates_the_cached_user(self):
+        client = APIClient()
+        client.cookies["access_token"] = self.token
+        self.assertEqual(client.post("/api/auth/logout/").status_code, 200)
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+    @override_settings(AUTH_USER_CACHE={"ENABLED": True, "SHARED_CACHE": "default"})
+    def test_shared_cache_sees_other_processes_invalidations(self):
+        self.authenticate()
+        user_cache.clear()  # Another process, sharing only the shared cache
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+        # Another process invalidates: here, only the shared generation changes
+        with mock.patch.object(user_cache, "_local", user_cache.LRUCache()):
+            user_cache.invalidate([self.user.pk])
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+    def test_string_user_id_claim(self):
+        token = AccessToken.for_user(self.user)
+        token["user_id"] = str(self.user.pk)
+        with self.assertNumQueries(1):
+            self.authenticate(str(token))
+        with self.assertNumQueries(0):
+            self.authenticate(str(token))
+
+        user_cache.invalidate([self.user.pk])
+        with self.assertNumQueries(1):
+            self.authenticate(str(token))
+
+    @override_settings(AUTH_USER_CACHE={"ENABLED": False})
+    def test_disabled(self):
+        self.authenticate()
+        with self.assertNumQueries(1):
+            self.authenticate()
+
+
+class OutboundTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        clock = mock.Mock(monotonic=lambda: self.now, sleep=self.sleep)
+        clock_patch = mock.patch.object(outbound, "time", clock)
+        clock_patch.start()
+        self.addCleanup(clock_patch.stop)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def host_client(self, status=200):
+        with override_settings(
+            OUTBOUND={"FAILURE_THRESHOLD": 2, "RESET_SECONDS": 30, "RATE": 1, "BURST": 1}
+        ):
+            client = outbound.HostClient("api.example.com")
+        response = HttpResponse(status=status)
+        client.session.request = mock.Mock(return_value=response)
+        return client
+
+    def send(self, client):
+        return client.request("example", "test", "GET", "https://api.example.com/")
+
+    def test_circuit_opens_half_opens_and_closes(self):
+        breaker = outbound.CircuitBreaker(failure_threshold=2, reset_seconds=30)
+        breaker.failure()
+        self.assertTrue(breaker.allow())
+        breaker.failure()
+        self.assertFalse(breaker.allow())  # Open
+
+        self.now += 30
+        self.assertTrue(breaker.allow())  # Half open: a single trial call
+        self.assertFalse(breaker.allow())
+        breaker.failure()  # The trial failing opens the circuit again
+        self.assertFalse(breaker.allow())
+
+        self.now += 30
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertTrue(breaker.allow())  # Closed
+        self.assertTrue(breaker.allow())
+
+    def test_server_errors_open_the_circuit(self):
+        client = self.host_client(status=503)
+        for _ in range(2):
+            self.assertEqual(self.send(client).status_code, 503)
+            self.now += 1  # A token per second
+        with self.assertRaises(outbound.CircuitOpenError):
+            self.send(client)
+        self.assertEqual(client.session.request.call_count, 2)
+
+    def test_trial_without_an_outcome_is_released(self):
+        client = self.host_client()
+        client.breaker.failure()
+        client.breaker.failure()
+        self.now += 30
+
+        # The trial call is rate limited before reaching the host...
+        client.bucket.tokens, client.bucket.updated_at = 0, self.now
+        client.max_wait = 0
+        with self.assertRaises(outbound.RateLimitedError):
+            self.send(client)
+        # ...or fails in our code: either way the next call is the trial
+        client.session.request.side_effect = ValueError
+        self.now += 1
+        with self.assertRaises(ValueError):
+            self.send(client)
+
+        client.session.request.side_effect = None
+        self.now += 1
+        self.assertEqual(self.send(client).status_code, 200)
+        self.assertIsNone(client.breaker.opened_at)
+
+    def test_rate_limit(self):
+        bucket = outbound.TokenBucket(rate=2, capacity=2)
+        self.assertTrue(bucket.acquire(max_wait=0))
+        self.assertTrue(bucket.acquire(max_wait=0))
+        self.assertFalse(bucket.acquire(max_wait=0.4))  # The next token is 0.5s away
+        self.assertEqual(self.now, 1000.0)
+        self.assertTrue(bucket.acquire(max_wait=0.5))  # Waits for it
+        self.assertEqual(self.now, 1000.5)
+
+        client = self.host_client()
+        client.max_wait = 0
+        self.send(client)
+        with self.assertRaises(outbound.RateLimitedError):
+            self.send(client)
+        self.assertEqual(client.session.request.call_count, 1)
+
+    def test_retry_policy(self):
+        retry = self.host_client().session.get_adapter("https://api.example.com/").max_retries
+        self.assertEqual(retry.total, outbound.DEFAULTS["RETRIES"])
+        self.assertTrue(retry.is_retry("GET", 503))
+        self.assertTrue(retry.is_retry("GET", 429))
+        self.assertFalse(retry.is_retry("GET", 404))
+        self.assertFalse(retry.is_retry("POST", 503))  # Not idempotent
+
+
+@override_settings(NOTIFICATIONS={"DIGEST_DELAY": 0, "BATCH_SIZE": 2, "BACKOFF_SECONDS": 60})
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f"notified-{i}") for i in range(4)]
+        self.calls = []
+        self.unsubscribed = set()
+        self.status = 200
+        post_patch = mock.patch.object(outbound, "post", self.fake_onesignal)
+        post_patch.start()
+        self.addCleanup(post_patch.stop)
+
+    def fake_onesignal(self, service, endpoint, url, **kwargs):
+        """Answers like the fake_onesignal command"""
+        self.calls.append(kwargs["json"])
+        user_ids = kwargs["json"]["include_external_user_ids"]
+        invalid = [user_id for user_id in user_ids if int(user_id) in self.unsubscribed]
+        body = {"id": "notification"}
+        if invalid and len(invalid) == len(user_ids):
+            body = {"id": "", "errors": ["All included players are not subscribed"]}
+        elif invalid:
+            body["errors"] = {"invalid_external_user_ids": invalid}
+        response = requests.Response()
+        response.status_code, response.url = self.status, url
+        response._content = json.dumps(body).encode()
+        return response
+
+    def enqueue(self, user, kind, key):
+        outbox.enqueue([outbox.make_event(user.pk, kind, "Title", f"Event {key}", key)])
+
+    def statuses(self):
+        return dict(NotificationEvent.objects.values_list("dedupe_key", "status"))
+
+    def test_reruns_are_deduplicated(self):
+        category = Category.objects.create(name="Streaming")
+        subscription = Subscription.objects.bulk_create(
+            [Subscription(name="Netflix", category=category)]
+        )[0]
+        plan = Plan.objects.create(subscription=subscription, name="Basic", cost=10)
+        user = self.users[0]
+        UserPlan.objects.create(user=user, plan=plan, payment_date=date.today())
+
+        tasks.update_payment_plans(user)
+        tasks.update_payment_plans(user)
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+        outbox.run_delivery("worker")
+        tasks.update_payment_plans(user)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(NotificationEvent.objects.count(), 1)
+
+    def test_users_are_coalesced_and_batched(self):
+        payment = NotificationEvent.Kind.UPCOMING_PAYMENT
+        unused = NotificationEvent.Kind.UNUSED_SUBSCRIPTION
+        for i, user in enumerate(self.users[:3]):
+            self.enqueue(user, payment, f"payment-{i}-a")
+            self.enqueue(user, payment, f"payment-{i}-b")
+        self.enqueue(self.users[3], payment, "payment-3")
+        self.enqueue(self.users[3], unused, "unused-3")
+        self.unsubscribed = {self.users[1].pk}
+
+        totals = outbox.run_delivery("worker")
+
+        self.assertEqual(totals, {"sent": 3, "skipped": 1, "failed": 0})
+        # One digest per user; the 3 users with the same digest in batches of 2
+        self.assertEqual(
+            sorted(
+                (call["contents"]["en"], len(call["include_external_user_ids"]))
+                for call in self.calls
+            ),
+            [
+                ("1 subscription payment is due soon\n1 subscription went unused", 1),
+                ("2 subscription payments are due soon", 1),
+                ("2 subscription payments are due soon", 2),
+            ],
+        )
+        statuses = self.statuses()
+        self.assertEqual(statuses.pop("payment-1-a"), NotificationEvent.Status.SKIPPED)
+        self.assertEqual(statuses.pop("payment-1-b"), NotificationEvent.Status.SKIPPED)
+        self.assertEqual(set(statuses.values()), {NotificationEvent.Status.SENT})
+
+    def test_failures_back_off_and_give_up(self):
+        self.enqueue(self.users[0], NotificationEvent.Kind.UPCOMING_PAYMENT, "payment")
+        self.status = 503
+
+        for attempt, backoff in enumerate([60, 120, 240, 480], start=1):
+            self.assertEqual(outbox.run_delivery("worker")["failed"], 1)
+            event = NotificationEvent.objects.get()
+            self.assertEqual((event.status, event.attempts), ("pending", attempt))
+            delay = (event.next_attempt_at - dj_timezone.now()).total_seconds()
+            self.assertAlmostEqual(delay, backoff, delta=5)
+            # Not retried before its backoff has passed
+            self.assertEqual(outbox.run_delivery("worker")["failed"], 0)
+            event.next_attempt_at = dj_timezone.now()
+            event.save()
+
+        outbox.run_delivery("worker")
+        self.assertEqual(NotificationEvent.objects.get().status, NotificationEvent.Status.FAILED)
+        self.assertEqual(len(self.calls), 5)
+
+
+class MetricsTests(TestCase):
+    def registry(self, requests_total, durations):
+        registry = metrics.Registry()
+        counter = registry.counter("requests_total", "Requests", ["route"])
+        histogram = registry.histogram(
+            "duration_seconds", "Durations", ["route"], buckets=(0.1, 1)
+        )
+        counter.inc(requests_total, route="/a")
+        for duration in durations:
+            histogram.observe(duration, route="/a")
+        return registry
+
+    def test_exposition_format(self):
+        self.assertEqual(
+            self.registry(2, [0.05, 0.5, 3]).render(),
+            "# HELP requests_total Requests\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{route="/a"} 2\n'
+            "# HELP duration_seconds Durations\n"
+            "# TYPE duration_seconds histogram\n"
+            'duration_seconds_bucket{route="/a",le="0.1"} 1\n'
+            'duration_seconds_bucket{route="/a",le="1"} 2\n'
+            'duration_seconds_bucket{route="/a",le="+Inf"} 3\n'
+            'duration_seconds_sum{route="/a"} 3.55\n'
+            'duration_seconds_count{route="/a"} 3\n',
+        )
+
+    def test_processes_are_summed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # Another worker's flushed values
+            with open(os.path.join(directory, "metrics-1.json"), "w") as f:
+                json.dump(self.registry(3, [0.5]).snapshot(), f)
+
+            with override_settings(METRICS={"MULTIPROCESS_DIR": directory}):
+                rendered = self.registry(2, [0.05, 3]).render()
+        self.assertIn('requests_total{route="/a"} 5\n', rendered)
+        self.assertIn('duration_seconds_bucket{route="/a",le="1"} 2\n', rendered)
+        self.assertIn('duration_seconds_count{route="/a"} 3\n', rendered)
+
+    def test_streamed_calls_are_timed_until_closed(self):
+        now = [0.0]
+        clock = mock.Mock(perf_counter=lambda: now[0], monotonic=lambda: now[0])
+        response = requests.Response()
+        response.status_code, response.raw = 200, BytesIO(b"body")
+        with mock.patch.object(metrics, "time", clock):
+            with metrics.track_outbound("streaming", "data") as call:
+                call.record(response, stream=True)
+                now[0] = 1.0  # Headers received
+            now[0] = 5.0  # Body read
+            response.close()
+            response.close()
+
+        key = ("streaming", "data")
+        counts = metrics.outbound_duration.values[key]
+        self.assertEqual((sum(counts[:-1]), counts[-1]), (1, 5.0))
+        self.assertEqual(metrics.outbound_requests.values[(*key, "2xx")], 1)
+
+    def test_endpoint_requires_a_token(self):
+        url = reverse("metrics")
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with override_settings(METRICS={"TOKEN": "secret"}):
+            self.assertEqual(self.client.get(url).status_code, 401)
+            response = self.client.get(url, headers={"Authorization": "Bearer secret"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"# TYPE http_request_duration_seconds histogram", response.content)
+        with override_settings(METRICS={"ALLOW_UNAUTHENTICATED": True}):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class JSONRenderingTests(SimpleTestCase):
+    def test_fast_renderer_matches_drf(self):
+        data = {
+            "cost": Decimal("9.90"),
+            "paid_at": datetime(2025, 1, 2, 3, 4, 5, 6000, tzinfo=timezone.utc),
+            "payment_date": date(2025, 1, 2),
+            "name": "Caf\u00e9 \u2028",
+            "plans": [{"id": 1, "usage": 0.5, "trial": None}],
+            1: True,
+        }
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(
+            FastJSONRenderer().render(data, "application/json; indent=4"),
+            JSONRenderer().render(data, "application/json; indent=4"),
+        )
+
+    def test_fast_parser(self):
+        body = FastJSONRenderer().render({"budget": 80, "category_caps": {"1": 30.5}})
+        parsed = FastJSONParser().parse(BytesIO(body))
+        self.assertEqual(parsed, {"budget": 80, "category_caps": {"1": 30.5}})
+
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b"{bad"))
+
+    def test_compression_threshold(self):
+        request = RequestFactory().get("/", headers={"Accept-Encoding": "gzip"})
+
+        def compressed(size, content_type="application/json"):
+            middleware = CompressionMiddleware(
+                lambda request: HttpResponse(b"1" * size, content_type=content_type)
+            )
+            return middleware(request).has_header("Content-Encoding")
+
+        with self.settings(COMPRESSION={"MIN_SIZE": 1000}):
+            self.assertFalse(compressed(999))
+            self.assertTrue(compressed(1000))
+            self.assertFalse(compressed(1000, "image/png"))
+
+
+class UserPlanCostFilterTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="filters", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        category = Category.objects.create(name="Streaming")
+        self.user_plans = {}
+        for name, cost, period in [
+            ("Netflix", Decimal("10.00"), Plan.Period.MONTH),
+            ("Hulu", Decimal("20.00"), Plan.Period.MONTH),
+            ("Disney+", Decimal("5.00"), Plan.Period.WEEK),  # $21.43 a month
+        ]:
+            subscription = Subscription.objects.bulk_create(
+                [Subscription(name=name, category=category)]
+            )[0]
+            plan = Plan.objects.create(
+                subscription=subscription, name="Basic", cost=cost, period=period
+            )
+            self.user_plans[name] = UserPlan.objects.create(
+                user=self.user, plan=plan, payment_date=date.today()
+            ).pk
+
+    def assertMatches(self, params, names):
+        response = self.client.get(f"/api/user-plans/?{params}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(user_plan["id"] for user_plan in response.json()["results"]),
+            sorted(self.user_plans[name] for name in names),
+        )
+
+    def test_bounds_are_inclusive(self):
+        # The per-day costs of $10 and $20 a month aren't whole micros, so the bounds
+        # must be rounded like the stored costs to match them
+        self.assertMatches("period=month&cost_min=10", ["Netflix", "Hulu", "Disney+"])
+        self.assertMatches("period=month&cost_max=20", ["Netflix", "Hulu"])
+        self.assertMatches("period=month&cost_min=10&cost_max=10", ["Netflix"])
+        self.assertMatches("period=month&cost_min=20.01&cost_max=21.43", ["Disney+"])
+        self.assertMatches("period=week&cost_min=5&cost_max=5", ["Disney+"])
+
+
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="calendar", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+        category = Category.objects.create(name="Music")
+        # bulk_create() skips Subscription.save(), which looks up the icon over HTTP
+        subscription = Subscription.objects.bulk_create(
+            [Subscription(name="Spotify", category=category)]
+        )[0]
+        plan = Plan.objects.create(subscription=subscription, name="Premium", cost=11)
+        UserPlan.objects.create(user=self.user, plan=plan, payment_date=date(2025, 1, 2))
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json(), [query["sql"] for query in queries]
+
+    def test_fields_trim_output_and_joins(self):
+        data, queries = self.get("/api/user-plans/?fields=id,payment_date")
+
+        self.assertEqual(list(data["results"][0]), ["id", "payment_date"])
+        self.assertEqual(data["results"][0]["payment_date"], "2025-01-02")
+        self.assertFalse(any("JOIN" in sql for sql in queries))
+        self.assertFalse(any('"api_userplan"."usage_score"' in sql for sql in queries))
+
+    def test_fields_read_through_relations(self):
+        data, _ = self.get("/api/user-plans/?fields=subscription_name,cost,user&period=month")
+
+        self.assertEqual(
+            data["results"][0], {"subscription_name": "Spotify", "user": "calendar", "cost": 11}
+        )
+
+    def test_full_response_by_default(self):
+        data, queries = self.get("/api/user-plans/")
+
+        self.assertIn("total_spent", data["results"][0])
+        self.assertEqual(data["results"][0]["user"], "calendar")
+        self.assertEqual(len(queries), 2)  # Count and page, relations joined
+
+    def test_catalog_fields(self):
+        data, queries = self.get("/api/subscriptions/?fields=name,plans")
+        self.assertEqual(data[0]["name"], "Spotify")
+        self.assertEqual(data[0]["plans"][0]["name"], "Premium")
+        self.assertEqual(len(queries), 2)  # Plans are prefetched
+
+        data, _ = self.get("/api/plans/?fields=cost,period")
+        self.assertEqual(data, [{"period": "month", "cost": 11.0}])
+
+    def test_unknown_fields(self):
+        response = self.client.get("/api/plans/?fields=cost,secret")
+        self.assertEqual(response.status_code, 400)
+
+
+class LoadTestTests(LiveServerTestCase):
+    # Analytics reads are routed to the replica (a mirror of the test database), whose
+    # connection is only shared with the live server thread when listed here
+    databases = {"default", "replica"}
+
+    def loadtest(self, **options):
+        stdout = StringIO()
+        call_command(
+            "loadtest",
+            url=self.live_server_url,
+            users=2,
+            concurrency=2,
+            duration=0.5,
+            stdout=stdout,
+            stderr=StringIO(),
+            **options,
+        )
+        return json.loads(stdout.getvalue())
+
+    def test_replays_the_mix_against_seeded_users(self):
+        report = self.loadtest(seed_users=2, plans=3)
+
+        self.assertEqual(User.objects.filter(username__startswith="loadtest-").count(), 2)
+        self.assertGreater(report["requests"], 0)
+        self.assertEqual(report["error_rate"], 0.0)
+        self.assertEqual(report["accounts"], 2)
+        self.assertLessEqual(report["p50_ms"], report["p95_ms"])
+        self.assertLessEqual(report["p95_ms"], report["p99_ms"])
+        self.assertLessEqual(
+            set(report["routes"]),
+            {
+                "dashboard",
+                "user_plans.list",
+                "user_plans.filtered",
+                "subscriptions",
+                "spending",
+                "spending_by_category",
+                "budget",
+                "settings",
+                "toggle_usage",
+                "user_plans.create",
+                "user_plans.delete",
+            },
+        )
+        self.assertEqual(
+            sum(route["requests"] for route in report["routes"].values()), report["requests"]
+        )
+
+    def test_login_failure(self):
+        call_command(
+            "seed_synthetic", users=1, plans=1, prefix="loadtest", reset=True, stdout=StringIO()
+        )
+        with self.assertRaisesMessage(CommandError, "Could not log in as 'loadtest-0'"):
+            self.loadtest(password="wrong")
+
+
+class LoadTestSummaryTests(SimpleTestCase):
+    def test_summary(self):
+        results = [loadtest.Result("dashboard", 200, ms, True) for ms in range(1, 99)] + [
+            loadtest.Result("dashboard", 500, 99, False),
+            loadtest.Result("dashboard", None, 100, False),
+        ]
+        summary = loadtest._summary(results, elapsed=2)
+
+        self.assertEqual(summary["requests"], 100)
+        self.assertEqual(summary["requests_per_sec"], 50)
+        self.assertEqual(summary["error_rate"], 0.02)
+        self.assertEqual(summary["statuses"], {"200": 98, "500": 1, "connection_error": 1})
+        self.assertEqual(
+            (summary["p50_ms"], summary["p95_ms"], summary["p99_ms"], summary["max_ms"]),
+            (50, 95, 99, 100),
+        )
+        self.assertEqual(loadtest._summary([], elapsed=0)["error_rate"], 0.0)
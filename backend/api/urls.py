@@ -37,17 +37,63 @@ analytics_urlpatterns = [
     ),
     path("usage-by-category/", UsageByCategory.as_view(), name="usage-by-category"),
     path("set-budget/", SetBudgetView.as_view(), name="set-budget"),
+    path("dashboard/", DashboardView.as_view(), name="dashboard"),
+    path(
+        "popular-subscriptions/",
+        PopularSubscriptions.as_view(),
+        name="popular-subscriptions",
+    ),
+    path(
+        "category-benchmarks/", CategoryBenchmarks.as_view(), name="category-benchmarks"
+    ),
+    path(
+        "recommendations/",
+        CheaperPlanRecommendations.as_view(),
+        name="recommendations",
+    ),
+]
+
+# Async (ASGI) variants of the read-only analytics endpoints
+async_analytics_urlpatterns = [
+    path(
+        "total-spending-per-period/",
+        AsyncTotalSpendingPerPeriod.as_view(),
+        name="async-total-spending-per-period",
+    ),
+    path(
+        "average-spending-per-period/",
+        AsyncAverageSpendingPerPeriod.as_view(),
+        name="async-average-spending-per-period",
+    ),
+    path(
+        "spending-by-category/",
+        AsyncSpendingByCategory.as_view(),
+        name="async-spending-by-category",
+    ),
+    path(
+        "usage-by-category/",
+        AsyncUsageByCategory.as_view(),
+        name="async-usage-by-category",
+    ),
 ]
 
 cron_urlpatterns = [
     path("payment/", UpdateView.as_view(), name="update-payment-plans"),
     path("unused/", UpdateUnusedView.as_view(), name="update-unused-plans"),
+    path(
+        "notifications/",
+        DeliverNotificationsView.as_view(),
+        name="deliver-notifications",
+    ),
+    path("rollups/", RebuildRollupsView.as_view(), name="rebuild-rollups"),
+    path("jobs/<int:pk>/", CronJobStatusView.as_view(), name="cron-job-status"),
 ]
 
 urlpatterns = [
     path("auth/", include(auth_urlpatterns)),  # Authentication
     path("user/", include(user_urlpatterns)),  # User-related
     path("analytics/", include(analytics_urlpatterns)),  # Analytics
+    path("analytics/async/", include(async_analytics_urlpatterns)),  # Analytics (ASGI)
     path("cron/", include(cron_urlpatterns)),  # Cron jobs
     path(
         "user-plans/<int:pk>/toggle-usage/",
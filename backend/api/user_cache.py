@@ -0,0 +1,218 @@
+"""
+Cache of the users CookieJWTAuthentication looks up, so authenticated requests don't
+each SELECT the user. Entries are keyed by user id and the access token's `iat`, hold the
+user's columns (except the password hash, which is deferred) and live for TTL seconds in
+a bounded in-process LRU, backed by an optional shared cache. Saving or deleting a user,
+logging out and bumping their data version drop their entries.
+
+The in-process LRU only sees this process's invalidations, so with several workers other
+processes may use a user's old row for up to TTL seconds; set SHARED_CACHE to check a
+per-user generation in the shared cache on every hit instead.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+
+DEFAULTS = {
+    "ENABLED": False,
+    "TTL": 5,  # seconds an entry is reused
+    "MAX_SIZE": 1024,  # entries in the in-process LRU
+    "SHARED_CACHE": None,  # alias in settings.CACHES, e.g. a Redis cache
+}
+
+
+def get_setting(name):
+    return getattr(settings, "AUTH_USER_CACHE", {}).get(name, DEFAULTS[name])
+
+
+def _cached_fields():
+    # The password hash is only loaded when tokens are revoked by password changes
+    return [
+        field.attname
+        for field in User._meta.concrete_fields
+        if field.attname != "password" or api_settings.CHECK_REVOKE_TOKEN
+    ]
+
+
+class LRUCache:
+    """A thread-safe LRU of (expiry, value) entries"""
+
+    def __init__(self):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl, max_size):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_size:
+                self.entries.popitem(last=False)
+
+    def delete_users(self, user_ids):
+        with self.lock:
+            for key in [key for key in self.entries if key[0] in user_ids]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local = LRUCache()
+
+
+def _shared_cache():
+    alias = get_setting("SHARED_CACHE")
+    return caches[alias] if alias else None
+
+
+def _to_user(entry):
+    """A new User instance per request, as views may modify request.user"""
+    db, names, values, _ = entry
+    return User.from_db(db, names, values)
+
+
+def _to_entry(user, generation):
+    names = _cached_fields()
+    return user._state.db, names, [getattr(user, name) for name in names], generation
+
+
+def _user_id(user_id):
+    """Ids as ints, as tokens may carry the user id claim as a string; None if invalid"""
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def _keys(user_id, iat):
+    return f"auth-user:{user_id}:{iat}", f"auth-user:{user_id}:generation"
+
+
+def _current(entry, generation):
+    """Whether a shared entry is still valid, given the user's current generation"""
+    return entry is not None and entry[3] == generation
+
+
+def lookup(user_id, iat):
+    """The cached user, or None"""
+    user_id = _user_id(user_id)
+    if not get_setting("ENABLED") or user_id is None:
+        return None
+    entry = _local.get((user_id, iat))
+    if (shared := _shared_cache()) is None:
+        return _to_user(entry) if entry else None
+
+    entry_key, generation_key = _keys(user_id, iat)
+    if entry is not None:
+        return _to_user(entry) if _current(entry, shared.get(generation_key, 0)) else None
+
+    values = shared.get_many([entry_key, generation_key])
+    entry = values.get(entry_key)
+    if not _current(entry, values.get(generation_key, 0)):
+        return None
+    _local.set((user_id, iat), entry, get_setting("TTL"), get_setting("MAX_SIZE"))
+    return _to_user(entry)
+
+
+def generation(user_id):
+    """Read before loading a user from the database, and passed to store()"""
+    user_id = _user_id(user_id)
+    if not get_setting("ENABLED") or user_id is None or (shared := _shared_cache()) is None:
+        return 0
+    return shared.get(_keys(user_id, None)[1], 0)
+
+
+def store(user, iat, generation=0):
+    if not get_setting("ENABLED"):
+        return
+    user_id = _user_id(user.pk)
+    entry = _to_entry(user, generation)
+    _local.set((user_id, iat), entry, get_setting("TTL"), get_setting("MAX_SIZE"))
+    if (shared := _shared_cache()) is not None:
+        shared.set(_keys(user_id, iat)[0], entry, get_setting("TTL"))
+
+
+async def alookup(user_id, iat):
+    user_id = _user_id(user_id)
+    if not get_setting("ENABLED") or user_id is None:
+        return None
+    entry = _local.get((user_id, iat))
+    if (shared := _shared_cache()) is None:
+        return _to_user(entry) if entry else None
+
+    entry_key, generation_key = _keys(user_id, iat)
+    if entry is not None:
+        current = _current(entry, await shared.aget(generation_key, 0))
+        return _to_user(entry) if current else None
+
+    values = await shared.aget_many([entry_key, generation_key])
+    entry = values.get(entry_key)
+    if not _current(entry, values.get(generation_key, 0)):
+        return None
+    _local.set((user_id, iat), entry, get_setting("TTL"), get_setting("MAX_SIZE"))
+    return _to_user(entry)
+
+
+async def ageneration(user_id):
+    user_id = _user_id(user_id)
+    if not get_setting("ENABLED") or user_id is None or (shared := _shared_cache()) is None:
+        return 0
+    return await shared.aget(_keys(user_id, None)[1], 0)
+
+
+async def astore(user, iat, generation=0):
+    if not get_setting("ENABLED"):
+        return
+    user_id = _user_id(user.pk)
+    entry = _to_entry(user, generation)
+    _local.set((user_id, iat), entry, get_setting("TTL"), get_setting("MAX_SIZE"))
+    if (shared := _shared_cache()) is not None:
+        await shared.aset(_keys(user_id, iat)[0], entry, get_setting("TTL"))
+
+
+def invalidate(user_ids):
+    """Drops the users' entries, whatever token they were cached for"""
+    user_ids = {_user_id(user_id) for user_id in user_ids} - {None}
+    if not user_ids:
+        return
+    _local.delete_users(user_ids)
+
+    shared = _shared_cache()
+    if shared is not None:
+        # Entries stored under an older generation are ignored from now on
+        for user_id in user_ids:
+            key = _keys(user_id, None)[1]
+            shared.add(key, 0, None)
+            try:
+                shared.incr(key)
+            except ValueError:  # Evicted in between
+                shared.set(key, 1, None)
+
+
+def user_changed(sender, instance, **kwargs):
+    """post_save/post_delete receiver for User (profile and settings edits, passwords)"""
+    invalidate([instance.pk])
+
+
+def clear():
+    """Empties the in-process LRU"""
+    _local.clear()
@@ -1,10 +1,17 @@
+import logging
 import os
+import numpy as np
 import requests
 from dotenv import load_dotenv
 from urllib.parse import (
     quote,
 )  # https://stackoverflow.com/questions/21823965/use-20-instead-of-for-space-in-python-query-parameters
 
+from . import outbound
+from .money import CENTS_PER_UNIT, div_round
+
+logger = logging.getLogger(__name__)
+
 # Load environment variables
 load_dotenv()
 
@@ -20,10 +27,8 @@ def get_icon_url(name):
     api_url = f"{LOGODEV_API_URL}/search?q={quote(name)}"
     headers = {"Authorization": f"Bearer {LOGODEV_API_SKEY}"}
 
-    response = requests.get(api_url, headers=headers)
-
     try:
-        response = requests.get(api_url, headers=headers)
+        response = outbound.get("logodev", "search", api_url, headers=headers)
         response.raise_for_status()
 
         data = response.json()
@@ -33,7 +38,7 @@ def get_icon_url(name):
                 return f"{logo_url}&format=webp&retina=true"
 
     except requests.exceptions.RequestException as e:
-        print(f"Error fetching icon URL: {e}")
+        logger.warning("Error fetching icon URL: %s", e)
 
     return DEFAULT_ICON_URL
 
@@ -65,20 +70,21 @@ def _knapsack(i, remaining, plans, memo):
     return max_val
 
 
-def budget_plans(user_plans, original_budget):
+def budget_plans(user_plans, budget_cents):
     """
     Finds optimat set of subscriptions to include w/in a given budget
     Checks combinations of plan costs (weights) while maximizing usage score (value)
+    Plans are dicts of id, usage_score and cost_cents, and the budget is in cents
     Returns list of plan ids included in the budget
     """
-    # Preprocess and sort plans by cost to usage score ratio (can prune suboptimal paths sooner), and rounds costs to use for memo
+    # Preprocess and sort plans by cost to usage score ratio (can prune suboptimal paths sooner), and rounds costs to whole units to use for memo
     processed = sorted(
         (
             {
                 "id": p["id"],
                 "usage_score": p["usage_score"],
-                "scaled_cost": round(p["cost"]),
-                "value_density": p["usage_score"] / max(p["cost"], 1e-9),
+                "scaled_cost": div_round(p["cost_cents"], CENTS_PER_UNIT),
+                "value_density": p["usage_score"] / max(p["cost_cents"], 1e-9),
             }
             for p in user_plans
         ),
@@ -86,7 +92,7 @@ def budget_plans(user_plans, original_budget):
     )
 
     # Initialize memoization table and solve (build memo table)
-    budget = round(original_budget)
+    budget = div_round(budget_cents, CENTS_PER_UNIT)
     memo = {}
     max_score = _knapsack(0, budget, processed, memo)
 
@@ -108,3 +114,87 @@ def budget_plans(user_plans, original_budget):
             remaining_budget -= cost
 
     return selected
+
+
+
+def _category_frontier(plans, capacity):
+    """
+    0/1 knapsack over one category's plans for every budget up to `capacity` (in units).
+    Returns best[w], the highest usage score costing at most w, and taken[i][w], whether
+    plan i is in that selection over plans[:i + 1] (to reconstruct it for any w).
+    """
+    best = np.zeros(capacity + 1, dtype=np.int64)
+    taken = np.zeros((len(plans), capacity + 1), dtype=bool)
+    for i, plan in enumerate(plans):
+        cost = plan["scaled_cost"]
+        with_plan = best[: capacity + 1 - cost] + plan["usage_score"]
+        improves = with_plan > best[cost:]
+        taken[i, cost:] = improves
+        best[cost:] = np.where(improves, with_plan, best[cost:])
+    return best, taken
+
+
+def _frontier_selection(plans, taken, budget):
+    selected = []
+    for i in range(len(plans) - 1, -1, -1):
+        if taken[i, budget]:
+            selected.append(plans[i]["id"])
+            budget -= plans[i]["scaled_cost"]
+    return selected
+
+
+def budget_plans_by_category(user_plans, budget_cents, category_caps_cents):
+    """
+    Like budget_plans(), with per-category caps on top of the total budget.
+    Plans are dicts of id, usage_score, cost_cents and category, and caps map categories
+    to budgets in cents (uncapped categories are only limited by the total).
+    Each category is solved on its own into a frontier (best score per spend), then the
+    frontiers are merged under the total budget, so the work grows with
+    categories x budget x cap rather than with the product of all the caps.
+    Returns list of plan ids included in the budget
+    """
+    budget = div_round(budget_cents, CENTS_PER_UNIT)
+
+    plans_by_category = {}
+    for p in user_plans:
+        plans_by_category.setdefault(p["category"], []).append(
+            {
+                "id": p["id"],
+                "usage_score": p["usage_score"],
+                "scaled_cost": div_round(p["cost_cents"], CENTS_PER_UNIT),
+            }
+        )
+
+    # Per-category frontiers, each limited by its cap
+    frontiers = []
+    for category, plans in plans_by_category.items():
+        cap = budget
+        if category in category_caps_cents:
+            cap = min(cap, div_round(category_caps_cents[category], CENTS_PER_UNIT))
+        plans = [p for p in plans if p["scaled_cost"] <= cap]
+        best, taken = _category_frontier(plans, cap)
+        frontiers.append((plans, best, taken))
+
+    # Merge: total[w] is the best score spending at most w on the categories so far,
+    # and spend[w] how much of w the latest category gets in that solution
+    total = np.zeros(budget + 1, dtype=np.int64)
+    spends = []
+    for _, best, _ in frontiers:
+        merged = total + best[0]
+        spend = np.zeros(budget + 1, dtype=np.int64)
+        for s in range(1, len(best)):
+            with_spend = total[: budget + 1 - s] + best[s]
+            improves = with_spend > merged[s:]
+            merged[s:] = np.where(improves, with_spend, merged[s:])
+            spend[s:][improves] = s
+        total = merged
+        spends.append(spend)
+
+    # Walk back through the merges to split the budget, then select within each category
+    selected = []
+    remaining = budget
+    for (plans, _, taken), spend in zip(reversed(frontiers), reversed(spends)):
+        category_budget = int(spend[remaining])
+        selected.extend(_frontier_selection(plans, taken, category_budget))
+        remaining -= category_budget
+    return selected
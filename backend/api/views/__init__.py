@@ -1,4 +1,6 @@
 from .analytics_views import *
+from .async_analytics_views import *
 from .model_views import *
 from .cron_views import *
+from .metrics_views import *
 from .user_views import *
\ No newline at end of file
@@ -3,22 +3,27 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 
-from django.db.models import (
-    Q,
-    F,
-    ExpressionWrapper,
-    FloatField,
-)
+from django.db.models import Q
 
-from ..models import Plan, UserPlan
+from ..models import CategoryRollup, Plan, SubscriptionRollup, UserPlan
 from ..serializers import UserPlanSerializer
-from ..services import SpendingCalculator, AverageSpendingCalculator
-from ..serializers import PeriodQueryParamSerializer
+from ..services import (
+    PlanPortfolio,
+    SpendingCalculator,
+    AverageSpendingCalculator,
+    calculate_spending_by_category,
+    calculate_usage_by_category,
+)
+from ..serializers import BudgetRequestSerializer, PeriodQueryParamSerializer
 
-from ..utils import budget_plans
+from ..recommendations import find_cheaper_plans
+from ..conditional import ConditionalGetMixin
+from ..routers import ReplicaReadMixin
+from ..money import div_round, from_cents, normalize_cents, to_cents
+from ..utils import budget_plans, budget_plans_by_category
 
 
-class AverageSpendingPerPeriod(APIView):
+class AverageSpendingPerPeriod(ConditionalGetMixin, ReplicaReadMixin, APIView):
     """Gets normalized total spending for each period"""
 
     def get(self, request):
@@ -37,7 +42,8 @@ class AverageSpendingPerPeriod(APIView):
                 target_periods = Plan.Period.choices
 
             # Calculate results
-            calculator = AverageSpendingCalculator(UserPlan.objects.filter(user=user))
+            portfolio = PlanPortfolio.from_queryset(UserPlan.objects.filter(user=user))
+            calculator = AverageSpendingCalculator(portfolio)
             results = calculator.calculate_averages(target_periods)
 
             return Response(results)
@@ -46,14 +52,15 @@ class AverageSpendingPerPeriod(APIView):
             return Response({"error": str(e)}, status=400)
 
 
-class TotalSpendingPerPeriod(APIView):
+class TotalSpendingPerPeriod(ConditionalGetMixin, ReplicaReadMixin, APIView):
     """Retrieving total spending in the past __ period"""
 
     def get(self, request):
         user = request.user
         days_param = request.query_params.get("days")
 
-        calculator = SpendingCalculator(UserPlan.objects.filter(user=user))
+        portfolio = PlanPortfolio.from_queryset(UserPlan.objects.filter(user=user))
+        calculator = SpendingCalculator(portfolio)
 
         try:
             if days_param:
@@ -78,99 +85,189 @@ class TotalSpendingPerPeriod(APIView):
             raise ValidationError("Days parameter must be a positive integer")
 
 
-class SpendingByCategory(APIView):
+class SpendingByCategory(ConditionalGetMixin, ReplicaReadMixin, APIView):
     def get(self, request):
         user = request.user
-        user_plans = UserPlan.objects.filter(user=user).select_related(
-            "plan__subscription__category"
-        )
+        portfolio = PlanPortfolio.from_queryset(UserPlan.objects.filter(user=user))
 
-        # Get all period labels from Plan model
-        period_labels = [label for _, label in Plan.Period.choices]
-        totals = {period: 0.0 for period in period_labels}
-        spending_data = {}
+        spending_data = calculate_spending_by_category(portfolio)
+        return Response(spending_data, status=status.HTTP_200_OK)
 
-        for user_plan in user_plans:
-            plan = user_plan.plan
-            category = plan.subscription.category
-            cost = float(plan.cost)
-            period_days = plan.period
-
-            if period_days == 0:  # Avoid divide by zero error
-                continue
-
-            daily_cost = cost / period_days
-
-            # Calculate costs for all periods
-            for target_period in period_labels:
-                target_days = Plan.Period.get_days(target_period)
-                period_cost = daily_cost * target_days
-
-                if category.name not in spending_data:
-                    spending_data[category.name] = {
-                        "icon": category.icon_emoji,
-                        "costs": {p: 0.0 for p in period_labels},
-                        "percentages": {p: 0.0 for p in period_labels},
-                    }
-
-                spending_data[category.name]["costs"][target_period] += period_cost
-                totals[target_period] += period_cost
-
-        # Calculate percentages and format response
-        for category, data in spending_data.items():
-            for period in period_labels:
-                total = totals[period]
-                period_cost = data["costs"][period]
-
-                data["percentages"][period] = round(
-                    (period_cost / total * 100) if total != 0 else 0, 2
-                )
 
-            # Format costs to 2 decimal places
-            data["costs"] = {k: round(v, 2) for k, v in data["costs"].items()}
+class UsageByCategory(ConditionalGetMixin, ReplicaReadMixin, APIView):
+    def get(self, request):
+        user = request.user
+        portfolio = PlanPortfolio.from_queryset(UserPlan.objects.filter(user=user))
+
+        usage_by_category = calculate_usage_by_category(portfolio)
+        return Response(usage_by_category, status=status.HTTP_200_OK)
 
-        return Response(spending_data, status=status.HTTP_200_OK)
 
+class DashboardView(ConditionalGetMixin, ReplicaReadMixin, APIView):
+    """
+    Combined dashboard analytics computed from a single fetch of the user's plans.
+    `sections` selects a comma-separated subset, and `days`/`period` apply to the
+    total/average sections like on their individual endpoints.
+    """
+
+    SECTIONS = [
+        "total_spending",
+        "average_spending",
+        "spending_by_category",
+        "usage_by_category",
+    ]
 
-class UsageByCategory(APIView):
     def get(self, request):
-        user = request.user
+        try:
+            sections = self._get_sections_param(request.query_params.get("sections"))
+            days = self._get_days_param(request.query_params.get("days"))
 
-        user_plans = UserPlan.objects.filter(user=user)
-        usage_by_category = {}
+            serializer = PeriodQueryParamSerializer(data=request.query_params)
+            serializer.is_valid(raise_exception=True)
+            period_param = serializer.validated_data.get("period", None)
+        except ValidationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        for user_plan in user_plans:
-            category = user_plan.plan.subscription.category.name
-            usage_score = user_plan.usage_score
+        portfolio = PlanPortfolio.from_queryset(
+            UserPlan.objects.filter(user=request.user)
+        )
+        results = {}
+
+        if "total_spending" in sections:
+            calculator = SpendingCalculator(portfolio)
+            if days:
+                results["total_spending"] = {
+                    f"past_{days}_days": calculator.calculate_custom_spending(days)
+                }
+            else:
+                results["total_spending"] = calculator.calculate_spending(
+                    SpendingCalculator.DEFAULT_PERIODS
+                )
 
-            if category not in usage_by_category:
-                usage_by_category[category] = 0
-            usage_by_category[category] += usage_score
+        if "average_spending" in sections:
+            if period_param:
+                target_periods = [(period_param, Plan.Period.get_label(period_param))]
+            else:
+                target_periods = Plan.Period.choices
+            results["average_spending"] = AverageSpendingCalculator(
+                portfolio
+            ).calculate_averages(target_periods)
 
-        return Response(usage_by_category, status=status.HTTP_200_OK)
+        if "spending_by_category" in sections:
+            results["spending_by_category"] = calculate_spending_by_category(portfolio)
+
+        if "usage_by_category" in sections:
+            results["usage_by_category"] = calculate_usage_by_category(portfolio)
+
+        return Response(results, status=status.HTTP_200_OK)
+
+    def _get_sections_param(self, sections_str):
+        if not sections_str:
+            return self.SECTIONS
+
+        sections = [
+            section.strip() for section in sections_str.split(",") if section.strip()
+        ]
+        invalid = [section for section in sections if section not in self.SECTIONS]
+        if invalid:
+            raise ValidationError(
+                f"Invalid sections: {invalid}. Valid options: {self.SECTIONS}"
+            )
+        return sections
+
+    def _get_days_param(self, days_str):
+        if not days_str:
+            return None
+        try:
+            days = int(days_str)
+            if days <= 0:
+                raise ValueError
+            return days
+        except ValueError:
+            raise ValidationError("Days parameter must be a positive integer")
 
 
 # Structure (function based views) according to source: https://spookylukey.github.io/django-views-the-right-way/delegation.html
-class SetBudgetView(APIView):
+class SetBudgetView(ConditionalGetMixin, ReplicaReadMixin, APIView):
     def get(self, request):
         try:
-            budget = self._get_budget_param(request.query_params)
+            budget_cents = self._get_budget_param(request.query_params)
             period = self._get_period_param(request.query_params.get("period", "month"))
 
             filters = self._build_filters(
                 request.user, request.query_params.get("category_id")
             )
 
-            budget_candidate_plans = self._get_annotated_plans(filters, period)
+            budget_candidate_plans = self._get_costed_plans(filters, period)
 
-            candidate_data = list(
-                budget_candidate_plans.values("id", "cost", "usage_score")
+            candidate_data = [
+                {
+                    "id": user_plan.id,
+                    "cost_cents": user_plan.cost_cents,
+                    "usage_score": user_plan.usage_score,
+                }
+                for user_plan in budget_candidate_plans
+            ]
+
+            budget_plan_ids = set(budget_plans(candidate_data, budget_cents))
+
+            included_plans = [
+                p for p in budget_candidate_plans if p.id in budget_plan_ids
+            ]
+            excluded_plans = [
+                p for p in budget_candidate_plans if p.id not in budget_plan_ids
+            ]
+
+            return Response(
+                {
+                    "included_plans": UserPlanSerializer(included_plans, many=True).data,
+                    "excluded_plans": UserPlanSerializer(excluded_plans, many=True).data,
+                },
+                status=status.HTTP_200_OK,
             )
 
-            budget_plan_ids = budget_plans(candidate_data, budget)
+        except ValidationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    def post(self, request):
+        """
+        Budget with per-category caps, e.g.
+        {"budget": 80, "period": "month", "category_caps": {"1": 30, "2": 20}}
+        """
+        try:
+            serializer = BudgetRequestSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            data = serializer.validated_data
+            period = data.get("period") or Plan.Period.MONTH
+            caps_cents = {
+                category_id: to_cents(cap)
+                for category_id, cap in data["category_caps"].items()
+            }
+
+            budget_candidate_plans = self._get_costed_plans(Q(user=request.user), period)
 
-            included_plans = budget_candidate_plans.filter(id__in=budget_plan_ids)
-            excluded_plans = budget_candidate_plans.exclude(id__in=budget_plan_ids)
+            candidate_data = [
+                {
+                    "id": user_plan.id,
+                    "cost_cents": user_plan.cost_cents,
+                    "usage_score": user_plan.usage_score,
+                    "category": user_plan.category_id,
+                }
+                for user_plan in budget_candidate_plans
+            ]
+
+            budget_plan_ids = set(
+                budget_plans_by_category(
+                    candidate_data, to_cents(data["budget"]), caps_cents
+                )
+            )
+
+            included_plans = [
+                p for p in budget_candidate_plans if p.id in budget_plan_ids
+            ]
+            excluded_plans = [
+                p for p in budget_candidate_plans if p.id not in budget_plan_ids
+            ]
 
             return Response(
                 {
@@ -188,7 +285,7 @@ class SetBudgetView(APIView):
             budget = float(query_params.get("budget"))
             if budget < 0:
                 raise ValidationError("Budget must be a positive number")
-            return budget
+            return to_cents(budget)
         except (ValueError, TypeError):
             raise ValidationError("Invalid budget value")
 
@@ -201,12 +298,102 @@ class SetBudgetView(APIView):
     def _build_filters(self, user, category_id):
         filters = Q(user=user)
         if category_id:
-            filters &= Q(plan__subscription__category_id=category_id)
+            filters &= Q(category_id=category_id)
         return filters
 
-    def _get_annotated_plans(self, filters, period):
-        return UserPlan.objects.filter(filters).annotate(
-            cost=ExpressionWrapper(
-                F("plan__cost") / F("plan__period") * period, output_field=FloatField()
+    def _get_costed_plans(self, filters, period):
+        """User plans with their cost normalized to the period (in cents, and as `cost`)"""
+        user_plans = list(
+            UserPlan.objects.filter(filters).select_related(
+                "user", "plan__subscription__category"
             )
         )
+        for user_plan in user_plans:
+            plan = user_plan.plan
+            user_plan.cost_cents = normalize_cents(
+                to_cents(plan.cost), plan.period, period
+            )
+            user_plan.cost = from_cents(user_plan.cost_cents)
+        return user_plans
+
+
+def _average_monthly_cost(rollup):
+    if not rollup.user_plans:
+        return 0.0
+    return from_cents(div_round(rollup.monthly_cost_cents, rollup.user_plans))
+
+
+class PopularSubscriptions(ReplicaReadMixin, APIView):
+    """
+    Most tracked subscriptions across all users, from the rollups (see rollups.py).
+    `usage_histogram[score]` counts the tracked plans with that usage score.
+    """
+
+    MAX_LIMIT = 100
+
+    def get(self, request):
+        try:
+            limit = self._get_limit(request.query_params.get("limit", 10))
+            rollups = SubscriptionRollup.objects.select_related(
+                "subscription__category"
+            ).order_by("-user_plans")
+            if category_id := request.query_params.get("category_id"):
+                if not category_id.isdigit():
+                    raise ValidationError("category_id must be an integer")
+                rollups = rollups.filter(subscription__category_id=category_id)
+        except ValidationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            [
+                {
+                    "id": rollup.subscription_id,
+                    "name": rollup.subscription.name,
+                    "icon_url": rollup.subscription.icon_url,
+                    "category": rollup.subscription.category.name,
+                    "user_plans": rollup.user_plans,
+                    "tracked_plans": rollup.tracked_plans,
+                    "average_monthly_cost": _average_monthly_cost(rollup),
+                    "usage_histogram": rollup.usage_histogram,
+                }
+                for rollup in rollups[:limit]
+            ],
+            status=status.HTTP_200_OK,
+        )
+
+    def _get_limit(self, value):
+        try:
+            limit = int(value)
+            if not 0 < limit <= self.MAX_LIMIT:
+                raise ValueError
+            return limit
+        except (ValueError, TypeError):
+            raise ValidationError(f"limit must be an integer from 1 to {self.MAX_LIMIT}")
+
+
+class CategoryBenchmarks(ReplicaReadMixin, APIView):
+    """Platform-wide stats per category from the rollups, to compare a user's spending with"""
+
+    def get(self, request):
+        rollups = CategoryRollup.objects.select_related("category").order_by("category__name")
+        return Response(
+            {
+                rollup.category.name: {
+                    "icon": rollup.category.icon_emoji,
+                    "subscriptions": rollup.subscriptions,
+                    "user_plans": rollup.user_plans,
+                    "tracked_plans": rollup.tracked_plans,
+                    "average_monthly_cost": _average_monthly_cost(rollup),
+                    "usage_histogram": rollup.usage_histogram,
+                }
+                for rollup in rollups
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class CheaperPlanRecommendations(ReplicaReadMixin, APIView):
+    """The user's plans with a cheaper plan of the same subscription, and the yearly savings"""
+
+    def get(self, request):
+        return Response(find_cheaper_plans(request.user), status=status.HTTP_200_OK)
@@ -0,0 +1,124 @@
+from django.http import JsonResponse
+from django.views import View
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+
+from .. import conditional, routers
+from ..authentication import CookieJWTAuthentication
+from ..models import Plan, UserPlan
+from ..serializers import PeriodQueryParamSerializer
+from ..services import (
+    PlanPortfolio,
+    SpendingCalculator,
+    AverageSpendingCalculator,
+    calculate_spending_by_category,
+    calculate_usage_by_category,
+)
+
+
+class AsyncAnalyticsView(View):
+    """
+    Base for async (ASGI) variants of the read-only analytics views.
+    DRF's APIView is sync only, so this handles cookie-JWT authentication itself.
+    """
+
+    http_method_names = ["get"]
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            auth = await CookieJWTAuthentication().aauthenticate(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({"detail": str(e.detail)}, status=401)
+
+        if auth is None:
+            return JsonResponse(
+                {"detail": "Authentication credentials were not provided."}, status=401
+            )
+
+        request.user, request.auth = auth
+        if not_modified := conditional.not_modified_response(request):
+            return not_modified
+
+        if await routers.ais_pinned(request.user.pk):
+            response = await super().dispatch(request, *args, **kwargs)
+        else:
+            with routers.replica_reads():
+                response = await super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            conditional.add_etag(response, request.etag)
+        return response
+
+
+class AsyncTotalSpendingPerPeriod(AsyncAnalyticsView):
+    """Async variant of TotalSpendingPerPeriod"""
+
+    async def get(self, request):
+        days_param = request.GET.get("days")
+
+        if days_param:
+            try:
+                days = int(days_param)
+                if days <= 0:
+                    raise ValueError
+            except ValueError:
+                return JsonResponse(
+                    {"error": "Days parameter must be a positive integer"}, status=400
+                )
+
+        portfolio = await PlanPortfolio.afrom_queryset(
+            UserPlan.objects.filter(user=request.user)
+        )
+        calculator = SpendingCalculator(portfolio)
+
+        if days_param:
+            total = calculator.calculate_custom_spending(days)
+            return JsonResponse({f"past_{days}_days": total})
+
+        totals = calculator.calculate_spending(SpendingCalculator.DEFAULT_PERIODS)
+        return JsonResponse(totals)
+
+
+class AsyncAverageSpendingPerPeriod(AsyncAnalyticsView):
+    """Async variant of AverageSpendingPerPeriod"""
+
+    async def get(self, request):
+        serializer = PeriodQueryParamSerializer(data=request.GET)
+        if not serializer.is_valid():
+            return JsonResponse({"error": str(serializer.errors)}, status=400)
+        period_param = serializer.validated_data.get("period", None)
+
+        # Determine target periods
+        if period_param:
+            target_periods = [(period_param, Plan.Period.get_label(period_param))]
+        else:
+            target_periods = Plan.Period.choices
+
+        portfolio = await PlanPortfolio.afrom_queryset(
+            UserPlan.objects.filter(user=request.user)
+        )
+        results = AverageSpendingCalculator(portfolio).calculate_averages(target_periods)
+
+        return JsonResponse(results)
+
+
+class AsyncSpendingByCategory(AsyncAnalyticsView):
+    """Async variant of SpendingByCategory"""
+
+    async def get(self, request):
+        portfolio = await PlanPortfolio.afrom_queryset(
+            UserPlan.objects.filter(user=request.user)
+        )
+
+        spending_data = calculate_spending_by_category(portfolio)
+        return JsonResponse(spending_data)
+
+
+class AsyncUsageByCategory(AsyncAnalyticsView):
+    """Async variant of UsageByCategory"""
+
+    async def get(self, request):
+        portfolio = await PlanPortfolio.afrom_queryset(
+            UserPlan.objects.filter(user=request.user)
+        )
+
+        usage_by_category = calculate_usage_by_category(portfolio)
+        return JsonResponse(usage_by_category)
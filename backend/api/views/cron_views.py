@@ -2,86 +2,99 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny
+from rest_framework.exceptions import ValidationError
 from rest_framework_simplejwt.authentication import JWTAuthentication
 
-import datetime
-from .. import screentime, notifications
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
 
-from ..models import User, UserPlan
+from .. import jobs, outbox, rollups
+
+from ..models import CronJob, NotificationEvent
+from ..serializers import CronJobSerializer
+
+
+class EnqueueCronJobView(APIView):
+    """Enqueues a chunked cron job and returns immediately with its id"""
 
-class UpdateView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [AllowAny]
+    kind = None
 
     def post(self, request):
-        users = User.objects.filter(allow_notifications=True)
-
-        today = datetime.datetime.today().date()
+        try:
+            chunk_size = self._get_chunk_size(request.data.get("chunk_size"))
+        except ValidationError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        for user in users:
-            user_plans = UserPlan.objects.filter(user=user)
+        job = jobs.enqueue_job(self.kind, chunk_size)
 
-            for user_plan in user_plans:
-                user_plan.update_payment_date()
-
-                if user_plan.payment_date - today <= datetime.timedelta(days=3):
-                    notifications.send_push_notification(
-                        "Upcoming payment",
-                        f"{user_plan.plan.subscription.name} is due at {user_plan.payment_date}",
-                        user.id,
-                    )
+        if jobs.get_setting("RUN_IN_PROCESS") and job.status == CronJob.Status.PENDING:
+            jobs.start_background_worker(job)
 
         return Response(
-            {"message": "Subscription payments updated and notifications sent."},
-            status=status.HTTP_200_OK,
+            {
+                "job_id": job.pk,
+                "status": job.status,
+                "status_url": reverse("cron-job-status", args=[job.pk]),
+            },
+            status=status.HTTP_202_ACCEPTED,
         )
 
+    def _get_chunk_size(self, value):
+        if value is None:
+            return None
+        try:
+            chunk_size = int(value)
+            if chunk_size <= 0:
+                raise ValueError
+            return chunk_size
+        except (ValueError, TypeError):
+            raise ValidationError("chunk_size must be a positive integer")
+
+
+class UpdateView(EnqueueCronJobView):
+    """Advances overdue payment dates and sends upcoming payment notifications"""
+
+    kind = CronJob.Kind.PAYMENT
+
+
+class UpdateUnusedView(EnqueueCronJobView):
+    """Refreshes usage scores from RescueTime and sends unused subscription notifications"""
+
+    kind = CronJob.Kind.UNUSED
+
+
+class DeliverNotificationsView(APIView):
+    """Starts delivering queued notifications in the background"""
 
-class UpdateUnusedView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [AllowAny]
 
     def post(self, request):
-        users = User.objects.exclude(api_key_encrypted__isnull=True)
-
-        for user in users:
-            api_key = user.api_key_encrypted
-
-            # Fetch active plans for the user
-            user_plans = UserPlan.objects.filter(
-                user=user, track_usage=True
-            ).select_related("plan__subscription")
-
-            # Fetch screen time data
-            start_date = (datetime.date.today() - datetime.timedelta(days=30)).isoformat()
-            end_date = datetime.date.today().isoformat()
-            df = screentime.fetch_data(api_key, start_date, end_date)
-
-            # Update usage scores
-            for user_plan in user_plans:
-                try:
-                    subscription_name = user_plan.plan.subscription.name
-                    user_plan.update_usage_score(subscription_name, df)
-                except Exception as e:
-                    print(f"Error processing {subscription_name}: {e}")
-
-            # Send notifications for unused subscriptions
-            if user.allow_notifications:
-                unused_threshold = user.unused_threshold
-
-                for user_plan in user_plans:
-                    subscription_name = user_plan.plan.subscription.name
-
-                    if user_plan.usage_score < unused_threshold:
-                        notifications.send_push_notification(
-                            "Unused Subscription",
-                            f"The subscription '{subscription_name}' is unused.",
-                            user.id,
-                        )
-                    # (Admin purposes) Display subscriptions after processing all user plans
-                    screentime.display_subscriptions(subscription_name, df)
+        pending = NotificationEvent.objects.filter(
+            status=NotificationEvent.Status.PENDING
+        ).count()
+        outbox.start_background_delivery(jobs.default_worker_id())
+        return Response({"pending": pending}, status=status.HTTP_202_ACCEPTED)
 
-        return Response(
-            {"message": "Subscription usage updated and notifications sent."},
-            status=status.HTTP_200_OK,
-        )
+
+class RebuildRollupsView(APIView):
+    """Starts refreshing the catalog rollups in the background (`full` rebuilds everything)"""
+
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        full = str(request.data.get("full", "")).lower() in ("1", "true")
+        rollups.start_background_rollups(full=full)
+        return Response({"full": full}, status=status.HTTP_202_ACCEPTED)
+
+
+class CronJobStatusView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [AllowAny]
+
+    def get(self, request, pk):
+        job = get_object_or_404(CronJob, pk=pk)
+        return Response(CronJobSerializer(job).data, status=status.HTTP_200_OK)
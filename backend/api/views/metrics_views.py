@@ -0,0 +1,30 @@
+import hmac
+
+from django.http import HttpResponse
+from django.views import View
+
+from .. import metrics
+
+
+class MetricsView(View):
+    """Prometheus scrape endpoint (plain text, so not a DRF view)"""
+
+    http_method_names = ["get"]
+
+    def get(self, request):
+        # Closed by default: the metrics reveal traffic and outbound usage
+        token = metrics.get_setting("TOKEN")
+        if token:
+            expected = f"Bearer {token}"
+            provided = request.headers.get("Authorization", "")
+            if not hmac.compare_digest(provided.encode(), expected.encode()):
+                return HttpResponse("Unauthorized", status=401, content_type="text/plain")
+        elif not metrics.get_setting("ALLOW_UNAUTHENTICATED"):
+            return HttpResponse(
+                "Set METRICS_TOKEN to enable /metrics", status=403, content_type="text/plain"
+            )
+
+        return HttpResponse(
+            metrics.registry.render(),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
@@ -3,7 +3,6 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
-from rest_framework.filters import OrderingFilter
 
 from django.db.models import (
     Q,
@@ -17,6 +16,10 @@ from decimal import Decimal, InvalidOperation
 
 from ..models import *
 from ..serializers import *
+from ..conditional import ConditionalGetMixin
+from ..fieldsets import SparseFieldsetMixin
+from ..routers import ReplicaReadMixin
+from ..money import daily_micros, to_cents
 
 from datetime import date, timedelta
 import datetime
@@ -28,12 +31,12 @@ class CustomPageNumberPagination(PageNumberPagination):
     max_page_size = 100
 
 
-class UserPlanView(viewsets.ModelViewSet):
+class UserPlanView(ConditionalGetMixin, SparseFieldsetMixin, viewsets.ModelViewSet):
     serializer_class = UserPlanSerializer
     pagination_class = CustomPageNumberPagination
-    filter_backends = [OrderingFilter]
-    ordering_fields = ["payment_date", "plan__name", "track_usage", "usage_score"]
-    ordering = ["-payment_date"]
+    # Ordering is validated and applied in get_queryset(), which also knows about "cost"
+    filter_backends = []
+    ordering = "-payment_date"
 
     def get_queryset(self):
         queryset = UserPlan.objects.filter(user=self.request.user)
@@ -44,8 +47,9 @@ class UserPlanView(viewsets.ModelViewSet):
 
         queryset = queryset.filter(filters)
 
-        # Annotate cost if period is specified
-        if params.get("period"):
+        # Annotate cost if period is specified (and cost is wanted)
+        fields = self.get_fields_param()
+        if params.get("period") and (fields is None or "cost" in fields):
             queryset = self._annotate_cost(queryset, params["period"])
 
         # Apply cost filters
@@ -56,9 +60,7 @@ class UserPlanView(viewsets.ModelViewSet):
         if ordering:
             queryset = queryset.order_by(ordering)
 
-        return queryset.select_related(
-            "plan", "plan__subscription", "plan__subscription__category"
-        )
+        return self.apply_fieldset(queryset)
 
     def _parse_and_validate_params(self, query_params):
         params = {}
@@ -78,6 +80,8 @@ class UserPlanView(viewsets.ModelViewSet):
 
         for param in ["cost_min", "cost_max"]:
             if value := query_params.get(param):
+                if not params.get("period"):
+                    raise ValidationError(f"Cannot filter by {param} without a period parameter")
                 try:
                     params[param] = Decimal(value)
                 except InvalidOperation:
@@ -100,9 +104,6 @@ class UserPlanView(viewsets.ModelViewSet):
             if ordering_field not in allowed_static_fields and ordering_field != "cost":
                 raise ValidationError(f"Invalid ordering field: {ordering_field}")
 
-            if ordering_field == "cost" and not params.get("period"):
-                raise ValidationError("Cannot order by 'cost' without a period parameter")
-
             params["ordering"] = ordering
         return params
 
@@ -110,7 +111,7 @@ class UserPlanView(viewsets.ModelViewSet):
         filters = Q()
 
         if category_id := params.get("category_id"):
-            filters &= Q(plan__subscription__category__id=category_id)
+            filters &= Q(category_id=category_id)
         if track_usage := params.get("track_usage", None):
             filters &= Q(track_usage=track_usage)
         if days := params.get("days_until_payment"):
@@ -132,17 +133,28 @@ class UserPlanView(viewsets.ModelViewSet):
         )
 
     def _apply_cost_filters(self, queryset, params):
+        # Compared as cost per day on the indexed column, so the bounds are converted
+        # once instead of normalizing every row's cost in SQL. They are rounded the same
+        # way as the stored costs, so a plan priced exactly at a bound matches it.
+        period = params.get("period")
         if cost_min := params.get("cost_min"):
-            queryset = queryset.filter(cost__gte=cost_min)
+            queryset = queryset.filter(
+                daily_cost_micros__gte=daily_micros(to_cents(cost_min), period)
+            )
         if cost_max := params.get("cost_max"):
-            queryset = queryset.filter(cost__lte=cost_max)
+            queryset = queryset.filter(
+                daily_cost_micros__lte=daily_micros(to_cents(cost_max), period)
+            )
         return queryset
 
     def _get_valid_ordering(self, params):
         ordering = params.get("ordering")
         if not ordering:
-            return None
+            return self.ordering
 
+        # The same order for any period, straight from the (user, daily_cost_micros) index
+        if ordering.lstrip("-") == "cost":
+            return ordering.replace("cost", "daily_cost_micros")
         return ordering
 
     def create(self, request):
@@ -209,7 +221,7 @@ class ToggleUsageView(APIView):
         return Response({"track_usage": user_plan.track_usage}, status=status.HTTP_200_OK)
 
 
-class SubscriptionView(viewsets.ModelViewSet):
+class SubscriptionView(SparseFieldsetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Subscription.objects.all()
     serializer_class = SubscriptionSerializer
 
@@ -221,7 +233,7 @@ class SubscriptionView(viewsets.ModelViewSet):
 
         queryset = queryset.filter(filters)
 
-        return queryset
+        return self.apply_fieldset(queryset)
 
     def _parse_and_validate_params(self, query_params):
         params = {}
@@ -262,11 +274,14 @@ class SubscriptionView(viewsets.ModelViewSet):
         return filters
 
 
-class PlanView(viewsets.ModelViewSet):
+class PlanView(SparseFieldsetMixin, viewsets.ModelViewSet):
     queryset = Plan.objects.all()
     serializer_class = PlanSerializer
 
+    def get_queryset(self):
+        return self.apply_fieldset(super().get_queryset())
+
 
-class CategoryView(viewsets.ModelViewSet):
+class CategoryView(ReplicaReadMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -6,6 +6,8 @@ from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework_simplejwt.tokens import RefreshToken, AccessToken
 from rest_framework_simplejwt.views import TokenRefreshView, TokenVerifyView
 
+from .. import user_cache
+from ..conditional import ConditionalGetMixin
 from ..serializers import (
     UserSettingsSerializer,
     UserProfileSerializer,
@@ -14,13 +16,13 @@ from ..serializers import (
 )
 
 
-class UserProfileView(APIView):
+class UserProfileView(ConditionalGetMixin, APIView):
     def get(self, request):
         serializer = UserProfileSerializer(request.user)
         return Response(serializer.data)
 
 
-class UserSettingsView(APIView):
+class UserSettingsView(ConditionalGetMixin, APIView):
     def get(self, request):
         serializer = UserSettingsSerializer(request.user)
         return Response(serializer.data)
@@ -141,6 +143,9 @@ class LogoutView(APIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
+        # The access token stays valid until it expires, only its cached user is dropped
+        user_cache.invalidate([request.user.pk])
+
         response = Response(
             {"message": "Successfully logged out!"}, status=status.HTTP_200_OK
         )
@@ -1,3 +1,4 @@
+import os
 from datetime import timedelta
 from pathlib import Path
 
@@ -35,12 +36,16 @@ INSTALLED_APPS = [
 AUTH_USER_MODEL = "api.User"
 
 MIDDLEWARE = [
+    "api.middleware.MetricsMiddleware",
+    "api.middleware.QueryInstrumentationMiddleware",
+    "api.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.middleware.DatabaseRoutingMiddleware",
     "api.middleware.TokenRefreshMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
@@ -73,11 +78,60 @@ WSGI_APPLICATION = "backend.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# SQLite tuning (see api/sqlite.py). "production" switches to WAL, so reads don't wait
+# for writers, makes transactions take the write lock up front and wait for it (instead of
+# failing with "database is locked" when upgrading), and keeps connections open between
+# requests. "development" keeps SQLite's defaults and is the default, so checkouts (and
+# the committed db.sqlite3) stay in rollback journal mode; deployments set
+# SQLITE_PROFILE=production.
+SQLITE_PROFILES = {
+    "development": {
+        "DATABASE": {},
+        "PRAGMAS": {"journal_mode": "delete"},
+    },
+    "production": {
+        "DATABASE": {
+            "CONN_MAX_AGE": 600,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {"transaction_mode": "IMMEDIATE"},
+        },
+        "PRAGMAS": {
+            "journal_mode": "wal",
+            "synchronous": "normal",  # with WAL, only a power loss can drop recent commits
+            "busy_timeout": 5000,  # ms
+            "cache_size": -20000,  # KiB per connection
+            "temp_store": "memory",
+            "mmap_size": 134217728,
+        },
+    },
+}
+
+SQLITE_PROFILE = os.getenv("SQLITE_PROFILE", "development")
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        **SQLITE_PROFILES[SQLITE_PROFILE]["DATABASE"],
+    }
+}
+
+# Optional read replica for analytics and catalog reads (see api/routers.py),
+# e.g. a copy of the primary kept up to date by litestream
+if os.getenv("DATABASE_REPLICA_NAME"):
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.getenv("DATABASE_REPLICA_NAME"),
+        "TEST": {"MIRROR": "default"},
+        **SQLITE_PROFILES[SQLITE_PROFILE]["DATABASE"],
     }
+
+DATABASE_ROUTERS = ["api.routers.PrimaryReplicaRouter"]
+
+DATABASE_ROUTING = {
+    "REPLICA": "replica",
+    # Seconds a user's reads stay on the primary after they write, covering replication lag
+    "REPLICATION_LAG": int(os.getenv("DATABASE_REPLICATION_LAG", 5)),
 }
 
 
@@ -128,6 +182,21 @@ REST_FRAMEWORK = {
         "api.authentication.CookieJWTAuthentication",
     ),
     "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    # orjson backed when installed (see api/renderers.py)
+    "DEFAULT_RENDERER_CLASSES": (
+        "api.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    "DEFAULT_PARSER_CLASSES": (
+        "api.renderers.FastJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+    ),
+}
+
+# Gzipped responses (see api.middleware.CompressionMiddleware)
+COMPRESSION = {
+    "MIN_SIZE": 1024,  # smaller responses are sent as is
 }
 
 SIMPLE_JWT = {
@@ -136,3 +205,65 @@ SIMPLE_JWT = {
     "ROTATE_REFRESH_TOKENS": True,
     "BLACKLIST_AFTER_ROTATION": True,
 }
+
+# Users looked up by CookieJWTAuthentication (see api/user_cache.py)
+AUTH_USER_CACHE = {
+    "ENABLED": True,
+    "TTL": 5,
+    "MAX_SIZE": 1024,
+    "SHARED_CACHE": None,  # set to a CACHES alias when running several workers
+}
+
+# Chunked cron jobs (see api/jobs.py)
+CRON_JOBS = {
+    "CHUNK_SIZE": 100,
+    "LEASE_SECONDS": 300,
+    "MAX_ATTEMPTS": 3,
+    "RUN_IN_PROCESS": True,
+}
+
+# Cron run reports (see api/profiling.py)
+CRON_PROFILING = {
+    "TRACE_MEMORY": False,
+    "PROFILE_DIR": None,
+}
+
+# Calls to external services (see api/outbound.py), overridable per host under "HOSTS"
+OUTBOUND = {
+    "CONNECT_TIMEOUT": 3.05,
+    "READ_TIMEOUT": 10,
+    "RETRIES": 2,
+    "BACKOFF": 0.5,
+    "FAILURE_THRESHOLD": 5,
+    "RESET_SECONDS": 30,
+    "RATE": 10,
+    "BURST": 20,
+    "HOSTS": {
+        "www.rescuetime.com": {"READ_TIMEOUT": 30},  # CSV exports can be slow
+    },
+}
+
+# Push notification outbox (see api/outbox.py and the deliver_notifications command)
+NOTIFICATIONS = {
+    "DIGEST_DELAY": 60,
+    "BATCH_SIZE": 2000,
+    "MAX_ATTEMPTS": 5,
+    "BACKOFF_SECONDS": 60,
+}
+
+# Per-request DB query counts and timings (see api.middleware.QueryInstrumentationMiddleware)
+QUERY_INSTRUMENTATION = {
+    "SAMPLE_RATE": 1.0 if DEBUG else 0.1,  # fraction of requests instrumented
+    "SLOW_REQUEST_MS": 500,  # requests slower than this are logged
+    "REPEATED_QUERY_THRESHOLD": 5,  # identical statements run this often are logged
+    "TOP_QUERIES": 5,
+}
+
+# Prometheus metrics served on /metrics (see api/metrics.py)
+METRICS = {
+    # Shared directory for multi-worker deployments (e.g. gunicorn), cleared on deploy
+    "MULTIPROCESS_DIR": os.getenv("METRICS_MULTIPROCESS_DIR"),
+    "FLUSH_INTERVAL": 5,
+    "TOKEN": os.getenv("METRICS_TOKEN"),  # required by /metrics unless ALLOW_UNAUTHENTICATED
+    "ALLOW_UNAUTHENTICATED": os.getenv("METRICS_ALLOW_UNAUTHENTICATED") == "True",
+}